@@ -0,0 +1,41 @@
+"""
+    Averaging u and v onto a 2000x2000 rho grid with
+    paegan.roms.roms.average_adjacents, against the threads and
+    np.vectorize(complex) it replaced.
+
+    python benchmarks/average.py
+"""
+import time
+import threading
+import numpy as np
+
+from paegan.roms import roms as rm
+
+def old(u, v):
+    t1 = threading.Thread(target=lambda: setattr(t1, 'data', 0.5 * (u[:, 0:-1] + u[:, 1:])))
+    t2 = threading.Thread(target=lambda: setattr(t2, 'data', (0.5 * (v.T[:, 0:-1] + v.T[:, 1:])).T))
+    t1.start(); t2.start()
+    t1.join(); t2.join()
+    return np.vectorize(complex)(t1.data[1:-1, :], t2.data[:, 1:-1])
+
+def new(u, v):
+    U = np.empty((u.shape[0] - 2, v.shape[1] - 2), dtype=complex)
+    rm.average_adjacents(u[1:-1, :], out=U.real)
+    rm.average_adjacents(v[:, 1:-1], True, out=U.imag)
+    return U
+
+def timed(f, *args):
+    s = time.time()
+    result = f(*args)
+    return result, time.time() - s
+
+if __name__ == "__main__":
+    rs = np.random.RandomState(5)
+    u = rs.normal(size=(2000, 1999))
+    v = rs.normal(size=(1999, 2000))
+
+    old_U, old_time = timed(old, u, v)
+    new_U, new_time = timed(new, u, v)
+    assert np.allclose(new_U, old_U)
+    print "threads and np.vectorize: %.3fs" % old_time
+    print "average_adjacents:        %.3fs" % new_time
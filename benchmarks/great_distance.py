@@ -0,0 +1,29 @@
+"""
+    Distances from every cell of a 100x100 regional model grid to one
+    point, with AsaGreatCircle.great_distance on the arrays against the
+    scalar solver run over each cell.
+
+    python benchmarks/great_distance.py
+"""
+import math
+import time
+import numpy as np
+
+from paegan.utils.asagreatcircle import AsaGreatCircle
+from paegan.external.greatcircle import GreatCircle
+
+if __name__ == "__main__":
+    lons, lats = np.meshgrid(np.linspace(-80, -60, 100), np.linspace(30, 45, 100))
+    f = (6378137.0 - 6356752.3142) / 6378137.0
+
+    s = time.time()
+    scalar = np.vectorize(GreatCircle.vinc_dist)(f, 6378137.0, np.radians(lats), np.radians(lons), math.radians(38.0), math.radians(-70.0))
+    scalar_time = time.time() - s
+
+    s = time.time()
+    result = AsaGreatCircle.great_distance(start_lats=lats, start_lons=lons, end_lats=38.0, end_lons=-70.0)
+    vector_time = time.time() - s
+
+    assert np.allclose(scalar[0], result['distance'], rtol=0, atol=0.001)
+    print "np.vectorize(GreatCircle.vinc_dist): %.3fs" % scalar_time
+    print "AsaGreatCircle.great_distance:       %.3fs" % vector_time
@@ -0,0 +1,180 @@
+import threading
+import collections
+import itertools
+import numpy as np
+
+from paegan.cdm.pool import read_lock
+from paegan.logger import logger
+
+# Size of the blocks of variables that aren't chunked on disk
+_block_bytes = 1024 * 1024
+
+def block_shape(ncvar, block_bytes=_block_bytes):
+    """
+        The shape of the blocks 'ncvar' is cached in.  Its chunk shape
+        when the file is chunked, otherwise blocks of about block_bytes
+        made of whole trailing axes, one index at a time along the
+        leading ones.
+    """
+    try:
+        chunking = ncvar.chunking()
+    except StandardError:
+        chunking = None
+    if chunking is not None and chunking != "contiguous":
+        return tuple(int(c) for c in chunking)
+
+    shape = [max(int(s), 1) for s in ncvar.shape]
+    blocks = [1] * len(shape)
+    size = np.dtype(ncvar.dtype).itemsize
+    for axis in reversed(range(len(shape))):
+        if size * shape[axis] <= block_bytes:
+            blocks[axis] = shape[axis]
+            size *= shape[axis]
+        else:
+            blocks[axis] = max(1, block_bytes // size)
+            break
+    return tuple(blocks)
+
+class BlockCache(object):
+    """
+        LRU cache of blocks of netCDF variables, keyed by
+        (resource, variable, block coordinates) and bounded by bytes.
+
+        Blocks line up with the chunks of the file when it is chunked
+        (see block_shape), so a block costs one chunk read.  Caching is
+        opt-in per dataset:
+
+        >> from paegan.cdm.cache import cache
+        >> dataset.block_cache = cache
+        >> dataset.get_values(...)
+        >> cache.hits, cache.misses
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self._lock = threading.RLock()
+        # key -> masked array, least recently used first
+        self._blocks = collections.OrderedDict()
+        self._max_bytes = max_bytes
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._blocks[key] = block
+            return block
+
+    def put(self, key, block):
+        nbytes = _nbytes(block)
+        if nbytes > self._max_bytes:
+            return
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self._nbytes -= _nbytes(old)
+            self._blocks[key] = block
+            self._nbytes += nbytes
+            self._evict()
+
+    def clear(self, resource=None):
+        """
+            Drop every block, or just those of 'resource'
+        """
+        with self._lock:
+            for key in self._blocks.keys():
+                if resource is None or key[0] == resource:
+                    self._nbytes -= _nbytes(self._blocks.pop(key))
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self):
+        while self._nbytes > self._max_bytes and len(self._blocks) > 0:
+            key, block = self._blocks.popitem(last=False)
+            self._nbytes -= _nbytes(block)
+            logger.debug("Evicted block %s from the cache" % str(key))
+
+    def get_max_bytes(self):
+        return self._max_bytes
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+    max_bytes = property(get_max_bytes, set_max_bytes)
+
+    def get_nbytes(self):
+        return self._nbytes
+    nbytes = property(get_nbytes, None)
+
+    def get_block_count(self):
+        return len(self._blocks)
+    block_count = property(get_block_count, None)
+
+def _nbytes(block):
+    nbytes = block.data.nbytes
+    if block.mask is not np.ma.nomask:
+        nbytes += block.mask.nbytes
+    return nbytes
+
+class CachedVariable(object):
+    """
+        Stands in for a netCDF4.Variable, serving reads of contiguous
+        hyperslabs out of a BlockCache.  Anything else is passed through
+        to the variable.
+    """
+
+    def __init__(self, cache, resource, name, ncvar):
+        self._cache = cache
+        self._resource = resource
+        self._name = name
+        self._ncvar = ncvar
+        self._blockshape = block_shape(ncvar)
+        self.ndim = ncvar.ndim
+        self.shape = ncvar.shape
+        self.dtype = ncvar.dtype
+        self.dimensions = ncvar.dimensions
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple) or len(key) != self.ndim or \
+           not all(isinstance(k, slice) and k.step in (None, 1) for k in key):
+            with read_lock:
+                return self._ncvar[key]
+
+        bounds = [k.indices(n)[:2] for k, n in zip(key, self.shape)]
+        if any(stop <= start for start, stop in bounds):
+            with read_lock:
+                return self._ncvar[key]
+
+        out = None
+        ranges = [range(start // b, (stop - 1) // b + 1) for (start, stop), b in zip(bounds, self._blockshape)]
+        for coords in itertools.product(*ranges):
+            block = self._block(coords)
+            src, dst = [], []
+            for c, b, (start, stop) in zip(coords, self._blockshape, bounds):
+                lo, hi = max(start, c * b), min(stop, (c + 1) * b)
+                src.append(slice(lo - c * b, hi - c * b))
+                dst.append(slice(lo - start, hi - start))
+            if out is None:
+                out = np.ma.masked_all([stop - start for start, stop in bounds], dtype=block.dtype)
+            out[tuple(dst)] = block[tuple(src)]
+        return out
+
+    def _block(self, coords):
+        key = (self._resource, self._name, coords)
+        block = self._cache.get(key)
+        if block is None:
+            with read_lock:
+                block = np.ma.asarray(self._ncvar[tuple(slice(c * b, min((c + 1) * b, n))
+                                                        for c, b, n in zip(coords, self._blockshape, self.shape))])
+            self._cache.put(key, block)
+        return block
+
+# The cache shared by every Dataset in this process that opts in
+cache = BlockCache()
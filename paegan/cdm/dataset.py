@@ -1,11 +1,19 @@
 import numpy as np
-import netCDF4, datetime, copy
-from paegan.cdm.timevar import Timevar
+import netCDF4, datetime, copy, itertools
+from paegan.cdm.timevar import Timevar, date2num, values2dates
 from paegan.cdm.depthvar import Depthvar
 from paegan.cdm.gridvar import Gridobj
 from paegan.cdm.variable import Coordinates as cachevar
 from paegan.cdm.variable import SubCoordinates as subs
+from paegan.cdm.variable import CoordinateInfo
+from paegan.cdm.pool import pool, locked, LockedHandle
+from paegan.cdm.search import search
+from paegan.cdm.cache import CachedVariable
+from paegan.cdm.cache import cache as _shared_cache
+from paegan.cdm.prefetch import Prefetcher
 from paegan.location4d import Location4D
+from paegan.roms.vertical import SCoordinate, is_s_coordinate
+from paegan.utils.asagreatcircle import AsaGreatCircle
 
 from paegan.logger import logger
 
@@ -56,39 +64,316 @@ _possibley = ["y", "Y",
            "lat_psi", "LAT_PSI",
           ]
 
-def _sub_by_nan(data, ind):
+def _raw_bounds(ncvar):
         """
-            Funtction to subset a dimension variable by replacing values
-            that do not appear in the index with np.nan, in order to
-            preserve the lazy data access on the full array's in the backend.
+            (min, max) of a coordinate variable, in its own units, read from
+            as little of it as possible.  In order: its actual_range
+            attribute (unpacked with scale_factor and add_offset if it is
+            stored packed), the two ends of a 1-D coordinate variable
+            (which CF requires to be monotonic), or else one pass over its
+            values.  valid_min and valid_max only bound what the values
+            may be, so aren't used.
         """
-        if len(ind) > 0:
-            xtmp = -1 * np.ones_like(data)
-            xtmp[ind[0]:ind[-1]+1] = ind
-            xbool = range(len(data)) != xtmp
-            data[xbool] = np.nan
-        else:
-            data = np.nan * np.ones_like(data)
-        return data
-        
-def _sub_by_nan2(data, ind):
-        """
-            Funtction to subset a dimension variable by replacing values
-            that do not appear in the index with np.nan, in order to
-            preserve the lazy data access on the full array's in the backend.
-        """
-        if (len(ind[0]) > 0) & (len(ind[1]) > 0):
-            xtmp = -1 * np.ones_like(data[1,:])
-            xtmp[ind[1][0]:ind[1][-1]+1] = ind[1]
-            xbool = range(len(data[1])) != xtmp
-            ytmp = -1 * np.ones_like(data[:,1])
-            ytmp[ind[0][0]:ind[0][-1]+1] = ind[0]
-            ybool = range(len(data[0])) != ytmp
-            data[ybool, xbool] = np.nan
+        attributes = ncvar.ncattrs()
+        if "actual_range" in attributes:
+            values = np.asarray(ncvar.actual_range)
+            packed = values.dtype == ncvar.dtype
+            values = values.astype(np.float64).ravel()
+            if packed and "scale_factor" in attributes:
+                values = values * ncvar.scale_factor
+            if packed and "add_offset" in attributes:
+                values = values + ncvar.add_offset
+            if values.size == 2 and not np.isnan(values).any():
+                return (values.min(), values.max())
+        if ncvar.ndim == 1 and ncvar.dimensions == (ncvar.name,) and ncvar.size > 0:
+            ends = np.ma.masked_invalid(np.ma.concatenate([np.ma.atleast_1d(ncvar[0]), np.ma.atleast_1d(ncvar[ncvar.size-1])]))
+            if ends.count() == 2:
+                return (ends.min(), ends.max())
+        values = np.ma.masked_invalid(ncvar[:])
+        return (values.min(), values.max())
+
+def _bounds_indexes(values, order):
+        """
+            Indexes of the smallest and largest of 'values', which are the
+            ends when they are monotonic ('order' as from search.monotonic)
+        """
+        if order == 1:
+            return 0, values.size - 1
+        elif order == -1:
+            return values.size - 1, 0
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isnan(values) == False
+        return (np.argmin(np.where(valid, values, np.inf)),
+                np.argmax(np.where(valid, values, -np.inf)))
+
+def _window(inds):
+        """
+            An array of indexes as a slice when they are one contiguous run,
+            so restricting an axis stays a view of its coordinate array
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        if inds.size > 0 and inds[-1] - inds[0] == inds.size - 1 and np.all(np.diff(inds) == 1):
+            return slice(int(inds[0]), int(inds[-1]) + 1)
+        return inds
+
+def _view(window):
+        """
+            Index for the part of an axis in 'window', where None is all of it
+        """
+        if window is None:
+            return slice(None)
+        return window
+
+def _within(window, local):
+        """
+            The window of the axis at the 'local' indexes found inside 'window'
+        """
+        local = np.asarray(local, dtype=np.int64)
+        if window is None:
+            return _window(local)
+        elif isinstance(window, slice):
+            return _window(local + window.start)
+        return _window(window[local])
+
+def _selected(window, size):
+        """
+            The indexes in 'window' along an axis of 'size'
+        """
+        return np.arange(size)[_view(window)]
+
+def _empty(window):
+        """
+            Whether 'window' (or any of a tuple of windows) selects nothing
+        """
+        if isinstance(window, tuple):
+            return any(_empty(w) for w in window)
+        elif window is None or isinstance(window, slice):
+            return False
+        return np.asarray(window).size == 0
+
+def _grid_view(data, rows, cols):
+        """
+            The (rows, cols) window of the last two axes of an array.  A
+            view unless both windows are scattered indexes.
+        """
+        rows, cols = _view(rows), _view(cols)
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            return data[..., rows, cols]
+        return data[(Ellipsis,) + np.ix_(rows, cols)]
+
+def _nearest_selected(values, window, target):
+        """
+            The window holding the index of the value in 'window' nearest to
+            target, which is empty if there is no such value
+        """
+        values = np.asarray(values[_view(window)], dtype=np.float64)
+        distance = np.abs(values - target)
+        if distance.size == 0 or np.isnan(distance).all():
+            return np.array([], dtype=np.int64)
+        return _within(window, [np.nanargmin(distance)])
+
+def _nearest_within(values, window, target, num=1):
+        """
+            The window of the values in 'window' within the num-th smallest
+            distance of target (all ties are kept)
+        """
+        values = np.asarray(values[_view(window)], dtype=np.float64)
+        if values.size == 0:
+            return np.array([], dtype=np.int64)
+        distance = np.abs(values - target)
+        distance = np.where(np.isnan(distance), np.inf, distance)
+        cutoff = np.sort(distance)[min(num, distance.size)-1]
+        return _within(window, np.where(distance <= cutoff)[0])
+
+def _search_within(values, window, targets, order=None):
+        """
+            The index (along the whole axis) of the value in 'window' nearest
+            to each of the targets.  'order' is the order of all of values.
+        """
+        if window is not None and not isinstance(window, slice):
+            order = None
+        local = search(values[_view(window)], targets, 'nearest', order)
+        return _selected(window, len(values))[local]
+
+# Distances from this many points to every grid point are worked out at once
+_point_block = 256
+
+def _nearest_flat(x, y, lats, lons):
+        """
+            The flat index into 'x' and 'y' of the grid point nearest to
+            each of the lats/lons, searched exhaustively
+        """
+        x, y = np.ravel(x), np.ravel(y)
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        flat = np.zeros(lats.size, dtype=np.int64)
+        for start in range(0, lats.size, _point_block):
+            block = slice(start, start + _point_block)
+            distance = AsaGreatCircle.great_distance(
+                start_lats=y[np.newaxis, :], start_lons=x[np.newaxis, :],
+                end_lats=lats[block, np.newaxis], end_lons=lons[block, np.newaxis])["distance"]
+            distance = np.where(np.isnan(distance), np.inf, distance)
+            flat[block] = np.argmin(distance, axis=1)
+        return flat
+
+# Bounding slabs up to this many times larger than the number of
+# points they hold are read whole and subset in memory.
+_point_slab_ratio = 16
+
+def _read_points(ncvar, indices):
+        """
+            Read the values at each row of 'indices' (npoints x ndim).
+
+            Points are grouped by all but their last two axes (time and depth
+            for a t,z,y,x variable) and each group is read as the single
+            hyperslab bounding it, if that slab isn't too sparse.  Otherwise
+            the group's points are read one at a time.
+        """
+        npoints, ndim = indices.shape
+        values = np.ma.masked_all((npoints,), dtype=ncvar.dtype)
+        if npoints == 0:
+            return values
+
+        shape = ncvar.shape
+        flat, inverse = np.unique(np.ravel_multi_index(tuple(indices.T), shape), return_inverse=True)
+        unique = np.column_stack(np.unravel_index(flat, shape))
+        unique_values = np.ma.masked_all((flat.size,), dtype=ncvar.dtype)
+
+        lead = max(ndim - 2, 0)
+        if lead > 0:
+            keys, groups = np.unique(np.ravel_multi_index(tuple(unique[:, :lead].T), shape[:lead]), return_inverse=True)
+            ngroups = keys.size
         else:
-            data = np.nan * np.ones_like(data)
-        return data
-        
+            groups = np.zeros(flat.size, dtype=np.int64)
+            ngroups = 1
+
+        for g in range(ngroups):
+            members = np.flatnonzero(groups == g)
+            rows = unique[members]
+            lo = rows.min(axis=0)
+            hi = rows.max(axis=0) + 1
+            if np.prod(hi - lo) <= _point_slab_ratio * members.size:
+                slab = np.ma.asarray(ncvar[tuple(slice(l, h) for l, h in zip(lo, hi))])
+                unique_values[members] = slab[tuple((rows - lo).T)]
+            else:
+                for m, row in zip(members, rows):
+                    unique_values[m] = ncvar[tuple(slice(r, r + 1) for r in row)].ravel()[0]
+
+        values[:] = unique_values[inverse]
+        return values
+
+# An axis whose requested indexes fill at least 1/_slab_ratio of the
+# range they span is read as that one range and subset in memory,
+# rather than as one read per contiguous run.
+_slab_ratio = 4
+# The most reads a single request is split into.  Past this, the axes
+# with the most runs are read as their bounding range instead.
+_max_reads = 64
+
+def _index_runs(inds):
+        """
+            The contiguous runs in sorted, unique indexes, as slices
+        """
+        breaks = np.flatnonzero(np.diff(inds) != 1) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [inds.size]))
+        return [slice(int(inds[s]), int(inds[e-1]) + 1) for s, e in zip(starts, ends)]
+
+def _read_hyperslabs(ncvar, indices, slab_ratio=_slab_ratio, max_reads=_max_reads):
+        """
+            Read the orthogonal selection 'indices' (an array of indexes for
+            each dimension) of ncvar as a few contiguous hyperslabs.
+
+            The indexes of each axis are sorted, de-duplicated, and split
+            into contiguous runs, or taken as their bounding range when the
+            runs fill enough of it (see _slab_ratio).  Each combination of
+            runs is one read, placed into the result.  Anything other than
+            one array per dimension is passed straight to netCDF4.
+        """
+        indices = [np.asarray(inds) for inds in indices]
+        if len(indices) != ncvar.ndim or any(inds.ndim != 1 or inds.size == 0 for inds in indices):
+            return ncvar[tuple(indices)]
+
+        uniques, inverses, runs = [], [], []
+        for inds in indices:
+            unique, inverse = np.unique(inds.astype(np.int64), return_inverse=True)
+            uniques.append(unique)
+            inverses.append(inverse)
+            if unique[-1] - unique[0] + 1 <= slab_ratio * unique.size:
+                runs.append([slice(int(unique[0]), int(unique[-1]) + 1)])
+            else:
+                runs.append(_index_runs(unique))
+        while np.prod([len(r) for r in runs]) > max_reads:
+            axis = np.argmax([len(r) for r in runs])
+            runs[axis] = [slice(runs[axis][0].start, runs[axis][-1].stop)]
+
+        out = None
+        for block in itertools.product(*runs):
+            data = np.ma.asarray(ncvar[block])
+            src, dst = [], []
+            for unique, sl in zip(uniques, block):
+                lo, hi = np.searchsorted(unique, [sl.start, sl.stop])
+                dst.append(slice(lo, hi))
+                src.append(unique[lo:hi] - sl.start)
+            if any(inds.size != data.shape[axis] for axis, inds in enumerate(src)):
+                # A bounding range holding indexes that weren't asked for
+                data = data[np.ix_(*src)]
+            if out is None:
+                out = np.ma.masked_all([unique.size for unique in uniques], dtype=data.dtype)
+            out[tuple(dst)] = data
+
+        if all(inverse.size == unique.size for inverse, unique in zip(inverses, uniques)) and \
+           all(np.all(inds[1:] > inds[:-1]) for inds in indices):
+            return out
+        return out[np.ix_(*inverses)]
+
+# The most bytes one read of an ncell variable may span.  Selections of
+# nodes spread over a larger range are read in chunks of nodes.
+_max_read_bytes = 32 * 1024 * 1024
+
+def _read_chunked(ncvar, indices, axis, slab_ratio=_slab_ratio, max_bytes=_max_read_bytes):
+        """
+            Read the orthogonal selection 'indices' of ncvar, a chunk of
+            'axis' at a time.
+
+            Each chunk is the run of selected indexes along 'axis' whose
+            range, across what is selected of the other axes, spans at most
+            max_bytes.  Chunks are read with _read_hyperslabs, so a scattered
+            selection on a large axis (the nodes of a mesh) never reads
+            more than max_bytes at once, and never reads the whole axis
+            unless asked for all of it.
+        """
+        indices = [np.asarray(inds) for inds in indices]
+        if len(indices) != ncvar.ndim or any(inds.ndim != 1 or inds.size == 0 for inds in indices):
+            return ncvar[tuple(indices)]
+
+        unique, inverse = np.unique(indices[axis].astype(np.int64), return_inverse=True)
+        itemsize = np.dtype(ncvar.dtype).itemsize
+        for i, inds in enumerate(indices):
+            if i != axis:
+                itemsize *= int(inds.max() - inds.min() + 1)
+        span = max(1, max_bytes // max(itemsize, 1))
+
+        out = None
+        start = 0
+        while start < unique.size:
+            stop = int(np.searchsorted(unique, unique[start] + span))
+            chunk = list(indices)
+            chunk[axis] = unique[start:stop]
+            data = _read_hyperslabs(ncvar, chunk, slab_ratio)
+            if out is None:
+                shape = list(data.shape)
+                shape[axis] = unique.size
+                out = np.ma.masked_all(shape, dtype=data.dtype)
+            where = [slice(None)] * len(shape)
+            where[axis] = slice(start, stop)
+            out[tuple(where)] = data
+            start = stop
+
+        if inverse.size == unique.size and np.all(indices[axis][1:] > indices[axis][:-1]):
+            return out
+        return out.take(inverse, axis=axis)
+
 class CommonDataset(object):
 
     @staticmethod
@@ -107,23 +392,34 @@ class CommonDataset(object):
 
         nc = None
         filename = None
+        pooled = False
 
         if isinstance(ncfile, str):
             ncfile = unicode(ncfile.strip())
 
+        if isinstance(ncfile, Dataset):
+            # Passed in paegan Dataset object
+            if ncfile._pooled:
+                ncfile = ncfile._filename
+            else:
+                nc = ncfile.nc
+                filename = ncfile._filename
+
         if isinstance(ncfile, unicode):
             try:
-                nc = netCDF4.Dataset(ncfile)
+                nc = pool.acquire(ncfile)
                 filename = ncfile
+                pooled = True
             except StandardError:
                 logger.error(ncfile)
                 raise
-        elif isinstance(ncfile, Dataset):
-            # Passed in paegan Dataset object
-            nc = ncfile.nc
-        elif isinstance(ncile, netCDF4.Dataset):
+        elif isinstance(ncfile, (netCDF4.Dataset, LockedHandle)):
             # Passed in a netCDF4 Dataset object
-            nc = ncfile
+            nc = locked(ncfile)
+            try:
+                filename = nc.filepath()
+            except StandardError:
+                filename = None
 
         datasettype = kwargs.get('dataset_type', None)
         
@@ -156,29 +452,43 @@ class CommonDataset(object):
                             datasettype = "ncell"
                     else:
                         datasettype = "ncell"
-        nc.close()
 
-        # Return appropriate dataset subclass based on datasettype
+        # Return appropriate dataset subclass based on datasettype.
+        # Pooled handles are picked up from the pool, others are handed
+        # over, so the resource is only opened once either way.
+        if pooled:
+            nc = None
         if datasettype == 'ncell':
             dataobj = NCellDataset(filename, datasettype,
-                zname=zname, tname=tname, xname=xname, yname=yname)
+                zname=zname, tname=tname, xname=xname, yname=yname, nc=nc)
         elif datasettype == 'rgrid':
             dataobj = RGridDataset(filename, datasettype,
-                zname=zname, tname=tname, xname=xname, yname=yname)
+                zname=zname, tname=tname, xname=xname, yname=yname, nc=nc)
         elif datasettype == 'cgrid':
             dataobj = CGridDataset(filename, datasettype,
-                zname=zname, tname=tname, xname=xname, yname=yname)
+                zname=zname, tname=tname, xname=xname, yname=yname, nc=nc)
         else:
             dataobj = None
+        if pooled:
+            pool.release(filename)
 
         return dataobj
     
 
 class Dataset(object):
     def __init__(self, filename, datasettype, xname='lon', yname='lat',
-        zname='z', tname='time'):
+        zname='z', tname='time', nc=None):
         self.nc = None
+        self._pooled = False
         self._coordcache = dict()
+        self._coordinfo = dict()
+        # Restrictions queued up by the restrict_* and nearest_* methods,
+        # resolved per variable when data is asked for.
+        self._plan = []
+        self._resolved = dict()
+        self._slab_ratio = _slab_ratio
+        self._block_cache = None
+        self._prefetcher = None
         self._filename = filename
         self._datasettype = datasettype
         
@@ -196,7 +506,12 @@ class Dataset(object):
         if tname not in self._possiblet:
             self._possiblet.append(tname)
 
-        self.opennc()
+        if nc is None:
+            self.opennc()
+        else:
+            # An open handle that isn't managed by the pool
+            self.nc = locked(nc)
+            self.metadata = self.nc.__dict__
         self._current_variables = list(self.nc.variables.keys())
         
     def _copy(self):
@@ -232,15 +547,109 @@ class Dataset(object):
         
     def get_xyind_from_point(self, var, point, **kwargs):
         raise NotImplementedError
-        
+
+    def get_xyind_at_points(self, var, lats, lons, xy=None):
+        raise NotImplementedError
+
+    def get_slab_ratio(self):
+        return self._slab_ratio
+    def set_slab_ratio(self, slab_ratio):
+        """
+            Axes of a request whose indexes fill at least 1/slab_ratio of
+            the range they span are read as that range.  Larger values mean
+            fewer, bigger reads.
+        """
+        self._slab_ratio = slab_ratio
+    slab_ratio = property(get_slab_ratio, set_slab_ratio)
+
+    def get_block_cache(self):
+        return self._block_cache
+    def set_block_cache(self, block_cache):
+        """
+            Serve reads of data out of a paegan.cdm.cache.BlockCache, or
+            None (the default) to always read from the file
+        """
+        self._block_cache = block_cache
+    block_cache = property(get_block_cache, set_block_cache)
+
+    def _read_var(self, var):
+        """
+            The variable to read 'var' through, cached if a block cache is set
+        """
+        ncvar = self.nc.variables[var]
+        if self._block_cache is None:
+            return ncvar
+        resource = self._filename
+        if resource is None:
+            resource = id(self.nc)
+        return CachedVariable(self._block_cache, resource, var, ncvar)
+
+    def start_prefetch(self, depth=1, max_bytes=64 * 1024 * 1024):
+        """
+            Read ahead along time.  Once get_values is stepping a variable
+            forward through time, the next 'depth' steps are read on a
+            background thread into the block cache (the shared one, if
+            none is set), with at most 'max_bytes' queued up at once.
+            The reads go through a handle of their own, so datasets that
+            weren't opened from a filename or url can't be prefetched.
+            Both handles are only used while holding read_lock (see
+            paegan.cdm.pool), so variables taken from a netCDF4.Dataset
+            opened some other way shouldn't be read meanwhile.
+        """
+        self.stop_prefetch()
+        if self._filename is None:
+            logger.warn("Not prefetching, the dataset has no filename to open another handle of")
+            return
+        if self._block_cache is None:
+            self._block_cache = _shared_cache
+        self._prefetcher = Prefetcher(self, depth=depth, max_bytes=max_bytes)
+
+    def cancel_prefetch(self):
+        """
+            Drop the prefetches that haven't been read yet
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.cancel()
+
+    def stop_prefetch(self):
+        if self._prefetcher is not None:
+            self._prefetcher.stop(wait=True)
+            self._prefetcher = None
+
     def closenc(self):
+        self.stop_prefetch()
         self.metadata = None
-        self.nc.close()
+        if self._pooled:
+            # Other copies may still be using the handle
+            pool.release(self._filename)
+            self._pooled = False
+        else:
+            self.nc.close()
         self.nc = None
         
     def opennc(self):
-        self.nc = netCDF4.Dataset(self._filename)
+        self.nc = pool.acquire(self._filename)
+        self._pooled = True
         self.metadata = self.nc.__dict__
+
+    def __del__(self):
+        try:
+            if self._prefetcher is not None:
+                self._prefetcher.stop()
+            if self._pooled:
+                pool.release(self._filename)
+                self._pooled = False
+        except StandardError:
+            pass
+
+    def _shared_nc(self):
+        """
+            The handle a copy of this dataset should be given, None if the
+            copy can pick it up from the pool.
+        """
+        if self._pooled:
+            return None
+        return self.nc
     
     def gettimestep(self, var=None):
         assert var in self._current_variables
@@ -248,32 +657,82 @@ class Dataset(object):
         return time[np.isnan(time)==False].timestep
     
     def gettimebounds(self, var=None, **kwargs):
+        """
+            (first, last) datetimes of var's time.  Only two values are
+            made into datetimes, and if the time hasn't been restricted or
+            read yet, only the metadata (or a value or two) is read.
+        """
         assert var in self._current_variables
+        tinds = self._resolve(var)["time"]
+        names = self.get_coord_names(var)
+        if names["tname"] is None:
+            return None
+        ncvar = self.nc.variables[names["tname"]]
+        if tinds is None and not self._incache(var, "time") and ncvar.ndim == 1:
+            bounds = _raw_bounds(ncvar)
+            if "units" in kwargs:
+                u = kwargs.get("units")
+                return (netCDF4.num2date(bounds[0], units=u), netCDF4.num2date(bounds[1], units=u))
+            return tuple(values2dates(bounds, ncvar.units))
+
         time = self.gettimevar(var)
+        order = time.order
+        if tinds is not None:
+            time = time[tinds]
+        first, last = _bounds_indexes(time.datenum, order)
         if "units" in kwargs:
             u = kwargs.get("units")
-            bounds = (netCDF4.num2date(np.nanmin(time[np.isnan(time)==False]),units=u),
-                      netCDF4.num2date(np.nanmax(time[np.isnan(time)==False]),units=u))
+            bounds = (netCDF4.num2date(time[first],units=u),
+                      netCDF4.num2date(time[last],units=u))
         else:
-            bounds = (np.nanmin(time[np.isnan(time)==False].dates), np.nanmax(time[np.isnan(time)==False].dates))
+            bounds = tuple(time[[first, last]].dates)
         return bounds
 
     def getdepthbounds(self, var=None, **kwargs):
+        """
+            (min, max) of var's depths, in meters with units="m".  If the
+            depths haven't been restricted or read yet, only the metadata
+            (or a value or two) is read.
+        """
         assert var in self._current_variables
+        if "units" in kwargs and kwargs["units"] != "m":
+            return ()
+        levels = self.getzlevels(var)
+        if levels is not None:
+            return self._level_bounds(var, levels, self._resolve(var))
+        zinds = self._resolve(var)["z"]
+        names = self.get_coord_names(var)
+        if names["zname"] is None:
+            return None
+        ncvar = self.nc.variables[names["zname"]]
+        if zinds is None and not self._incache(var, "z") and ncvar.ndim == 1:
+            bounds = _raw_bounds(ncvar)
+            if "units" in kwargs:
+                try:
+                    factor = Depthvar.meters_per_unit(ncvar.units)
+                except AttributeError:
+                    factor = None
+                if factor is None:
+                    factor = 1
+                bounds = (bounds[0] * factor, bounds[1] * factor)
+            return bounds
+
         depths = self.getdepthvar(var)
+        order = depths.order
         if "units" in kwargs:
-            if kwargs["units"] == "m":
-                bounds = (np.nanmin(depths.get_m), np.nanmax(depths.get_m))
-            else:
-                bounds = ()
-        else:
-            bounds = (np.nanmin(depths), np.nanmax(depths))
-        return bounds
+            depths = depths._converted('meters')
+        depths = np.asarray(depths)[_view(zinds)]
+        first, last = _bounds_indexes(depths, order)
+        return (depths[first], depths[last])
     
     def getbbox(self, var=None, **kwargs):
         assert var in self._current_variables
         grid = self.getgridobj(var)
-        return grid.bbox
+        xy = self._resolve(var)["xy"]
+        if xy is None:
+            return grid.bbox
+        x, y = self._xy_values(var, xy)
+        return (np.nanmin(x), np.nanmin(y), np.nanmax(x), np.nanmax(y))
         
     def getboundingpolygon(self, var=None, **kwargs):
         assert var in self._current_variables
@@ -285,6 +744,12 @@ class Dataset(object):
         test = var in self._coordcache
         return test
 
+    def _incache(self, var, name):
+        """
+            Whether var's "time", "z" or "xy" coordinate has been read
+        """
+        return self._checkcache(var) and getattr(self._coordcache[var], name) is not None
+
     def gettimevar(self, var=None, use_cache=True):
         #return self._timevar
         assert var in self._current_variables
@@ -294,9 +759,9 @@ class Dataset(object):
                 timevar = self._coordcache[var].time
             else:
                 self._coordcache[var] = cachevar()
-        if timevar == None:
+        if timevar is None:
             names = self.get_coord_names(var)
-            if names['tname'] != None:
+            if names['tname'] is not None:
                 timevar = Timevar(self.nc, names["tname"])
             else:
                 timevar = None
@@ -313,9 +778,9 @@ class Dataset(object):
                 depthvar = self._coordcache[var].z
             else:
                 self._coordcache[var] = cachevar()
-        if depthvar == None:
+        if depthvar is None:
             names = self.get_coord_names(var)
-            if names['zname'] != None:
+            if names['zname'] is not None:
                 depthvar = Depthvar(self.nc, names["zname"])
             else:
                 depthvar = None
@@ -323,6 +788,16 @@ class Dataset(object):
                 self._coordcache[var].add_z(depthvar)
         return depthvar
         
+    def getzlevels(self, var=None):
+        """
+            The SCoordinate (paegan.roms.vertical) of var's depth axis when
+            it is a ROMS s-coordinate, whose values are fractions of the
+            water column rather than depths.  None otherwise; only
+            curvilinear grids have them.
+        """
+        assert var in self._current_variables
+        return None
+
     def getgridobj(self, var=None):
         #return self._gridobj
         assert var in self._current_variables
@@ -331,9 +806,9 @@ class Dataset(object):
             gridobj = self._coordcache[var].xy
         else:
             self._coordcache[var] = cachevar()
-        if gridobj == None:
+        if gridobj is None:
             names = self.get_coord_names(var)
-            if names['xname'] != None and names['yname'] !=None:
+            if names['xname'] is not None and names['yname'] is not None:
                 gridobj = Gridobj(self.nc, names["xname"], 
                    names["yname"])
             else:
@@ -345,14 +820,23 @@ class Dataset(object):
         assert var in self._current_variables
         time = self.gettimevar(var, use_cache)
         if convert:
+            # Compare in the variable's own units
             bounds = netCDF4.date2num(bounds, time._units + " since " + time.origin.isoformat())
-        inds = np.where(np.logical_and(time.dates >= bounds[0].replace(tzinfo=time.dates[0].tzinfo), time.dates <= bounds[1].replace(tzinfo=time.dates[0].tzinfo)))
+            values = np.asarray(time)
+        else:
+            bounds = time.datenum_of(bounds)
+            values = time.datenum
+        inds = np.where(np.logical_and(values >= bounds[0], values <= bounds[1]))
         return inds
     
     def get_zind_from_bounds(self, var, bounds, use_cache=True):
         assert var in self._current_variables
-        depths = self.getdepthvar(var, use_cache)
-        inds = np.where(np.logical_and(depths >= bounds[0], depths <= bounds[1]))
+        levels = self.getzlevels(var)
+        if levels is not None:
+            window = self._apply_steps(var, {"time":None, "z":None, "xy":None}, [("z", "bounds", bounds)])["z"]
+            return (_selected(window, levels.size),)
+        meters = self.getdepthvar(var, use_cache)._converted('meters')
+        inds = np.where(np.logical_and(meters >= bounds[0], meters <= bounds[1]))
         return inds
         
     def get_nearest_tind(self, var, point, use_cache=True):
@@ -362,6 +846,14 @@ class Dataset(object):
         
     def get_nearest_zind(self, var, point, use_cache=True):
         assert var in self._current_variables
+        levels = self.getzlevels(var)
+        if levels is not None:
+            # The levels of the water column nearest to the point
+            steps = [("xy", "nearest", (point, 1)), ("z", "nearest", point.depth)]
+            if point.time is not None:
+                steps.insert(0, ("time", "nearest", point.time))
+            window = self._apply_steps(var, {"time":None, "z":None, "xy":None}, steps)["z"]
+            return _selected(window, levels.size)
         depths = self.getdepthvar(var, use_cache)
         return depths.nearest_index(point.depth)
         
@@ -381,6 +873,29 @@ class Dataset(object):
     
     def get_coord_names(self, var=None, **kwargs):
         assert var in self._current_variables
+        if len(set(kwargs) & set(["xname", "yname", "zname", "tname"])) > 0:
+            return self._find_coord_names(var, **kwargs)
+        return dict(self._get_coordinfo(var).names)
+
+    def _get_coordinfo(self, var):
+        """
+            The CoordinateInfo record of 'var', resolved on first use
+            and shared with the copies made from this dataset.
+        """
+        info = self._coordinfo.get(var, None)
+        if info is None:
+            names = self._find_coord_names(var)
+            dims = self.nc.variables[var].dimensions
+            positions = dict()
+            for common_name, i in (("time", "tname"), ("z", "zname"), ("x", "xname"), ("y", "yname")):
+                positions[common_name] = None
+                if names[i] is not None:
+                    positions[common_name] = [dims.index(cdim) for cdim in self.nc.variables[names[i]].dimensions if cdim in dims]
+            info = CoordinateInfo(names, positions)
+            self._coordinfo[var] = info
+        return info
+
+    def _find_coord_names(self, var, **kwargs):
         ncvar = self.nc.variables[var]
         try:
             coordinates = ncvar.coordinates.split()
@@ -431,7 +946,7 @@ class Dataset(object):
         total = []
         for i in names:
             name = names[i]
-            if name != None:
+            if name is not None:
                 cdims = self.nc.variables[name].dimensions
                 for cdim in cdims:
                     try:
@@ -456,7 +971,7 @@ class Dataset(object):
                         name2 = "tname"
                     else:
                         name2 = None
-                    if name2 != None:
+                    if name2 is not None:
                         names[name2] = missing_dim
         # Need to add next check if there are any dims left
         # to find variables with different names that use soley
@@ -480,7 +995,7 @@ class Dataset(object):
     def get_varname_from_stdname(self, standard_name=None,
         match=None):
         var_matches = []
-        if match == None:
+        if match is None:
             for var in self._current_variables:
                 try:
                     sn = self.nc.variables[var].standard_name
@@ -503,25 +1018,25 @@ class Dataset(object):
         coord_dict = self.get_coord_dict(var)
         names = self.get_coord_names(var)
         x, y, z, time = None, None, None, None
-        if names['tname'] != None:
+        if names['tname'] is not None:
             #tname = names['tname']
-            if timebounds != None:
+            if timebounds is not None:
                 timeinds = self.get_tind_from_bounds(var, timebounds)
             time = coord_dict['time'][timeinds[0]:timeinds[-1]+1]
-        if names['zname'] != None:
+        if names['zname'] is not None:
             #zname = names['zname']
-            if zbounds != None:
+            if zbounds is not None:
                 zinds = self.get_zind_from_bounds(var, zbounds)
             z = coord_dict['z'][zinds[0]:zinds[-1]+1]
         xinds, yinds = self.get_xyind_from_bbox(var, bbox)
         xy = coord_dict['xy']
-        if names['xname'] != None:
+        if names['xname'] is not None:
             #xname = names['xname']
             if len(xy._xarray.shape) == 2:
                 x = xy._xarray[xinds[0][0]:xinds[0][-1]+1, xinds[1][0]:xinds[1][-1]+1]
             elif len(xy.xarray.shape) == 1:
                 x = xy._xarray[np.squeeze(xinds)]
-        if names['yname'] != None:
+        if names['yname'] is not None:
             #yname = names['yname']
             if len(xy._yarray.shape) == 2:
                 y = xy._yarray[yinds[0][0]:yinds[0][-1]+1, yinds[1][0]:yinds[1][-1]+1]
@@ -536,78 +1051,54 @@ class Dataset(object):
         
         Get smallest chunck of data that encompasses the 4-d
         bounding box limits of the data completely.
-        
+
+        The restrictions queued up on this dataset by the restrict_*
+        and nearest_* methods are resolved here, and any bounds or
+        point passed in are applied on top of them.
         
         """
         assert var in self._current_variables
         ncvar = self.nc.variables[var]
-        names = self.get_coord_names(var)
-        # find how the shapes match up to var
-        # (should i use dim names or just sizes to figure out?)
-        # I'm going to use dim names
-        dims = ncvar.dimensions
         ndim = ncvar.ndim
-        shape = ncvar.shape
-        positions = dict()
-        total = []
-        for i in names:
-            name = names[i]
-            if i == "tname":
-                common_name = "time"
-            elif i == "zname":
-                common_name = "z"
-            elif i == "xname":
-                common_name = "x"
-            elif i == "yname":
-                common_name = "y"
-            else:
-                common_name = None
-            if common_name != None:
-                positions[common_name] = None
-                if name != None:
-                    positions[common_name] = []
-                    cdims = self.nc.variables[name].dimensions
-                    for cdim in cdims:
-                        try:
-                            positions[common_name].append(dims.index(cdim))
-                        except StandardError:
-                            pass
-
-        if positions["time"] != None:
-            if timebounds != None:
-                tinds = self.get_tind_from_bounds(var, timebounds)
-            else:
-                if timeinds == None:
-                    if point != None:
-                        tinds = np.asarray([self.get_nearest_tind(var, point)])
-                    else:
-                        tinds = np.arange(0, ncvar.shape[positions["time"]]+1)
-                else:
-                    tinds = timeinds
-        if positions["z"] != None:
-            if zbounds != None:
-                zinds = self.get_zind_from_bounds(var, zbounds)
-            else:
-                if zinds == None:
-                    if point != None:
-                        zinds = np.asarray([self.get_nearest_zind(var, point)])
-                    else:
-                        zinds = np.arange(0, ncvar.shape[positions["z"]]+1)
-                else:
-                    pass
-        if bbox != None:
-            xinds, yinds = self.get_xyind_from_bbox(var, bbox)
-        else:
-            if point != None:
-                num = kwargs.get("num", 1)
-                xinds, yinds = self.get_xyind_from_point(var, point, num=num)
+        positions = self._get_positions(var)
+
+        steps = []
+        if timebounds is not None:
+            steps.append(("time", "bounds", timebounds))
+        if zbounds is not None:
+            steps.append(("z", "bounds", zbounds))
+        if bbox is not None:
+            steps.append(("xy", "bbox", bbox))
+        if point is not None:
+            if timebounds is None and timeinds is None and point.time is not None:
+                steps.append(("time", "nearest", point.time))
+            if zbounds is None and zinds is None and point.depth is not None:
+                steps.append(("z", "nearest", point.depth))
+            if bbox is None:
+                steps.append(("xy", "nearest", (point, kwargs.get("num", 1))))
+        selection = self._resolve(var, steps)
+
+        # get t inds, z inds, xy inds
+        # tinds = [[1,],]
+        # zinds = [[1,],]
+        # xinds = [[50,], [50,]]
+        # yinds = [[50,], [50,]]
+        if positions["time"] is not None:
+            if timebounds is None and timeinds is not None:
+                tinds = timeinds
             else:
-                xinds = [np.arange(0, ncvar.shape[pos]+1) for pos in positions["x"]]
-                yinds = [np.arange(0, ncvar.shape[pos]+1) for pos in positions["y"]]
+                tinds = [_selected(selection["time"], ncvar.shape[positions["time"][0]])]
+        if positions["z"] is not None:
+            if zbounds is not None or zinds is None:
+                zinds = [_selected(selection["z"], ncvar.shape[positions["z"][0]])]
+        if positions["x"] is not None and positions["y"] is not None:
+            xinds, yinds = self._xy_indices(var, selection["xy"])
 
+        # Now take time inds, z inds, x and y inds and put them 
+        # into the request in the right places:
         indices = [None for i in range(ndim)]
         for name in positions:
-            if positions[name] != None:
+            if positions[name] is not None:
                 if name == "time":
                     for i,position in enumerate(positions[name]):
                         indices[position] = tinds[i] 
@@ -620,6 +1111,11 @@ class Dataset(object):
                 elif name == "x":
                     for i,position in enumerate(positions[name]):
                         indices[position] = xinds[i]
+
+        # Any other dimensions are taken whole
+        for position in range(ndim):
+            if indices[position] is None:
+                indices[position] = np.arange(ncvar.shape[position])
         
         return indices
     
@@ -630,108 +1126,131 @@ class Dataset(object):
         
         Get smallest chunck of data that encompasses the 4-d
         bounding box limits of the data completely.
-        
+
+        Nothing is read until this is called; any restrictions
+        queued up on the dataset are resolved into indices here
+        (see get_indices) and the data is read in one request.
         
         """
         assert var in self._current_variables
-        ncvar = self.nc.variables[var]
-        names = self.get_coord_names(var)
-        # find how the shapes match up to var
-        # (should i use dim names or just sizes to figure out?)
-        # I'm going to use dim names
-        dims = ncvar.dimensions
-        ndim = ncvar.ndim
-        shape = ncvar.shape
-        positions = dict()
-        total = []
-        for i in names:
-            name = names[i]
-            if i == "tname":
-                common_name = "time"
-            elif i == "zname":
-                common_name = "z"
-            elif i == "xname":
-                common_name = "x"
-            elif i == "yname":
-                common_name = "y"
-            else:
-                common_name = None
-            if common_name != None:
-                positions[common_name] = None
-                if name != None:
-                    positions[common_name] = []
-                    cdims = self.nc.variables[name].dimensions
-                    for cdim in cdims:
-                        try:
-                            positions[common_name].append(dims.index(cdim))
-                        except StandardError:
-                            pass
-        # get t inds, z inds, xy inds
-        # tinds = [[1,],]
-        # zinds = [[1,],]
-        # xinds = [[50,], [50,]]
-        # yinds = [[50,], [50,]]
-        if positions["time"] != None:
-            if timebounds != None:
-                tinds = self.get_tind_from_bounds(var, timebounds)
-            else:
-                if timeinds == None:
-                    if point != None:
-                        tinds = np.asarray([self.get_nearest_tind(var, point)])
-                    else:
-                        tinds = np.arange(0, ncvar.shape[positions["time"]]+1)
-                else:
-                    tinds = timeinds
-        if positions["z"] != None:
-            if zbounds != None:
-                zinds = self.get_zind_from_bounds(var, zbounds)
-            else:
-                if zinds == None:
-                    if point != None:
-                        zinds = np.asarray([self.get_nearest_zind(var, point)])
-                    else:
-                        zinds = np.arange(0, ncvar.shape[positions["z"]]+1)
-                else:
-                    pass
-        if bbox != None:
-            xinds, yinds = self.get_xyind_from_bbox(var, bbox)
-        else:
-            if point != None:
-                num = kwargs.get("num", 1)
-                xinds, yinds = self.get_xyind_from_point(var, point, num=num)
-            else:
-                xinds = [np.arange(0, ncvar.shape[pos]+1) for pos in positions["x"]]
-                yinds = [np.arange(0, ncvar.shape[pos]+1) for pos in positions["y"]]
-        #if len(tinds) > 0 and len(zinds) > 0 and \
-        #    len(xinds) > 0 and len(yinds) > 0:
-        # Now take time inds, z inds, x and y inds and put them 
-        # into the request in the right places:
-       
-        indices = [None for i in range(ndim)]
-        for name in positions:
-            if positions[name] != None:
-                if name == "time":
-                    for i,position in enumerate(positions[name]):
-                        indices[position] = tinds[i] 
-                elif name == "z":
-                    for i,position in enumerate(positions[name]):
-                        indices[position] = zinds[i]
-                elif name == "y":
-                    for i,position in enumerate(positions[name]):
-                        indices[position] = yinds[i]
-                elif name == "x":
-                    for i,position in enumerate(positions[name]):
-                        indices[position] = xinds[i]
+        indices = self.get_indices(var, zbounds=zbounds, bbox=bbox,
+                                   timebounds=timebounds, zinds=zinds, timeinds=timeinds,
+                                   point=point, use_local=use_local, **kwargs)
         
         #logger.info("Getting data for %s with indexes: %s" % (var, str(indices)))
 
-        if np.all([i.size >0 for i in indices]):
+        if np.all([np.asarray(i).size > 0 for i in indices]):
             data = self._get_data(var, indices, use_local)
         else:
             # data = None
             raise ValueError("no data inside the domian specified")
+
+        if self._prefetcher is not None and not use_local:
+            taxis = self._get_positions(var)["time"]
+            if taxis is not None:
+                ncvar = self.nc.variables[var]
+                self._prefetcher.observe(var, indices, taxis[0], ncvar.shape[taxis[0]],
+                                         np.dtype(ncvar.dtype).itemsize)
         return data
-            
+
+    def execute(self, var, **kwargs):
+        """
+            Resolve the restrictions queued up on this dataset and read 'var'.
+            The same as get_values.
+        """
+        return self.get_values(var, **kwargs)
+
+    values = execute
+
+    def _get_positions(self, var):
+        """
+            The axes of 'var' that each of its coordinate variables span,
+            as a dict with "time", "z", "x" and "y" keys.  Missing
+            coordinates map to None.
+        """
+        return self._get_coordinfo(var).positions
+
+    def get_values_at_points(self, var, points=None, lats=None, lons=None,
+        depths=None, times=None, **kwargs):
+        """
+
+        Get the value of 'var' nearest to each of many points at once.
+
+        Pass either 'points', a sequence of Location4D objects, or
+        parallel 'lats', 'lons', 'depths' (meters) and 'times' (datetime)
+        sequences.  All of the indexes are resolved together and reads
+        are grouped into hyperslabs, so this is much cheaper than
+        calling get_values(var, point=...) for each point.
+
+        Only what the dataset has been restricted to is searched, so
+        each point gets the nearest of the selected times, depths and
+        grid cells.
+
+        Returns a 1D (masked) array with one value per point.
+
+        """
+        assert var in self._current_variables
+        if points is not None:
+            lats = [p.latitude for p in points]
+            lons = [p.longitude for p in points]
+            depths = [p.depth for p in points]
+            times = [p.time for p in points]
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lons = np.asarray(lons, dtype=np.float64).ravel()
+        npoints = lats.size
+
+        ncvar = self.nc.variables[var]
+        positions = self._get_positions(var)
+        selection = self._resolve(var)
+        indices = np.zeros((npoints, ncvar.ndim), dtype=np.int64)
+        located = []
+
+        for axis, window in selection.items():
+            if _empty(window):
+                raise ValueError("the restrictions on this dataset select no %s of %s" % (axis, var))
+
+        if positions["time"] is not None:
+            if times is None or None in list(times):
+                raise ValueError("a time is needed for every point, %s has a time axis" % var)
+            time = self.gettimevar(var)
+            tinds = _search_within(time.datenum, selection["time"], date2num(list(times)), time.order)
+            for position in positions["time"]:
+                indices[:, position] = tinds
+                located.append(position)
+        if positions["x"] is not None and positions["y"] is not None:
+            xinds, yinds = self.get_xyind_at_points(var, lats, lons, selection["xy"])
+            for i, position in enumerate(positions["x"]):
+                indices[:, position] = xinds[i]
+                located.append(position)
+            for i, position in enumerate(positions["y"]):
+                indices[:, position] = yinds[i]
+                located.append(position)
+        if positions["z"] is not None:
+            if depths is None or None in list(depths):
+                raise ValueError("a depth is needed for every point, %s has a depth axis" % var)
+            depths = np.asarray(depths, dtype=np.float64).ravel()
+            levels = self.getzlevels(var)
+            if levels is not None and positions["x"] is not None:
+                # The depths of the levels differ from cell to cell
+                rows, cols = xinds
+                among = None
+                if selection["z"] is not None:
+                    among = _selected(selection["z"], levels.size)
+                zinds = levels.nearest_levels(depths, tinds if positions["time"] is not None else None,
+                                              rows, cols, self.getgridobj(var)._xarray.shape, among)
+            else:
+                depth = self.getdepthvar(var)
+                zinds = _search_within(depth._converted('meters'), selection["z"], depths, depth.order)
+            for position in positions["z"]:
+                indices[:, position] = zinds
+                located.append(position)
+
+        for position in range(ncvar.ndim):
+            if position not in located and ncvar.shape[position] != 1:
+                raise ValueError("%s has a dimension (%s) that is not time, depth, or x/y" % (var, ncvar.dimensions[position]))
+
+        return _read_points(self._read_var(var), indices)
+
     def _get_data(self, var, **kwargs):
         raise NotImplementedError
                 
@@ -745,29 +1264,159 @@ class Dataset(object):
     _ind2lat = ind2lat
     __get_data = _get_data
     
+    def _resolve(self, var, steps=None):
+        """
+            Resolve this dataset's queued restrictions for 'var', followed
+            by any extra 'steps', into the selected indexes of each axis.
+
+            Returns a dict with "time", "z" and "xy" keys.  Time and z map
+            to a window of their axis: None for all of it, a slice for a
+            contiguous run (a view of the coordinate, which is the usual
+            case), or else an array of indexes.  xy maps to the windows
+            the dataset type uses to select grid cells (see _xy_indices).
+            Searches only look inside the windows.  The resolution of the
+            queued restrictions is kept, since the plan of a dataset never
+            changes.
+        """
+        base = self._resolved.get(var, None)
+        if base is None:
+            base = self._apply_steps(var, {"time":None, "z":None, "xy":None}, self._plan)
+            self._resolved[var] = base
+        if not steps:
+            return base
+        return self._apply_steps(var, dict(base), steps)
+
+    def _apply_steps(self, var, selection, steps):
+        """
+            Narrow 'selection' down by each (axis, kind, argument) step in
+            turn.  A nearest step searches only what is still selected.
+            Steps on an axis 'var' doesn't have are skipped.
+
+            When the depth axis is a ROMS s-coordinate, depth steps are
+            taken last, since the depths of its levels depend on the
+            timesteps and grid cells selected.
+        """
+        levels = None
+        if any(step[0] == "z" for step in steps):
+            levels = self.getzlevels(var)
+            if levels is not None:
+                steps = [step for step in steps if step[0] != "z"] + [step for step in steps if step[0] == "z"]
+        for axis, kind, arg in steps:
+            if axis == "time":
+                time = self.gettimevar(var)
+                if time is None:
+                    continue
+                window = selection["time"]
+                if kind == "bounds":
+                    datenum = time.datenum[_view(window)]
+                    lo, hi = time.datenum_of(arg)
+                    local = np.where(np.logical_and(datenum >= lo, datenum <= hi))[0]
+                    selection["time"] = _within(window, local)
+                elif kind == "nearest":
+                    selection["time"] = _nearest_selected(time.datenum, window, date2num(arg))
+            elif axis == "z" and levels is not None:
+                selection["z"] = self._select_levels(var, levels, selection, kind, arg)
+            elif axis == "z":
+                depths = self.getdepthvar(var)
+                if depths is None:
+                    continue
+                window = selection["z"]
+                if kind == "bounds":
+                    meters = depths._converted('meters')[_view(window)]
+                    local = np.where(np.logical_and(meters >= arg[0], meters <= arg[1]))[0]
+                    selection["z"] = _within(window, local)
+                elif kind == "nearest":
+                    selection["z"] = _nearest_selected(depths._converted('meters'), window, arg)
+            elif axis == "xy":
+                if self.getgridobj(var) is None:
+                    continue
+                if kind == "bbox":
+                    selection["xy"] = self._select_xy_bbox(var, selection["xy"], arg)
+                elif kind == "nearest":
+                    point, num = arg
+                    selection["xy"] = self._select_xy_point(var, selection["xy"], point, num)
+        return selection
+
+    def _select_levels(self, var, levels, selection, kind, arg):
+        """
+            The window of var's s-levels with a depth (meters, positive
+            down) inside the 'arg' bounds, or nearest to the 'arg' depth, in
+            any of the selected timesteps and grid cells
+        """
+        window = selection["z"]
+        found = np.zeros(_selected(window, levels.size).size, dtype=bool)
+        for heights in self._level_heights(var, levels, selection):
+            heights = heights[_view(window)]
+            heights = heights.reshape(heights.shape[0], -1)
+            if heights.size == 0:
+                continue
+            with np.errstate(invalid="ignore"):
+                if kind == "bounds":
+                    inside = np.logical_and(heights >= -max(arg), heights <= -min(arg))
+                    found |= inside.any(axis=1)
+                elif kind == "nearest":
+                    distance = np.abs(heights + arg)
+                    distance = np.where(np.isnan(distance), np.inf, distance)
+                    wet = np.isfinite(distance).any(axis=0)
+                    found[np.unique(np.argmin(distance, axis=0)[wet])] = True
+        return _within(window, np.where(found)[0])
+
+    def _level_bounds(self, var, levels, selection):
+        """
+            (min, max) depth in meters of var's selected s-levels
+        """
+        lo, hi = np.inf, -np.inf
+        for heights in self._level_heights(var, levels, selection):
+            heights = heights[_view(selection["z"])]
+            if np.isfinite(heights).any():
+                lo, hi = min(lo, np.nanmin(heights)), max(hi, np.nanmax(heights))
+        if lo > hi:
+            return None
+        return (-hi, -lo)
+
+    def _level_heights(self, var, levels, selection):
+        raise NotImplementedError
+
+    def _select_xy_bbox(self, var, xy, bbox):
+        raise NotImplementedError
+
+    def _select_xy_point(self, var, xy, point, num=1):
+        raise NotImplementedError
+
+    def _xy_indices(self, var, xy):
+        raise NotImplementedError
+
+    def _xy_values(self, var, xy):
+        raise NotImplementedError
+
     """
     
         Methods that operate on and return another Dataset object.
         Intended to be strung together.
+
+        Nothing is computed when they are called, each one returns a
+        copy with the restriction added to its query plan.  The plan is
+        resolved into indices when data is asked for (get_values,
+        get_indices, execute, or the get*bounds/getbbox methods).
     
     """
+    def _restrict(self, step):
+        new = self._copy()
+        new._plan.append(step)
+        return new
+
     def restrict_bbox(self, bbox = None, **kwargs):
-        raise NotImplementedError
+        assert bbox is not None
+        assert len(bbox) == 4
+        return self._restrict(("xy", "bbox", bbox))
             
     def restrict_time(self, times = None):
-        assert times != None
+        assert times is not None
         assert len(times) == 2
-        new = self._copy()
-        for var in new._current_variables:
-            time_dimension = new.gettimevar(var)
-            if time_dimension != None:
-                inds = new.get_tind_from_bounds(var, times)
-                time_dimension = _sub_by_nan(time_dimension, inds[0][0])
-                new._coordcache[var].t = time_dimension
-        return new
+        return self._restrict(("time", "bounds", times))
             
     def restrict_vars(self, varlist = None):
-        assert varlist != None
+        assert varlist is not None
         coord_names = []
         new = self._copy()
         if type(varlist) == str:
@@ -777,19 +1426,15 @@ class Dataset(object):
         for var in self._current_variables:
             if (not var in set(varlist)) and (not var in set(coord_names)):
                 new._current_variables.remove(var)
+        if new._current_variables != self._current_variables:
+            # The coordinate resolution is no longer shared with self
+            new._coordinfo = dict((var, new._coordinfo[var]) for var in new._current_variables if var in new._coordinfo)
         return new
          
     def restrict_depth(self, depths = None):
-        assert depths != None
+        assert depths is not None
         assert len(depths) == 2
-        new = self._copy()
-        for var in new._current_variables:
-            depth_dimension = new.getdepthvar(var)
-            if depth_dimension != None:
-                inds = new.get_zind_from_bounds(var, depths)
-                depth_dimension = _sub_by_nan(depth_dimension, inds[0])
-                new._coordcache[var].z = depth_dimension
-        return new
+        return self._restrict(("z", "bounds", depths))
             
     def regrid(self, **kwargs):
         """
@@ -799,31 +1444,18 @@ class Dataset(object):
         raise NotImplementedError
         
     def nearest_point(self, point):
-        raise NotImplementedError
+        assert type(point) == Location4D
+        return self._restrict(("xy", "nearest", (point, 1)))
             
     def nearest_depth(self, depth):
-        new = self._copy()
-        if type(depth) != Location4D:
-            depth = Location4D(depth=depth, latitude=0, longitude=0)
-        for var in self._current_variables:
-            depth_dimension = new.getdepthvar(var)
-            if depth_dimension != None:
-                ind = new.get_nearest_zind(var, depth)
-                depth_dimension = _sub_by_nan(depth_dimension, ind)
-                new._coordcache[var].z = depth_dimension 
-        return new
+        if type(depth) == Location4D:
+            depth = depth.depth
+        return self._restrict(("z", "nearest", depth))
             
     def nearest_time(self, time):
-        new = self._copy()
-        if type(time) != Location4D:
-            time = Location4D(time=time, latitude=0, longitude=0)
-        for var in self._current_variables:
-            time_dimension = new.gettimevar(var)
-            if time_dimension != None:
-                ind = new.get_nearest_tind(var, time)
-                time_dimension = _sub_by_nan(time_dimension, ind)
-                new._coordcache[var].t = time_dimension
-        return new    
+        if type(time) == Location4D:
+            time = time.time
+        return self._restrict(("time", "nearest", time))
 
 class CGridDataset(Dataset):
     """
@@ -833,38 +1465,98 @@ class CGridDataset(Dataset):
     """
     def __init__(self, *args,**kwargs):
         super(CGridDataset,self).__init__(*args, **kwargs)
+        # zname -> SCoordinate (None if it isn't one), shared with copies
+        self._zlevels = dict()
+        # angle name -> Rotation (see paegan.roms.roms.get_rotation), shared with copies
+        self._rotations = dict()
         
     def _copy(self):
-        new = CGridDataset(self._filename, self._datasettype)
+        new = CGridDataset(self._filename, self._datasettype, nc=self._shared_nc())
         new._coordcache = copy.copy(self._coordcache)
+        new._coordinfo = self._coordinfo
+        new._zlevels = self._zlevels
+        new._rotations = self._rotations
+        new._plan = list(self._plan)
+        new._slab_ratio = self._slab_ratio
+        new._block_cache = self._block_cache
         new._current_variables = copy.copy(self._current_variables)
         return new
         
-    def restrict_bbox(self, bbox = None, **kwargs):
-        assert bbox != None
-        assert len(bbox) == 4
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds = new.get_xyind_from_bbox(var, bbox)
-                grid._xarray = _sub_by_nan2(grid._xarray, inds)
-                grid._yarray = _sub_by_nan2(grid._yarray, inds)
-                new._coordcache[var].xy = grid
-        return new
-    
-    def nearest_point(self, point):
-        assert type(point) == Location4D
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds = new.get_xyind_from_point(var, point)
-                grid._xarray = _sub_by_nan2(grid._xarray, inds)
-                grid._yarray = _sub_by_nan2(grid._yarray, inds)
-                new._coordcache[var].xy = grid
-        return new
-        
+    def getzlevels(self, var=None):
+        assert var in self._current_variables
+        zname = self.get_coord_names(var)["zname"]
+        if zname not in self._zlevels:
+            levels = None
+            if is_s_coordinate(self.nc, zname):
+                try:
+                    levels = SCoordinate(self.nc, zname)
+                except StandardError:
+                    logger.warn("Could not work out the depths of the %s levels, searching them as values" % zname)
+            self._zlevels[zname] = levels
+        levels = self._zlevels[zname]
+        if levels is not None and levels.nc is not self.nc:
+            levels.nc = self.nc
+        return levels
+
+    def _level_heights(self, var, levels, selection):
+        """
+            The heights (N, rows, cols) of var's levels in the selected grid
+            cells, for each of the selected timesteps in turn
+        """
+        grid = self.getgridobj(var)
+        tinds = [None]
+        positions = self._get_positions(var)
+        if levels.time_varying and positions["time"] is not None:
+            tsize = self.nc.variables[var].shape[positions["time"][0]]
+            tinds = _selected(selection["time"], tsize)
+        rows, cols = (None, None) if selection["xy"] is None else selection["xy"]
+        for tind in tinds:
+            yield _grid_view(levels.z(tind, grid._xarray.shape), rows, cols)
+
+    def _select_xy_bbox(self, var, xy, bbox):
+        # xy is a (rows, cols) pair of windows
+        grid = self.getgridobj(var)
+        if xy is None:
+            xy = (None, None)
+        rows, cols = xy
+        x, y = _grid_view(grid._xarray, rows, cols), _grid_view(grid._yarray, rows, cols)
+        inside = np.logical_and(np.logical_and(x >= bbox[0], x <= bbox[2]),
+                                np.logical_and(y >= bbox[1], y <= bbox[3]))
+        r, c = np.where(inside)
+        if r.size == 0:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty
+        return (_within(rows, np.arange(r.min(), r.max()+1)),
+                _within(cols, np.arange(c.min(), c.max()+1)))
+
+    def _select_xy_point(self, var, xy, point, num=1):
+        grid = self.getgridobj(var)
+        if xy is None:
+            r, c = grid.near_xy(point=point, num=num)
+            return _window(np.unique(r)), _window(np.unique(c))
+        rows, cols = xy
+        lats = _grid_view(grid._yarray, rows, cols)
+        if lats.size == 0:
+            return xy
+        distance = AsaGreatCircle.great_distance(start_lats=point.latitude, start_lons=point.longitude,
+                                                 end_lats=lats, end_lons=_grid_view(grid._xarray, rows, cols))["distance"]
+        distance = np.where(np.isnan(distance), np.inf, distance).ravel()
+        r, c = np.unravel_index(np.argsort(distance)[:num], lats.shape)
+        return _within(rows, np.unique(r)), _within(cols, np.unique(c))
+
+    def _xy_indices(self, var, xy):
+        if xy is None:
+            xy = (None, None)
+        shape = self.getgridobj(var)._xarray.shape
+        inds = (_selected(xy[0], shape[0]), _selected(xy[1], shape[1]))
+        return inds, inds
+
+    def _xy_values(self, var, xy):
+        grid = self.getgridobj(var)
+        if xy is None:
+            return grid._xarray, grid._yarray
+        return _grid_view(grid._xarray, xy[0], xy[1]), _grid_view(grid._yarray, xy[0], xy[1])
+
     def get_xyind_from_bbox(self, var, bbox, **kwargs):
         grid = self.getgridobj(var)
         xbool = grid.get_xbool_from_bbox(bbox)
@@ -881,15 +1573,25 @@ class CGridDataset(Dataset):
         grid = self.getgridobj(var)
         num = kwargs.get("num", None)
         indexr, indexc = grid.near_xy(point=point, num=num)
-        inds = indexc, indexr
+        inds = indexr, indexc
+        return inds, inds
+
+    def get_xyind_at_points(self, var, lats, lons, xy=None):
+        grid = self.getgridobj(var)
+        if xy is None:
+            flat = grid.nearest_flat_indexes(lats, lons)[:, 0]
+            inds = np.unravel_index(flat, grid._xarray.shape)
+            return inds, inds
+        x, y = self._xy_values(var, xy)
+        rows, cols = np.unravel_index(_nearest_flat(x, y, lats, lons), x.shape)
+        selected = self._xy_indices(var, xy)[0]
+        inds = (selected[0][rows], selected[1][cols])
         return inds, inds
         
     def _get_data(self, var, indarray, use_local=False):
         ndims = len(indarray)
         if use_local == False:
-            var = self.nc.variables[var]
-        else:
-            pass
+            return _read_hyperslabs(self._read_var(var), indarray, self._slab_ratio)
             
         if ndims == 1:
             data = var[indarray]
@@ -919,36 +1621,43 @@ class RGridDataset(Dataset):
         super(RGridDataset,self).__init__(*args, **kwargs)
     
     def _copy(self):
-        new = RGridDataset(self._filename, self._datasettype)
+        new = RGridDataset(self._filename, self._datasettype, nc=self._shared_nc())
         new._coordcache = copy.copy(self._coordcache)
+        new._coordinfo = self._coordinfo
+        new._plan = list(self._plan)
+        new._slab_ratio = self._slab_ratio
+        new._block_cache = self._block_cache
         new._current_variables = copy.copy(self._current_variables)
         return new
         
-    def restrict_bbox(self, bbox = None, **kwargs):
-        assert bbox != None
-        assert len(bbox) == 4
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                xinds, yinds =  new.get_xyind_from_bbox(var, bbox)
-                grid._xarray = _sub_by_nan(grid._xarray, xinds[0][0])
-                grid._yarray = _sub_by_nan(grid._yarray, yinds[0][0])
-                new._coordcache[var].xy = grid
-        return new
-    
-    def nearest_point(self, point):
-        assert type(point) == Location4D
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                xind, yind = new.get_xyind_from_point(var, point)
-                grid._xarray = _sub_by_nan(grid._xarray, xind)
-                grid._yarray = _sub_by_nan(grid._yarray, yind)
-                new._coordcache[var].xy = grid
-        return new
-        
+    def _select_xy_bbox(self, var, xy, bbox):
+        # xy is an (x, y) pair of windows
+        grid = self.getgridobj(var)
+        if xy is None:
+            xy = (None, None)
+        x, y = grid._xarray[_view(xy[0])], grid._yarray[_view(xy[1])]
+        return (_within(xy[0], np.where(np.logical_and(x >= bbox[0], x <= bbox[2]))[0]),
+                _within(xy[1], np.where(np.logical_and(y >= bbox[1], y <= bbox[3]))[0]))
+
+    def _select_xy_point(self, var, xy, point, num=1):
+        grid = self.getgridobj(var)
+        if xy is None:
+            xy = (None, None)
+        return (_nearest_within(grid._xarray, xy[0], point.longitude, num),
+                _nearest_within(grid._yarray, xy[1], point.latitude, num))
+
+    def _xy_indices(self, var, xy):
+        if xy is None:
+            xy = (None, None)
+        grid = self.getgridobj(var)
+        return [_selected(xy[0], grid._xarray.size)], [_selected(xy[1], grid._yarray.size)]
+
+    def _xy_values(self, var, xy):
+        grid = self.getgridobj(var)
+        if xy is None:
+            xy = (None, None)
+        return grid._xarray[_view(xy[0])], grid._yarray[_view(xy[1])]
+
     def get_xyind_from_bbox(self, var, bbox):
         grid = self.getgridobj(var)
         xbool = grid.get_xbool_from_bbox(bbox)
@@ -962,14 +1671,20 @@ class RGridDataset(Dataset):
         num = kwargs.get("num", 1)
         index = grid.near_xy(point=point, num=num)
         return index[1], index[0] 
+
+    def get_xyind_at_points(self, var, lats, lons, xy=None):
+        grid = self.getgridobj(var)
+        if xy is None:
+            xy = (None, None)
+        xinds = [_search_within(grid._xarray, xy[0], lons)]
+        yinds = [_search_within(grid._yarray, xy[1], lats)]
+        return xinds, yinds
         
     def _get_data(self, var, indarray, use_local=False):
         ndims = len(indarray)
         #print "this is what im trying to get", indarray
         if use_local == False:
-            var = self.nc.variables[var]
-        else:
-            pass
+            return _read_hyperslabs(self._read_var(var), indarray, self._slab_ratio)
 
         if ndims == 1:
             data = var[indarray]
@@ -1000,38 +1715,47 @@ class NCellDataset(Dataset):
         if None in self.nc.variables:
             self._is_topology = True
             self.topology_var_name = None
+        self._max_read_bytes = _max_read_bytes
     
     def _copy(self):
-        new = NCellDataset(self._filename, self._datasettype)
+        new = NCellDataset(self._filename, self._datasettype, nc=self._shared_nc())
         new._coordcache = copy.copy(self._coordcache)
+        new._coordinfo = self._coordinfo
+        new._plan = list(self._plan)
+        new._slab_ratio = self._slab_ratio
+        new._block_cache = self._block_cache
+        new._max_read_bytes = self._max_read_bytes
         new._current_variables = copy.copy(self._current_variables)
         return new
         
-    def restrict_bbox(self, bbox = None, **kwargs):
-        assert bbox != None
-        assert len(bbox) == 4
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds =  new.get_xyind_from_bbox(var, bbox)
-                grid._xarray = _sub_by_nan(grid._xarray, inds[0][0])
-                grid._yarray = _sub_by_nan(grid._yarray, inds[0][0])
-                new._coordcache[var].xy = grid
-        return new
-    
-    def nearest_point(self, point):
-        assert type(point) == Location4D
-        new = self._copy()
-        for var in new._current_variables:
-            grid = new.getgridobj(var)
-            if grid != None:
-                inds, inds = new.get_xyind_from_point(var, point)
-                grid._xarray = _sub_by_nan(grid._xarray, inds)
-                grid._yarray = _sub_by_nan(grid._yarray, inds)
-                new._coordcache[var].xy = grid
-        return new
-        
+    def _select_xy_bbox(self, var, xy, bbox):
+        # xy is a window of nodes
+        grid = self.getgridobj(var)
+        x, y = grid._xarray[_view(xy)], grid._yarray[_view(xy)]
+        inside = np.logical_and(np.logical_and(x >= bbox[0], x <= bbox[2]),
+                                np.logical_and(y >= bbox[1], y <= bbox[3]))
+        return _within(xy, np.where(inside)[0])
+
+    def _select_xy_point(self, var, xy, point, num=1):
+        grid = self.getgridobj(var)
+        if xy is None:
+            return _window(grid.near_xy(point=point, num=num, ncell=True)[0][0])
+        lats = grid._yarray[_view(xy)]
+        if lats.size == 0:
+            return xy
+        distance = AsaGreatCircle.great_distance(start_lats=point.latitude, start_lons=point.longitude,
+                                                 end_lats=lats, end_lons=grid._xarray[_view(xy)])["distance"]
+        distance = np.where(np.isnan(distance), np.inf, distance)
+        return _within(xy, np.sort(np.argsort(distance)[:num]))
+
+    def _xy_indices(self, var, xy):
+        inds = _selected(xy, self.getgridobj(var)._xarray.size)
+        return [inds], [inds]
+
+    def _xy_values(self, var, xy):
+        grid = self.getgridobj(var)
+        return grid._xarray[_view(xy)], grid._yarray[_view(xy)]
+
     def get_xyind_from_bbox(self, var, bbox):
         grid = self.getgridobj(var)
         xbool = grid.get_xbool_from_bbox(bbox)
@@ -1045,18 +1769,40 @@ class NCellDataset(Dataset):
         inds, inds = grid.near_xy(point=point, num=num, ncell=True)
         return inds, inds
 
+    def get_xyind_at_points(self, var, lats, lons, xy=None):
+        grid = self.getgridobj(var)
+        if xy is None:
+            inds = [grid.nearest_flat_indexes(lats, lons)[:, 0]]
+            return inds, inds
+        x, y = self._xy_values(var, xy)
+        inds = [_selected(xy, grid._xarray.size)[_nearest_flat(x, y, lats, lons)]]
+        return inds, inds
+
+    def get_max_read_bytes(self):
+        return self._max_read_bytes
+    def set_max_read_bytes(self, max_read_bytes):
+        """
+            The most bytes a single read may span.  Node selections spread
+            wider than this are read in chunks.
+        """
+        self._max_read_bytes = max_read_bytes
+    max_read_bytes = property(get_max_read_bytes, set_max_read_bytes)
+
     def _get_data(self, var, indarray, use_local=False):
         ndims = len(indarray)
         if use_local == False:
-            var =    self.nc.variables[var]
-        else:
-            pass
+            # Read only the selected nodes, in chunks along the node axis
+            positions = self._get_positions(var)
+            axis = ndims - 1
+            if positions["x"] is not None:
+                axis = positions["x"][-1]
+            return _read_chunked(self._read_var(var), indarray, axis,
+                                 self._slab_ratio, self._max_read_bytes)
         if ndims == 1:
-            data = var[:]
-            data = data[indarray]
+            data = var[indarray]
         elif ndims == 2:
-            data = var[:]
-            data = data[indarray[0], indarray[1]]
+            data = var[indarray[0], :]
+            data = data[:, indarray[1]]
         elif ndims == 3:
             data = var[indarray[0], indarray[1], :]
             data = data[:, :, indarray[2]]
@@ -1,5 +1,26 @@
 import numpy as np
 import netCDF4
+from paegan.cdm.search import search, monotonic
+
+def _normalize_units(units):
+    """
+        CF convention v1.0/udunits names of length units, as the names Depthvar uses
+    """
+    if units in ['m','meter','meters from the sea surface']:
+        units='meters'
+    if units in ['cm','centimeter']:
+        units='centimeters'
+    if units in ['mm','millimeter']:
+        units='millimeters'
+    if units in ['km','kilometer']:
+        units='kilometers'
+    if units in ['ft','feets']:
+        units='feet'
+    if units in ['yd','yard']:
+        units='yards'
+    if units in ['mile']:
+        units='miles'
+    return units
 
 class Depthvar(np.ndarray):
 
@@ -23,65 +44,113 @@ class Depthvar(np.ndarray):
     _meters2unit['kilometers'] = 0.001
     _meters2unit['miles'] = 0.000621371
 
-    def __new__(self, ncfile, name, units=None, **kwargs):
+    def __new__(cls, ncfile, name, units=None, **kwargs):
         if type(ncfile) is str:
             ncfile = netCDF4.Dataset(ncfile)
-        self._nc = ncfile
         
-        data = self._nc.variables[name][:]
-        if units == None:
+        data = ncfile.variables[name][:]
+        if units is None:
             try:
-                self._units = self._nc.variables[name].units
+                units = ncfile.variables[name].units
             except StandardError:
-                self._units = 'meters'
-        else:
-            self._units = units
+                units = 'meters'
                
         # compatibility to CF convention v1.0/udunits names:
-        if self._units in ['m','meter','meters from the sea surface']:
-            self._units='meters'
-        if self._units in ['cm','centimeter']:
-            self._units='centimeters'
-        if self._units in ['mm','millimeter']:
-            self._units='millimeters'
-        if self._units in ['km','kilometer']:
-            self._units='kilometers'
-        if self._units in ['ft','feets']:
-            self._units='feet'
-        if self._units in ['yd','yard']:
-            self._units='yards'
-        if self._units in ['mile']:
-            self._units='miles'
+        units = _normalize_units(units)
+
+        # Kept on the instance (and carried to views by __array_finalize__),
+        # so two Depthvars don't share units
+        self = data.view(cls)
+        self._nc = ncfile
+        self._units = units
+        return self
 
-        return data.view(self)
+    def __array_finalize__(self, obj):
+        self._nc = getattr(obj, '_nc', None)
+        self._units = getattr(obj, '_units', 'meters')
+        self._order = None
+        # units -> float64 depths in them, see _converted
+        self._conversions = {}
     
-    def nearest_index(self, depth):
-        return np.where(abs(self.meters-depth) == np.nanmin(abs(self.meters-depth)))[0]
+    def nearest_index(self, depth, select='nearest'):
+        """
+            For one depth (in meters), the indexes of the depths nearest
+            to it (all of them, if tied).  For a list of depths, the index
+            of the depth nearest to each.  select='before'/'after' gives
+            the index of the largest depth <= / smallest depth >= each one.
+            Binary searched when the depths are monotonic.
+        """
+        meters = self._converted('meters')
+        if np.ndim(depth) == 0 and select == 'nearest':
+            if self.order == 0:
+                distance = abs(meters - depth)
+                return np.where(distance == np.nanmin(distance))[0]
+            ind = search(meters, [depth], select, self.order)[0]
+            # Keep a neighbour that is just as near
+            distance = abs(meters[max(ind-1, 0):ind+2] - depth)
+            return np.where(distance == distance.min())[0] + max(ind-1, 0)
+        return search(meters, np.atleast_1d(depth), select, self.order)
+
+    @classmethod
+    def meters_per_unit(cls, units):
+        """
+            How many meters are in one of 'units' (a CF/udunits name),
+            or None if they aren't a length (dbar, sigma, level...)
+        """
+        return cls._unit2meters.get(_normalize_units(units), None)
+
+    def get_order(self):
+        """
+            1 if the depths never decrease, -1 if they never increase,
+            0 otherwise (see paegan.cdm.search.monotonic)
+        """
+        if self._order is None:
+            self._order = monotonic(self._converted('meters'))
+        return self._order
     
     def nearest(self, depth):
         """
         find nearest depth,
-        input and output are meters
+        input and output are meters (one depth, or an array of them)
+        """
+        if np.ndim(depth) == 0:
+            return self._converted('meters')[self.nearest_index(depth)][0]
+        return self._converted('meters')[self.nearest_index(depth)]
+
+    def _converted(self, units):
+        """
+            The depths in 'units' as a float64 array, worked out once and
+            kept.  Read-only, since it is shared by every caller; the
+            properties hand out copies.
+            Depths whose units aren't a length are taken as they are.
         """
-        return self.meters[self.nearest_index(depth)][0]
+        values = self._conversions.get(units, None)
+        if values is None:
+            if units == 'meters':
+                factor = self.meters_per_unit(self._units)
+                if factor is None:
+                    factor = 1
+                values = np.asarray(self, dtype=np.float64) * factor
+            else:
+                values = self.meters * self._meters2unit[units]
+            values.flags.writeable = False
+            self._conversions[units] = values
+        return values
     
     def get_mm(self):
-        fac = self._unit2meters[self._units] * self._meters2unit['millimeters']
-        return self*fac
+        return self._converted('millimeters').copy()
     
     def get_cm(self):
-        fac = self._unit2meters[self._units] * self._meters2unit['centimeters']
-        return self*fac
+        return self._converted('centimeters').copy()
 
     def get_km(self):
-        fac = self._unit2meters[self._units] * self._meters2unit['kilometers']
-        return self*fac
+        return self._converted('kilometers').copy()
 
     def get_m(self):
-        fac = self._unit2meters[self._units] * self._meters2unit['meters']
-        return self*fac
+        return self._converted('meters').copy()
         
     meters = property(get_m, None, doc="meters")
     kilometers = property(get_km, None, doc="kilometers")
     centimeters = property(get_cm, None, doc="centimeters")
     millimeters = property(get_mm, None, doc="millimeters")
+    order = property(get_order, None)
@@ -3,6 +3,26 @@ import netCDF4
 from paegan.utils.asagreatcircle import AsaGreatCircle
 from paegan.location4d import Location4D
 
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # No spatial index, nearest lookups fall back to a full scan
+    cKDTree = None
+
+# Extra candidates pulled from the spatial index and re-ranked by
+# geodesic distance, since chord distance on a sphere only
+# approximates distance on the ellipsoid.
+_tree_candidates = 8
+
+def _unit_sphere(lats, lons):
+    """
+        Convert decimal degree lat/lons into x/y/z points on the unit sphere
+    """
+    lats = np.radians(lats)
+    lons = np.radians(lons)
+    coslat = np.cos(lats)
+    return np.column_stack((coslat * np.cos(lons), coslat * np.sin(lons), np.sin(lats)))
+
 class Gridobj:
     def __init__(self, nc, xname=None, yname=None,
         xunits=None, yunits=None, projected=False, **kwargs):
@@ -17,8 +37,11 @@ class Gridobj:
         self._ymesh = None
         self._xmesh = None
         self._type = None
+        self._tree = None
+        self._tree_inds = None
+        self._tree_arrays = None
         
-        if self._xname != None:
+        if self._xname is not None:
             self._x_nc = self._nc.variables[self._xname]
             self._xarray = np.asarray(self._x_nc[:])
             if self.xmax <= 360 and self.xmin >= 0:
@@ -27,7 +50,7 @@ class Gridobj:
             
         else:
             self._xarray = np.asarray((),)
-        if self._yname !=None:
+        if self._yname is not None:
             self._y_nc = self._nc.variables[self._yname]
             self._yarray = np.asarray(self._y_nc[:])
         else:
@@ -98,32 +121,90 @@ class Gridobj:
     def bbox_to_wkt(self):
         pass
     
+    def _build_tree(self):
+        """
+            Build a KD-tree over the finite grid points, on the unit sphere
+            so it isn't fooled by the dateline or converging meridians.
+        """
+        x = self._xarray.ravel()
+        y = self._yarray.ravel()
+        self._tree_inds = np.flatnonzero(np.logical_and(np.isfinite(x), np.isfinite(y)))
+        self._tree = cKDTree(_unit_sphere(y[self._tree_inds], x[self._tree_inds]))
+        self._tree_arrays = (self._xarray, self._yarray)
+
+    def get_tree(self):
+        """
+            The spatial index over _xarray/_yarray, built on first use.  It is
+            rebuilt if the coordinate arrays are replaced.
+        """
+        if cKDTree is None:
+            return None
+        if self._tree is None or self._tree_arrays[0] is not self._xarray \
+                              or self._tree_arrays[1] is not self._yarray:
+            self._build_tree()
+        return self._tree
+
+    def nearest_flat_indexes(self, lats, lons, num=1):
+        """
+            Flat indexes (into _xarray/_yarray) of the 'num' nearest grid
+            points to each of the lats/lons, nearest first.
+
+            Returns an array of shape (len(lats), num)
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        x = self._xarray.ravel()
+        y = self._yarray.ravel()
+
+        tree = self.get_tree()
+        if tree is None:
+            distance = AsaGreatCircle.great_distance(
+                start_lats=y[np.newaxis, :], start_lons=x[np.newaxis, :],
+                end_lats=lats[:, np.newaxis], end_lons=lons[:, np.newaxis])["distance"]
+            distance[np.isnan(distance)] = np.inf
+            return np.argsort(distance, axis=1, kind='mergesort')[:, :num]
+
+        for attempt in range(2):
+            k = min(num + _tree_candidates, self._tree_inds.size)
+            d, candidates = tree.query(_unit_sphere(lats, lons), k=k)
+            candidates = self._tree_inds[np.asarray(candidates).reshape(lats.size, k)]
+            distance = AsaGreatCircle.great_distance(
+                start_lats=y[candidates], start_lons=x[candidates],
+                end_lats=lats[:, np.newaxis], end_lons=lons[:, np.newaxis])["distance"]
+            if np.isnan(distance).any() and attempt == 0:
+                # Points were masked out of the arrays in place since the
+                # tree was built, so it needs to be rebuilt.
+                self._build_tree()
+                tree = self._tree
+                continue
+            distance[np.isnan(distance)] = np.inf
+            order = np.argsort(distance, axis=1, kind='mergesort')[:, :num]
+            return candidates[np.arange(lats.size)[:, np.newaxis], order]
+
     def near_xy(self, **kwargs):
         """
-            TODO: Implement ncell near_xy
+            Find the nearest grid points to a point.
+
+            Curvilinear (2D) and ncell grids are searched through the
+            spatial index; rectilinear (1D) grids search each axis.
         """
         point = kwargs.get("point", None)
-        if point == None:
+        if point is None:
             lat = kwargs.get("lat", None)
             lon = kwargs.get("lon", None)
             point = Location4D(latitude=lat, longitude=lon)
         num = kwargs.get("num", 1)
+        if num is None:
+            num = 1
         ncell = kwargs.get("ncell", False)
         if ncell:
-            if num > 1:
-                pass
-            else:
-                distance = AsaGreatCircle.great_distance(
-                    start_lats=self._yarray, start_lons=self._xarray,
-                    end_lats=point.latitude, end_lons=point.longitude)["distance"]
-                inds = np.where(distance == np.nanmin(distance))
-                xinds, yinds = inds, inds
+            inds = self.nearest_flat_indexes(point.latitude, point.longitude, num=num)[0]
+            inds = (np.sort(inds),)
+            xinds, yinds = inds, inds
         else:
             if self._ndim == 2:
-                distance = AsaGreatCircle.great_distance(
-                    start_lats=self._yarray, start_lons=self._xarray,
-                    end_lats=point.latitude, end_lons=point.longitude)["distance"]
-                yinds, xinds = np.where(distance == np.nanmin(distance))
+                inds = self.nearest_flat_indexes(point.latitude, point.longitude, num=num)[0]
+                yinds, xinds = np.unravel_index(inds, self._xarray.shape)
             else:
                 #if self._xmesh == None and self._ymesh == None:
                 #    self._xmesh, self._ymesh = np.meshgrid(self._xarray, self._yarray)
@@ -147,6 +228,7 @@ class Gridobj:
     xmin = property(get_xmin, None)
     ymin = property(get_ymin, None)
     bbox = property(get_bbox, None)
+    tree = property(get_tree, None)
     xunits = property(get_xunits, None)
     yunits = property(get_yunits, None)
     _findy = findy
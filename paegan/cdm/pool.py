@@ -0,0 +1,196 @@
+import threading
+import collections
+import netCDF4
+
+from paegan.logger import logger
+
+class HandlePool(object):
+    """
+        Process-wide pool of open netCDF4.Dataset handles, keyed by resource
+        (filename or url).
+
+        Each resource is opened once and shared by everything that acquires
+        it.  References are counted, and a handle is closed once nobody holds
+        it, so the file can be rewritten or removed.  Up to 'max_idle' handles
+        nobody holds can be kept open instead (none by default), in case they
+        are wanted again; the least recently used go first.  Idle handles are
+        also closed once more than 'max_handles' are open.  Handles in use are
+        never closed, so that cap can be exceeded while they are all held.
+
+        >> nc = pool.acquire(url)
+        >> ...
+        >> pool.release(url)
+    """
+
+    def __init__(self, max_handles=32, max_idle=0):
+        self._lock = threading.RLock()
+        # resource -> [LockedHandle, reference count], least recently used first
+        self._handles = collections.OrderedDict()
+        self._max_handles = max_handles
+        self._max_idle = max_idle
+
+    def acquire(self, resource):
+        """
+            Returns the open handle for 'resource' (a LockedHandle),
+            opening it if needed
+        """
+        with self._lock:
+            entry = self._handles.pop(resource, None)
+            if entry is None:
+                entry = [LockedHandle(netCDF4.Dataset(resource)), 0]
+            entry[1] += 1
+            self._handles[resource] = entry
+            self._evict()
+            return entry[0]
+
+    def release(self, resource):
+        """
+            Gives back a handle from acquire().  The last one given back is
+            closed, unless it is kept idle (see max_idle).
+        """
+        with self._lock:
+            entry = self._handles.get(resource, None)
+            if entry is None or entry[1] == 0:
+                logger.warn("Released %s more times than it was acquired" % resource)
+                return
+            entry[1] -= 1
+            self._evict()
+
+    def refcount(self, resource):
+        with self._lock:
+            entry = self._handles.get(resource, None)
+            if entry is None:
+                return 0
+            return entry[1]
+
+    def close_idle(self):
+        """
+            Close every handle that isn't in use
+        """
+        with self._lock:
+            for resource, entry in self._handles.items():
+                if entry[1] == 0:
+                    self._close(resource)
+
+    def _evict(self):
+        idle = sum(1 for entry in self._handles.values() if entry[1] == 0)
+        for resource, entry in self._handles.items():
+            if len(self._handles) <= self._max_handles and idle <= self._max_idle:
+                break
+            if entry[1] == 0:
+                self._close(resource)
+                idle -= 1
+
+    def _close(self, resource):
+        nc, count = self._handles.pop(resource)
+        try:
+            nc.close()
+        except StandardError:
+            logger.warn("Could not close %s" % resource)
+
+    def get_max_handles(self):
+        return self._max_handles
+    def set_max_handles(self, max_handles):
+        with self._lock:
+            self._max_handles = max_handles
+            self._evict()
+    max_handles = property(get_max_handles, set_max_handles)
+
+    def get_max_idle(self):
+        return self._max_idle
+    def set_max_idle(self, max_idle):
+        """
+            How many handles nobody holds are kept open
+        """
+        with self._lock:
+            self._max_idle = max_idle
+            self._evict()
+    max_idle = property(get_max_idle, set_max_idle)
+
+    def get_open_count(self):
+        return len(self._handles)
+    open_count = property(get_open_count, None)
+
+class LockedHandle(object):
+    """
+        Stands in for a netCDF4 Dataset, Variable or Dimension, doing
+        everything with it while holding read_lock.  The variables and
+        dimensions reached through it are wrapped the same way.
+    """
+
+    __slots__ = ("_target", "_mappings")
+
+    def __init__(self, target):
+        object.__setattr__(self, "_target", target)
+        # "variables"/"dimensions" -> (the target's dict, wrapped copy)
+        object.__setattr__(self, "_mappings", dict())
+
+    def __getattr__(self, name):
+        with read_lock:
+            value = getattr(self._target, name)
+            if name in ("variables", "dimensions") and isinstance(value, dict):
+                return self._wrapped(name, value)
+        if callable(value):
+            return _locked_call(value)
+        return value
+
+    def __setattr__(self, name, value):
+        with read_lock:
+            setattr(self._target, name, value)
+
+    def _wrapped(self, name, mapping):
+        wrapped = self._mappings.get(name, None)
+        if wrapped is None or wrapped[0] is not mapping or len(wrapped[1]) != len(mapping):
+            wrapped = (mapping, collections.OrderedDict((key, LockedHandle(value)) for key, value in mapping.items()))
+            self._mappings[name] = wrapped
+        return wrapped[1]
+
+    def get_dict(self):
+        with read_lock:
+            return self._target.__dict__
+    __dict__ = property(get_dict, None)
+
+    def __getitem__(self, key):
+        with read_lock:
+            return self._target[key]
+
+    def __setitem__(self, key, value):
+        with read_lock:
+            self._target[key] = value
+
+    def __len__(self):
+        with read_lock:
+            return len(self._target)
+
+    def __array__(self, *args):
+        with read_lock:
+            return self._target.__array__(*args)
+
+    def __repr__(self):
+        with read_lock:
+            return repr(self._target)
+
+def _locked_call(method):
+    def call(*args, **kwargs):
+        with read_lock:
+            return method(*args, **kwargs)
+    return call
+
+def locked(nc):
+    """
+        'nc' as a LockedHandle (None, and handles that already are one,
+        are left as they are)
+    """
+    if nc is None or isinstance(nc, LockedHandle):
+        return nc
+    return LockedHandle(nc)
+
+# The pool shared by every Dataset in this process
+pool = HandlePool()
+
+# The netCDF library isn't thread safe, so everything done with a Dataset's
+# handle holds this: pooled handles, and handles passed to a Dataset, are
+# LockedHandles.  Reads on other threads (see paegan.cdm.prefetch) have to
+# hold it too.  Variables and handles opened outside of paegan aren't
+# covered, so shouldn't be read while a Dataset is prefetching.
+read_lock = threading.RLock()
@@ -0,0 +1,169 @@
+import threading
+import weakref
+import Queue
+import numpy as np
+import netCDF4
+
+from paegan.cdm.pool import read_lock
+from paegan.logger import logger
+
+class Prefetcher(object):
+    """
+        Reads ahead along the time axis of a Dataset.
+
+        The dataset reports each read to observe().  Once a variable is
+        being stepped forward in time (each read starting after the last
+        one started, but not past where it ended), the next 'depth' steps
+        are read on a background thread into the dataset's block cache,
+        so the I/O overlaps whatever is done with the current step.
+
+        At most 'max_bytes' of reads are queued up at once.  cancel()
+        drops whatever hasn't been read yet, and stop() also ends the
+        thread.
+
+        The thread reads through its own handle of the dataset's file,
+        opened when it first reads and closed when it ends, never through
+        the dataset's (pooled) handle.  Its reads hold read_lock, as does
+        everything done with the dataset's handle (a LockedHandle).
+    """
+
+    def __init__(self, dataset, depth=1, max_bytes=64 * 1024 * 1024):
+        self._dataset = weakref.ref(dataset)
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        # Bumped by cancel(), so queued reads from before it are dropped
+        self._generation = 0
+        self._queued_bytes = 0
+        # var -> (first, last) time index of the last read
+        self._last = dict()
+        # (var, first time index) of the steps read or queued
+        self._scheduled = set()
+        self._stopped = False
+        # Private copy of the dataset, on a handle only the thread uses
+        self._reader = None
+        self._thread = threading.Thread(target=self._run, name="paegan-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def observe(self, var, indices, taxis, tsize, itemsize=8):
+        """
+            Note a read of 'var' at 'indices' (an array of indexes for each
+            dimension, time along 'taxis' of length 'tsize'), and queue the
+            steps after it if time is being stepped through.
+        """
+        tinds = np.asarray(indices[taxis])
+        if tinds.size == 0:
+            return
+        first, last = int(tinds.min()), int(tinds.max())
+        with self._lock:
+            if self._stopped:
+                return
+            previous = self._last.get(var, None)
+            self._last[var] = (first, last)
+            # Forget the steps behind this one
+            self._scheduled = set(key for key in self._scheduled if key[0] != var or key[1] > first)
+            if previous is None or not (previous[0] < first <= previous[1] + 1):
+                return
+            step = first - previous[0]
+            nbytes = itemsize * np.prod([np.asarray(inds).size for inds in indices])
+            for j in range(1, self.depth + 1):
+                shifted = tinds + j * step
+                if shifted.max() >= tsize:
+                    break
+                key = (var, int(shifted.min()))
+                if key in self._scheduled:
+                    continue
+                if self._queued_bytes + nbytes > self.max_bytes:
+                    logger.debug("Not prefetching %s, %d bytes are already queued" % (var, self._queued_bytes))
+                    break
+                ahead = list(indices)
+                ahead[taxis] = shifted
+                self._scheduled.add(key)
+                self._queued_bytes += nbytes
+                self._queue.put((self._generation, var, ahead, nbytes))
+
+    def cancel(self):
+        """
+            Drop the reads that haven't started yet
+        """
+        with self._lock:
+            self._generation += 1
+            self._queued_bytes = 0
+            self._scheduled = set()
+            self._last = dict()
+            while True:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                except Queue.Empty:
+                    break
+
+    def stop(self, wait=False):
+        """
+            Cancel everything and end the background thread
+        """
+        self.cancel()
+        with self._lock:
+            self._stopped = True
+        self._queue.put(None)
+        if wait and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def wait(self):
+        """
+            Block until every queued read is done
+        """
+        self._queue.join()
+
+    def _run(self):
+        try:
+            while True:
+                task = self._queue.get()
+                try:
+                    if task is None:
+                        return
+                    generation, var, indices, nbytes = task
+                    with self._lock:
+                        if generation != self._generation:
+                            continue
+                        self._queued_bytes -= nbytes
+                    dataset = self._dataset()
+                    if dataset is None or dataset.nc is None:
+                        return
+                    try:
+                        with read_lock:
+                            self._read(dataset, var, indices)
+                    except StandardError:
+                        logger.warn("Could not prefetch %s" % var)
+                    del dataset
+                finally:
+                    self._queue.task_done()
+        finally:
+            self._close()
+
+    def _read(self, dataset, var, indices):
+        if self._reader is None:
+            nc = netCDF4.Dataset(dataset._filename)
+            self._reader = dataset.__class__(dataset._filename, dataset._datasettype, nc=nc)
+        # Pick up changes to how the dataset reads
+        self._reader._block_cache = dataset._block_cache
+        self._reader._slab_ratio = dataset._slab_ratio
+        if hasattr(dataset, "_max_read_bytes"):
+            self._reader._max_read_bytes = dataset._max_read_bytes
+        self._reader._get_data(var, indices)
+
+    def _close(self):
+        if self._reader is None:
+            return
+        try:
+            with read_lock:
+                self._reader.closenc()
+        except StandardError:
+            logger.warn("Could not close the prefetch handle of %s" % self._reader._filename)
+        self._reader = None
+
+    def get_stopped(self):
+        return self._stopped
+    stopped = property(get_stopped, None)
@@ -0,0 +1,86 @@
+import numpy as np
+
+def monotonic(values):
+    """
+        1 if 'values' never decrease, -1 if they never increase, and 0 if
+        they do both or hold NaNs (so can't be binary searched)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 1 or np.isnan(values).any():
+        return 0
+    diff = np.diff(values)
+    if np.all(diff >= 0):
+        return 1
+    if np.all(diff <= 0):
+        return -1
+    return 0
+
+def search(values, targets, select='nearest', order=None, block=1024):
+    """
+        Index into 'values' for each of 'targets':
+            'nearest' - of the nearest value (the first, if tied)
+            'before'  - of the largest value <= the target, or -1
+            'after'   - of the smallest value >= the target, or len(values)
+
+        'order' is what monotonic() returns for values, worked out if not
+        given.  Monotonic values are binary searched; anything else is
+        scanned, 'block' targets at a time.
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    targets = np.asarray(targets, dtype=np.float64).ravel()
+    if order is None:
+        order = monotonic(values)
+    if values.size == 0:
+        return np.zeros(targets.size, dtype=np.int64) - 1
+    if order == 0:
+        return _scan(values, targets, select, block)
+
+    # Search an increasing copy: the values negated if they decrease
+    ascending = values * order
+    targets = targets * order
+    n = ascending.size
+    if select == 'nearest':
+        right = np.clip(np.searchsorted(ascending, targets, side='left'), 1, max(n - 1, 1))
+        left = right - 1
+        if n == 1:
+            return np.zeros(targets.size, dtype=np.int64)
+        use_left = (targets - ascending[left]) <= (ascending[right] - targets)
+        chosen = np.where(use_left, left, right)
+        # The first of any repeated values
+        return np.searchsorted(ascending, ascending[chosen], side='left').astype(np.int64)
+    if select == 'before':
+        # values <= target, which are negated values >= negated target
+        if order == 1:
+            inds = np.searchsorted(ascending, targets, side='right') - 1
+        else:
+            inds = np.searchsorted(ascending, targets, side='left')
+        return np.where(np.logical_or(inds < 0, inds >= n), -1, inds).astype(np.int64)
+    if select == 'after':
+        if order == 1:
+            inds = np.searchsorted(ascending, targets, side='left')
+        else:
+            inds = np.searchsorted(ascending, targets, side='right') - 1
+        return np.where(np.logical_or(inds < 0, inds >= n), n, inds).astype(np.int64)
+    raise ValueError("select must be 'nearest', 'before' or 'after', not %s" % select)
+
+def _scan(values, targets, select, block):
+    inds = np.empty(targets.size, dtype=np.int64)
+    valid = np.isnan(values) == False
+    # NaN values are never matched, there's no need to warn about them
+    values = np.where(valid, values, 0)
+    for i in range(0, targets.size, block):
+        chunk = targets[i:i+block, np.newaxis]
+        if select == 'nearest':
+            distance = np.where(valid, np.abs(values - chunk), np.inf)
+            inds[i:i+block] = np.argmin(distance, axis=1)
+        elif select == 'before':
+            below = np.logical_and(valid, values <= chunk)
+            found = np.argmax(np.where(below, values, -np.inf), axis=1)
+            inds[i:i+block] = np.where(below.any(axis=1), found, -1)
+        elif select == 'after':
+            above = np.logical_and(valid, values >= chunk)
+            found = np.argmin(np.where(above, values, np.inf), axis=1)
+            inds[i:i+block] = np.where(above.any(axis=1), found, values.size)
+        else:
+            raise ValueError("select must be 'nearest', 'before' or 'after', not %s" % select)
+    return inds
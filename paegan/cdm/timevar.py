@@ -7,8 +7,8 @@
 import numpy as np
 import netCDF4, datetime
 from dateutil.parser import parse
-import bisect
 import pytz
+from paegan.cdm.search import search, monotonic
 
 # Same basedate as matplotlib: http://matplotlib.org/api/dates_api.html#matplotlib.dates.num2date
 timevar_units = 'days since 0001-01-01 00:00:00'
@@ -19,6 +19,92 @@ def date2num(python_datetime):
 def num2date(indatenum, inunits, tzinfo=None):
     return np.vectorize(lambda x: x.replace(tzinfo=tzinfo))(netCDF4.num2date(indatenum, inunits, 'proleptic_gregorian'))
 
+def _normalize_units(units):
+    """
+        CF convention v1.0/udunits names of time units, as the names Timevar uses
+    """
+    units = units.lower()
+    if units in ['second','sec','secs','s']:
+        units='seconds'
+    if units in ['min','minute','mins']:
+        units='minutes'
+    if units in ['h','hs','hr','hrs','hour']:
+        units='hours'
+    if units in ['day','d','ds']:
+        units='days'
+    return units
+
+# Columns of "YYYY-MM-DD?hh:mm:ss" holding digits, and the separators
+_iso_digits = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+_iso_separators = {4: "-", 7: "-", 10: "T_ ", 13: ":", 16: ":"}
+
+def _days_from_civil(year, month, day):
+    """
+        Days since 0001-01-01 of proleptic gregorian dates (integer arrays)
+    """
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    # Eras start on 0000-03-01, 306 days before 0001-01-01
+    return era * 146097 + doe - 306
+
+def parse_char_times(chars):
+    """
+        Days since 0001-01-01 of the times in a 2-D char array, one per row.
+
+        Rows that all share the "YYYY-MM-DD?hh:mm:ss" layout (the date and
+        time split by 'T', '_' or ' ', optionally ending in 'Z', then
+        padding) are read by slicing the digits out of the array.  Returns
+        None if any row doesn't fit, so they can be parsed one at a time.
+    """
+    chars = np.asarray(chars)
+    if chars.ndim != 2 or chars.shape[1] < 19 or chars.shape[0] == 0:
+        return None
+    codes = np.ascontiguousarray(chars.astype('S1')).view(np.uint8).reshape(chars.shape)
+
+    digits = codes[:, _iso_digits].astype(np.int64) - ord('0')
+    if np.any(digits < 0) or np.any(digits > 9):
+        return None
+    for column, allowed in _iso_separators.items():
+        if not np.all(np.in1d(codes[:, column], [ord(c) for c in allowed])):
+            return None
+    rest = codes[:, 19:]
+    if rest.shape[1] > 0:
+        zulu = rest[:, 0] == ord('Z')
+        rest = np.where(zulu[:, np.newaxis] & (np.arange(rest.shape[1]) == 0), 0, rest)
+        if not np.all(np.in1d(rest, [0, ord(' ')])):
+            return None
+
+    def field(start, width):
+        value = np.zeros(codes.shape[0], dtype=np.int64)
+        for i in range(start, start + width):
+            value = value * 10 + digits[:, i]
+        return value
+    year, month, day = field(0, 4), field(4, 2), field(6, 2)
+    hour, minute, second = field(8, 2), field(10, 2), field(12, 2)
+    if np.any(year < 1) or np.any((month < 1) | (month > 12)) or np.any(day < 1) or \
+       np.any(hour > 23) or np.any(minute > 59) or np.any(second > 59):
+        return None
+
+    first = np.ones_like(day)
+    days_in_month = _days_from_civil(year + (month == 12), month % 12 + 1, first) - _days_from_civil(year, month, first)
+    if np.any(day > days_in_month):
+        return None
+    return _days_from_civil(year, month, day) + (hour * 3600 + minute * 60 + second) / 86400.
+
+def values2dates(values, units, tzinfo=pytz.utc):
+    """
+        Datetimes of raw time values in a CF units string, read the way
+        Timevar reads them.  For when only a few of them are needed.
+    """
+    units_split = units.split(' ', 2)
+    assert len(units_split) == 3 and units_split[1] == 'since', \
+        'units string improperly formatted\n' + units
+    origin = "%04d-%02d-%02dT%02d:%02d:%02d" % parse(units_split[2]).timetuple()[:6]
+    return num2date(np.asarray(values, dtype=np.float64), _normalize_units(units_split[0]) + " since " + origin, tzinfo=tzinfo)
+
 class Timevar(np.ndarray):
     
     _unit2sec={}
@@ -35,68 +121,78 @@ class Timevar(np.ndarray):
     _sec2unit['hours'] = 1.0/3600.0
     _sec2unit['days'] = 1.0/(24.0*3600.0)
 
-    def __new__(self, ncfile, name='time', units=None, tzinfo=None, **kwargs):
+    def __new__(cls, ncfile, name='time', units=None, tzinfo=None, **kwargs):
         if type(ncfile) is str:
             ncfile = netCDF4.Dataset(ncfile)
-        self._nc = ncfile
         
-        if self._nc.variables[name].ndim > 1:
-            _str_data = self._nc.variables[name][:,:]
-            if units == None:
+        if ncfile.variables[name].ndim > 1:
+            _str_data = ncfile.variables[name][:,:]
+            if units is None:
                 units = timevar_units
-            dates = [parse(_str_data[i, :].tostring()) for i in range(len(_str_data[:,0]))]
-            data = netCDF4.date2num(dates, units)
+            data = parse_char_times(_str_data)
+            units_split = units.split(' ', 2)
+            if data is not None and units != timevar_units:
+                unit = _normalize_units(units_split[0])
+                if len(units_split) == 3 and unit in cls._unit2sec:
+                    start = date2num(parse(units_split[2]).replace(tzinfo=None))
+                    data = (data - start) * cls._unit2sec['days'] / cls._unit2sec[unit]
+                else:
+                    data = None
+            if data is None:
+                # Irregular strings, one at a time
+                dates = [parse(_str_data[i, :].tostring()) for i in range(len(_str_data[:,0]))]
+                data = netCDF4.date2num(dates, units, 'proleptic_gregorian')
         else:
-            data = self._nc.variables[name][:]
+            data = ncfile.variables[name][:]
             
-        if units == None:
+        if units is None:
             try:
-                self._units = self._nc.variables[name].units
+                units = ncfile.variables[name].units
             except StandardError:
-                self._units = units
-        else:
-            self._units = units
-
-        if tzinfo == None:
-            self._tzinfo = pytz.utc
-        else:
-            self._tzinfo = tzinfo
+                pass
 
+        if tzinfo is None:
+            tzinfo = pytz.utc
         
-        units_split=self._units.split(' ',2)
+        units_split=units.split(' ',2)
         assert len(units_split) == 3 and units_split[1] == 'since', \
-            'units string improperly formatted\n' + self._units
-        self.origin=parse(units_split[2])
-        
-        self._units = units_split[0].lower()
+            'units string improperly formatted\n' + units
         
-        # compatibility to CF convention v1.0/udunits names:
-        if self._units in ['second','sec','secs','s']:
-            self._units='seconds'
-        if self._units in ['min','minute','mins']:
-            self._units='minutes'
-        if self._units in ['h','hs','hr','hrs','hour']:
-            self._units='hours'
-        if self._units in ['day','d','ds']:
-            self._units='days'
-
-        return data.view(self)
+        units = _normalize_units(units_split[0])
+
+        # Kept on the instance (and carried to views by __array_finalize__),
+        # so two Timevars don't share units
+        self = np.asarray(data).view(cls)
+        self._nc = ncfile
+        self._units = units
+        self._tzinfo = tzinfo
+        self.origin = parse(units_split[2])
+        return self
+
+    def __array_finalize__(self, obj):
+        # Views and slices keep the units, but work out their own datenums
+        self._nc = getattr(obj, '_nc', None)
+        self._units = getattr(obj, '_units', None)
+        self._tzinfo = getattr(obj, '_tzinfo', None)
+        self.origin = getattr(obj, 'origin', None)
+        self._datenum = None
+        self._order = None
     
     def gettimestep(self):
         return self.seconds[1] - self.seconds[0]
     
     def nearest_index(self, dateo, select='nearest'):
-        to = date2num(dateo)
+        """
+            Index of the step nearest to a datetime (or each of a list of
+            them), or with select='before'/'after' of the last step at or
+            before it (-1 if none) / the first step at or after it (the
+            length if none).  Binary searched when time is monotonic.
+        """
+        to = np.atleast_1d(date2num(dateo))
+        inds = search(self.datenum, to, select, self.order)
         if select == 'nearest':
-            try:
-                return [np.where(abs(self.datenum-t) == np.nanmin(abs(self.datenum-t)))[0][0] for t in to]
-            except TypeError:
-                return [np.where(abs(self.datenum-to) == np.nanmin(abs(self.datenum-to)))[0][0]]
-        elif select == 'before':
-            try: 
-                return np.asarray([bisect.bisect(self.datenum, t)-1 for t in to])
-            except TypeError:
-                return np.asarray([bisect.bisect(self.datenum, to)-1])
+            return list(inds)
+        return inds
     
     def nearest(self, dateo):
         """
@@ -127,12 +223,52 @@ class Timevar(np.ndarray):
         return np.asarray(self,dtype='float64')*fac
 
     def get_dates(self):
-        return num2date(self, self._units + " since " + self.origin.strftime('%Y-%m-%dT%H:%M:%S'), tzinfo=self._tzinfo)
+        # Not strftime, which refuses years before 1900 (like the default origin)
+        origin = "%04d-%02d-%02dT%02d:%02d:%02d" % self.origin.timetuple()[:6]
+        return num2date(self, self._units + " since " + origin, tzinfo=self._tzinfo)
     
     def get_datenum(self):
-        return date2num(self.dates)
+        """
+            Days since 0001-01-01 (UTC) of each step, worked out from the
+            units and origin once and kept.  Use this rather than dates
+            to search or compare times.
+        """
+        if self._datenum is None:
+            self._datenum = self._compute_datenum()
+        return self._datenum
+
+    def _compute_datenum(self):
+        offset = None
+        if self._tzinfo is not None:
+            offset = self._tzinfo.utcoffset(self.origin.replace(tzinfo=None))
+        if self._units in self._unit2sec and (offset is None or offset == datetime.timedelta(0)):
+            start = date2num(self.origin.replace(tzinfo=None))
+            fac = self._unit2sec[self._units] * self._sec2unit['days']
+            return start + np.asarray(self, dtype=np.float64) * fac
+        # Offsets that may change from step to step (daylight saving)
+        return np.asarray(date2num(self.dates), dtype=np.float64)
+
+    def datenum_of(self, dateo):
+        """
+            The datenum of a datetime (or datetimes), read in this
+            variable's timezone as the dates are
+        """
+        try:
+            return np.asarray(date2num([d.replace(tzinfo=self._tzinfo) for d in dateo]), dtype=np.float64)
+        except TypeError:
+            return date2num(dateo.replace(tzinfo=self._tzinfo))
         
-    datenum = property(get_datenum, None, doc="datenum in seconds since 1970-01-01")
+    def get_order(self):
+        """
+            1 if time never goes backwards, -1 if it never goes forwards,
+            0 otherwise (see paegan.cdm.search.monotonic)
+        """
+        if self._order is None:
+            self._order = monotonic(self.datenum)
+        return self._order
+
+    datenum = property(get_datenum, None, doc="datenum in days since 0001-01-01")
+    order = property(get_order, None)
     seconds = property(get_seconds, None, doc="seconds")
     minutes = property(get_minutes, None, doc="minutes")
     hours = property(get_hours, None, doc="hours")
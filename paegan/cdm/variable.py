@@ -27,11 +27,11 @@ class Coordinates(object):
     
     def _getinfo(self):
        info = ""
-       if self.xy != None:
+       if self.xy is not None:
            info = info + "[XY]"
-       if self.z != None:
+       if self.z is not None:
            info = info + "[Z]"
-       if self.time != None:
+       if self.time is not None:
            info = info + "[T]"
        return info
        
@@ -52,6 +52,16 @@ class Coordinates(object):
     y = property(get_yarray)
     
     
+class CoordinateInfo(object):
+    """
+    The coordinate variable names of a field variable, and the axes of the field
+    variable that each of them span.  Resolved once and kept by the dataset obj.
+    """
+    def __init__(self, names, positions):
+        self.names = names
+        self.positions = positions
+
+
 class SubCoordinates(object):
     def __init__(self, **kwargs):
         self.x = None
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 class GreatCircle(object):
     # -----------------------------------------------------------------------
@@ -124,6 +125,114 @@ class GreatCircle(object):
                 alpha21 = alpha21 - two_pi
 
         return s, alpha12,  alpha21 
+
+    @staticmethod
+    def vinc_dist_array( f, a, phi1, lembda1, phi2, lembda2, max_iterations=200 ) :
+        """
+
+        Array version of vinc_dist.  All of the points are iterated
+        together, and an element drops out of the iteration as soon as
+        its lembda has converged.  Inputs are broadcast against each other.
+        lats, longs and azimuths are in radians, distance in metres
+
+        Returns ( s, alpha12,  alpha21 ) as a tuple of ndarrays
+
+        """
+
+        phi1, lembda1, phi2, lembda2 = np.broadcast_arrays(
+            np.asarray(phi1, dtype=np.float64), np.asarray(lembda1, dtype=np.float64),
+            np.asarray(phi2, dtype=np.float64), np.asarray(lembda2, dtype=np.float64))
+        shape = phi1.shape
+        # Work on flat copies, reshaped on the way out
+        phi1, lembda1, phi2, lembda2 = [np.array(x).ravel() for x in (phi1, lembda1, phi2, lembda2)]
+
+        two_pi = 2.0*math.pi
+
+        b = a * (1.0 - f)
+
+        U1 = np.arctan( (1-f) * np.tan( phi1 ) )
+        U2 = np.arctan( (1-f) * np.tan( phi2 ) )
+        sinU1, cosU1 = np.sin(U1), np.cos(U1)
+        sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+        omega = lembda2 - lembda1
+        lembda = omega.copy()
+
+        sqr_sin_sigma = np.zeros(lembda.shape)
+        Sin_sigma = np.zeros(lembda.shape)
+        Cos_sigma = np.zeros(lembda.shape)
+        sigma = np.zeros(lembda.shape)
+        cos_sq_alpha = np.zeros(lembda.shape)
+        Cos2sigma_m = np.zeros(lembda.shape)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Same point, the scalar version returns zeros for these
+            same = (np.abs( phi2 - phi1 ) < 1e-8) & (np.abs( omega ) < 1e-8)
+
+            # Indexes of the points still iterating
+            active = np.flatnonzero(~same)
+
+            for i in range(max_iterations):
+                if active.size == 0:
+                    break
+
+                lem = lembda[active]
+                s1, c1, s2, c2 = sinU1[active], cosU1[active], sinU2[active], cosU2[active]
+                sin_lem, cos_lem = np.sin(lem), np.cos(lem)
+
+                sqr = (c2 * sin_lem)**2 + (c1 * s2 - s1 * c2 * cos_lem)**2
+                ssig = np.sqrt(sqr)
+                csig = s1 * s2 + c1 * c2 * cos_lem
+                sig = np.arctan2(ssig, csig)
+
+                Sin_alpha = c1 * c2 * sin_lem / np.sin(sig)
+                csa = 1.0 - Sin_alpha**2
+                # Equatorial lines have cos^2(alpha) == 0, where Cos2sigma_m is taken as zero
+                c2sm = np.where(csa != 0, np.cos(sig) - (2 * s1 * s2 / csa), 0.0)
+
+                C = (f/16) * csa * (4 + f * (4 - 3 * csa))
+
+                new_lem = omega[active] + (1-C) * f * Sin_alpha * (sig + C * np.sin(sig) * \
+                        (c2sm + C * np.cos(sig) * (-1 + 2 * c2sm**2)))
+
+                sqr_sin_sigma[active], Sin_sigma[active], Cos_sigma[active] = sqr, ssig, csig
+                sigma[active], cos_sq_alpha[active], Cos2sigma_m[active] = sig, csa, c2sm
+                lembda[active] = new_lem
+
+                # Same stopping rule as the scalar version.  NaN elements
+                # compare False and drop out, just like they do there.
+                keep = (new_lem != 0) & (np.abs( (lem - new_lem) / new_lem ) > 1.0e-9)
+                active = active[keep]
+
+            u2 = cos_sq_alpha * (a*a-b*b) / (b*b)
+
+            A = 1 + (u2/16384) * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+
+            B = (u2/1024) * (256 + u2 * (-128+ u2 * (74 - 47 * u2)))
+
+            delta_sigma = B * Sin_sigma * (Cos2sigma_m + (B/4) * \
+                    (Cos_sigma * (-1 + 2 * Cos2sigma_m**2) - \
+                    (B/6) * Cos2sigma_m * (-3 + 4 * sqr_sin_sigma) * \
+                    (-3 + 4 * Cos2sigma_m**2)))
+
+            s = b * A * (sigma - delta_sigma)
+
+            sin_lem, cos_lem = np.sin(lembda), np.cos(lembda)
+            alpha12 = np.arctan2( cosU2 * sin_lem, cosU1 * sinU2 - sinU1 * cosU2 * cos_lem )
+            alpha21 = np.arctan2( cosU1 * sin_lem, -sinU1 * cosU2 + cosU1 * sinU2 * cos_lem )
+
+            alpha12 = np.where( alpha12 < 0.0, alpha12 + two_pi, alpha12 )
+            alpha12 = np.where( alpha12 > two_pi, alpha12 - two_pi, alpha12 )
+
+            alpha21 = alpha21 + two_pi / 2.0
+            alpha21 = np.where( alpha21 < 0.0, alpha21 + two_pi, alpha21 )
+            alpha21 = np.where( alpha21 > two_pi, alpha21 - two_pi, alpha21 )
+
+        s[same] = 0.0
+        alpha12[same] = 0.0
+        alpha21[same] = 0.0
+
+        return s.reshape(shape), alpha12.reshape(shape),  alpha21.reshape(shape)
         
         
     #----------------------------------------------------------------------------
@@ -224,4 +333,112 @@ class GreatCircle(object):
                 alpha21 = alpha21 - two_pi
 
 
-        return phi2,  lembda2,  alpha21 
\ No newline at end of file
+        return phi2,  lembda2,  alpha21 
+
+    @staticmethod
+    def vinc_pt_array( f, a, phi1, lembda1, alpha12, s, max_iterations=200 ) :
+        """
+
+        Array version of vinc_pt.  All of the points are iterated
+        together, and an element drops out of the iteration as soon as
+        its sigma has converged.  Inputs are broadcast against each other.
+        lats, longs and azimuths are passed in RADIANS
+
+        Returns ( phi2,  lambda2,  alpha21 ) as a tuple of ndarrays, all in radians
+
+        """
+
+        phi1, lembda1, alpha12, s = np.broadcast_arrays(
+            np.asarray(phi1, dtype=np.float64), np.asarray(lembda1, dtype=np.float64),
+            np.asarray(alpha12, dtype=np.float64), np.asarray(s, dtype=np.float64))
+        shape = phi1.shape
+        # Work on flat copies, reshaped on the way out
+        phi1, lembda1, alpha12, s = [np.array(x).ravel() for x in (phi1, lembda1, alpha12, s)]
+
+        two_pi = 2.0*math.pi
+
+        alpha12 = np.where( alpha12 < 0.0, alpha12 + two_pi, alpha12 )
+        alpha12 = np.where( alpha12 > two_pi, alpha12 - two_pi, alpha12 )
+
+        b = a * (1.0 - f)
+
+        TanU1 = (1-f) * np.tan(phi1)
+        U1 = np.arctan( TanU1 )
+        sinU1, cosU1 = np.sin(U1), np.cos(U1)
+        sin_alpha12, cos_alpha12 = np.sin(alpha12), np.cos(alpha12)
+        sigma1 = np.arctan2( TanU1, cos_alpha12 )
+        Sinalpha = cosU1 * sin_alpha12
+        cosalpha_sq = 1.0 - Sinalpha * Sinalpha
+
+        u2 = cosalpha_sq * (a * a - b * b ) / (b * b)
+        A = 1.0 + (u2 / 16384) * (4096 + u2 * (-768 + u2 * \
+                (320 - 175 * u2) ) )
+        B = (u2 / 1024) * (256 + u2 * (-128 + u2 * (74 - 47 * u2) ) )
+
+        # Starting with the approximation
+        first = s / (b * A)
+        sigma = first.copy()
+        two_sigma_m = np.zeros(sigma.shape)
+
+        # Not moving anywhere.  These return the location that was passed in.
+        still = sigma == 0
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Indexes of the points still iterating
+            active = np.flatnonzero(~still)
+
+            for i in range(max_iterations):
+                if active.size == 0:
+                    break
+
+                sig = sigma[active]
+                tsm = 2 * sigma1[active] + sig
+                cos_tsm = np.cos(tsm)
+                Ba = B[active]
+
+                delta_sigma = Ba * np.sin(sig) * ( cos_tsm \
+                            + (Ba/4) * (np.cos(sig) * \
+                            (-1 + 2 * cos_tsm**2 - \
+                            (Ba/6) * cos_tsm * \
+                            (-3 + 4 * np.sin(sig)**2) * \
+                            (-3 + 4 * cos_tsm**2))))
+
+                new_sig = first[active] + delta_sigma
+
+                two_sigma_m[active] = tsm
+                sigma[active] = new_sig
+
+                # Same stopping rule as the scalar version
+                keep = np.abs( (sig - new_sig) / new_sig ) > 1.0e-9
+                active = active[keep]
+
+            sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+            cos_tsm = np.cos(two_sigma_m)
+
+            phi2 = np.arctan2 ( (sinU1 * cos_sigma + cosU1 * sin_sigma * cos_alpha12 ), \
+                    ((1-f) * np.sqrt( Sinalpha**2 + \
+                    (sinU1 * sin_sigma - cosU1 * cos_sigma * cos_alpha12)**2)))
+
+            lembda = np.arctan2( (sin_sigma * sin_alpha12 ), (cosU1 * cos_sigma - \
+                    sinU1 * sin_sigma * cos_alpha12))
+
+            C = (f/16) * cosalpha_sq * (4 + f * (4 - 3 * cosalpha_sq ))
+
+            omega = lembda - (1-C) * f * Sinalpha * \
+                    (sigma + C * sin_sigma * (cos_tsm + \
+                    C * cos_sigma * (-1 + 2 * cos_tsm**2)))
+
+            lembda2 = lembda1 + omega
+
+            alpha21 = np.arctan2 ( Sinalpha, (-sinU1 * sin_sigma + \
+                    cosU1 * cos_sigma * cos_alpha12))
+
+            alpha21 = alpha21 + two_pi / 2.0
+            alpha21 = np.where( alpha21 < 0.0, alpha21 + two_pi, alpha21 )
+            alpha21 = np.where( alpha21 > two_pi, alpha21 - two_pi, alpha21 )
+
+        phi2[still] = phi1[still]
+        lembda2[still] = lembda1[still]
+        alpha21[still] = alpha12[still]
+
+        return phi2.reshape(shape),  lembda2.reshape(shape),  alpha21.reshape(shape)
@@ -1,7 +1,17 @@
 import os.path
 import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import netCDF4
+from paegan.cdm.pool import LockedHandle
+
+# Arrays with at least this many values are averaged in blocks of rows
+# by a pool of threads (NumPy releases the GIL while it adds them up)
+_parallel_size = 1024 * 1024
+_workers = multiprocessing.cpu_count()
+_pool = None
+_pool_lock = threading.Lock()
 
 #       ---------------------------------
 #       rho | u | rho | u | rho | u | rho
@@ -65,91 +75,183 @@ def shrink(a, b):
         b = (b,)
         
     if len(a.shape) == 1:                # 1D array is a special case
-        dim = b[-1]                      
-        while a.shape[0] > dim:          # only shrink a
-            if (dim - a.shape[0]) >= 2:  # trim off edges evenly
-                a = a[1:-1]
-            else:                        # or average adjacent cells
-                a = 0.5*(a[1:] + a[:-1])
+        # 1D arrays have always been shrunk by averaging adjacent cells
+        # once for every cell too many, never by trimming.
+        passes = a.shape[0] - b[-1]
+        if passes > 0:
+            a = _average_passes(a, passes)
     else:
         for dim_idx in range(-(len(a.shape)),0):
             dim = b[dim_idx]
-            a = a.swapaxes(0,dim_idx)        # put working dim first
-            while a.shape[0] > dim:          # only shrink a
-                if (a.shape[0] - dim) >= 2:  # trim off edges evenly
-                    a = a[1:-1,:]
-                if (a.shape[0] - dim) == 1:  # or average adjacent cells
-                    a = 0.5*(a[1:,:] + a[:-1,:])
-            a = a.swapaxes(0,dim_idx)        # swap working dim back
+            axis = a.ndim + dim_idx
+            extra = a.shape[axis] - dim         # only shrink a
+            if extra <= 0:
+                continue
+            # Trim off edges evenly (a view), and average adjacent cells
+            # if that leaves one too many
+            trim = extra // 2
+            a = a[(slice(None),)*axis + (slice(trim, a.shape[axis]-trim),)]
+            if extra % 2 == 1:
+                a = _average(a, axis)
         
     return a
 
-def uv_to_rho(file):
-    nc = netCDF4.Dataset(file)
-
-    lat_rho=nc.variables['lat_rho']
-    lon_rho=nc.variables['lon_rho']
-
-    # lat_rho and lon_rho should have identical shapes (eta,xi)/(y/x)
-    if lat_rho.shape != lon_rho.shape:
-        print "Shape of lat_rho and lon_rho must be equal"
-        return None
-
-    # Store shape for use below
-    [rho_y,rho_x] = lat_rho.shape
-
-    # U
-    u_data = nc.variables['u'][0,0,:,:]
-
-    # V
-    v_data = nc.variables['v'][0,0,:,:]
-
-    # Get the angles
-    angle = nc.variables['angle'][:,:]
-
-    # Create empty rho matrix to store complex U + Vj
-    U = np.empty([rho_y,rho_x], dtype=complex )
-    # And fill it with with nan values
-    U[:] = np.nan
-
-    vfunc = np.vectorize(complex)
-
-    # THREE IDENTICAL METHODS
-    # Fill in RHO cells per diagram above.  Skip first row and first
-    # column of RHOs and leave them as numpy.nan values.  Also skip the 
-    # last row and column.
-
-    #1.) 
-    # Fill rho points with averages (if we can do the calculation)
-    # Thread]
-    t1 = AverageAdjacents(u_data)
-    t2 = AverageAdjacents(v_data, True)
-    t1.start(); t2.start()
-    t1.join();  t2.join()
-    u_avg = t1.data
-    v_avg = t2.data
-    complexed = vfunc(u_avg[1:-1,:],v_avg[:,1:-1])
-
-    # 2.) 
-    # Don't thread
-    #u_avg = average_adjacents(u_data)
-    #v_avg = average_adjacents(v_data,True)
-    #complexed = vfunc(u_avg[1:-1,:],v_avg[:,1:-1])
-
-    # 3.)
-    # Use Octant method
-    #data_U = (rho_y-2,rho_x-2)
-    #u_avg = shrink(u_data, data_U)
-    #v_avg = shrink(v_data, data_U)
-    #complexed = vfunc(u_avg,v_avg)
-    
-    # Only pull the U and V values that can contribute to the averaging (see diagram).
-    # This means we lost the first and last row and the first and last column of both
-    # U and V.   
-    U[1:rho_y-1, 1:rho_x-1] = complexed
- 
-    # We need the rotated point, so rotate by the "angle"
-    return rotate_complex_by_angle(U,angle)
+def _average_passes(a, passes):
+    """
+        Average adjacent values of a 1D array 'passes' times over, going
+        back and forth between two buffers
+    """
+    if isinstance(a, np.ma.MaskedArray):
+        for i in range(passes):
+            a = _average(a, 0)
+        return a
+    n = a.shape[0] - 1
+    buffers = [_average(a, 0), np.empty(max(n - 1, 0), dtype=np.result_type(a.dtype, 0.5))]
+    lo, hi = (slice(0, -1),), (slice(1, None),)
+    for i in range(1, passes):
+        _average_block(buffers[(i - 1) % 2][:n], buffers[i % 2][:n-1], lo, hi)
+        n -= 1
+    return buffers[(passes - 1) % 2][:n]
+
+def _axis_indexes(selection, size):
+    """
+        Indexes along an axis of 'size' for a slice, a sequence of indexes,
+        or None (all of them)
+    """
+    if selection is None:
+        return np.arange(size)
+    if isinstance(selection, slice):
+        return np.arange(size)[selection]
+    return np.atleast_1d(np.asarray(selection, dtype=np.int64))
+
+def uv_to_rho(file, times=None, levels=None, chunk=1, output=None, uname="u", vname="v"):
+    """
+        Average u and v onto the rho points and rotate them by the grid
+        'angle' into eastward and northward components.
+
+        file:   An open paegan Dataset (see CommonDataset.open).  Its
+                grid must not be restricted, so that u, v and rho line
+                up.
+        times:  Time indexes (a slice or a sequence), all by default
+        levels: s_rho indexes (a slice or a sequence), all by default
+        chunk:  How many timesteps are read and worked on at once, which
+                bounds the memory used
+        output: None to return (east, north) arrays, or the path of a
+                netCDF file (or an open netCDF4.Dataset) to write them to
+                as 'u_east' and 'v_north', a chunk at a time
+
+        The results are (t, z, eta_rho, xi_rho), or (t, eta_rho, xi_rho)
+        for 3-D u and v (ubar/vbar).  The first and last rows and columns
+        of rho points can't be averaged onto, so are NaN.
+
+        For compatibility, a path or URL can be passed instead of a
+        Dataset, which returns the rotated first time and level as a 2-D
+        complex array (east + north*j).
+    """
+    if isinstance(file, basestring):
+        from paegan.cdm.dataset import CommonDataset
+        dataset = CommonDataset.open(file)
+        try:
+            east, north = uv_to_rho(dataset, times=[0], levels=[0], uname=uname, vname=vname)
+        finally:
+            dataset.closenc()
+        return (east + 1j*north).reshape(east.shape[-2:])
+
+    nc = file.nc
+    uvar = nc.variables[uname]
+    rotation = get_rotation(file)
+    [rho_y, rho_x] = rotation.shape
+    rotation = rotation.subset(slice(1, -1), slice(1, -1))
+
+    tinds = _axis_indexes(times, uvar.shape[0])
+    depth_axes = uvar.ndim == 4
+    zinds = _axis_indexes(levels, uvar.shape[1]) if depth_axes else None
+    shape = (tinds.size, zinds.size, rho_y, rho_x) if depth_axes else (tinds.size, rho_y, rho_x)
+
+    if output is None:
+        east = np.empty(shape)
+        north = np.empty(shape)
+    else:
+        out_nc, east, north = _uv_output(output, nc, uvar, tinds, zinds, shape)
+
+    try:
+        for start in range(0, tinds.size, chunk):
+            tchunk = tinds[start:start+chunk]
+            u = file.get_values(uname, timeinds=[tchunk], zinds=[zinds])
+            v = file.get_values(vname, timeinds=[tchunk], zinds=[zinds])
+            u = np.ma.filled(np.ma.asarray(u, dtype=np.float64), np.nan)
+            v = np.ma.filled(np.ma.asarray(v, dtype=np.float64), np.nan)
+            if u.shape[-2:] != (rho_y, rho_x-1) or v.shape[-2:] != (rho_y-1, rho_x):
+                raise ValueError("%s %s and %s %s are not on the u and v points of a %s rho grid" %
+                                 (uname, str(u.shape[-2:]), vname, str(v.shape[-2:]), str((rho_y, rho_x))))
+
+            if output is None:
+                east_block = east[start:start+tchunk.size]
+                north_block = north[start:start+tchunk.size]
+            else:
+                east_block = np.empty((tchunk.size,) + shape[1:])
+                north_block = np.empty((tchunk.size,) + shape[1:])
+
+            # Only the u and v that can contribute to the averaging (see
+            # diagram), so we lose the first and last row and column.
+            for block in (east_block, north_block):
+                block[..., 0, :] = block[..., -1, :] = np.nan
+                block[..., :, 0] = block[..., :, -1] = np.nan
+            u_rho = east_block[..., 1:-1, 1:-1]
+            v_rho = north_block[..., 1:-1, 1:-1]
+            average_adjacents(u[..., 1:-1, :], out=u_rho)
+            average_adjacents(v[..., 1:-1], True, out=v_rho)
+            rotation.rotate(u_rho, v_rho, east=u_rho, north=v_rho)
+
+            if output is not None:
+                east[start:start+tchunk.size] = east_block
+                north[start:start+tchunk.size] = north_block
+    finally:
+        if output is not None and not isinstance(output, netCDF4.Dataset):
+            out_nc.close()
+
+    if output is None:
+        return east, north
+    return output
+
+def _uv_output(output, nc, uvar, tinds, zinds, shape):
+    """
+        The netCDF file to write uv_to_rho to, and its u_east and v_north
+        variables.  The times, levels and rho coordinates are copied over.
+    """
+    if isinstance(output, netCDF4.Dataset):
+        out_nc = output
+    else:
+        out_nc = netCDF4.Dataset(output, "w")
+    angle = nc.variables['angle']
+    dims = list(uvar.dimensions[:-2]) + list(angle.dimensions)
+    for dim, size in zip(dims, shape):
+        if dim not in out_nc.dimensions:
+            out_nc.createDimension(dim, size)
+
+    selected = {dims[0]: tinds}
+    if zinds is not None:
+        selected[dims[1]] = zinds
+    for name in dims + ['lon_rho', 'lat_rho']:
+        if name in nc.variables and name not in out_nc.variables and \
+           all(d in dims for d in nc.variables[name].dimensions):
+            source = nc.variables[name]
+            copied = out_nc.createVariable(name, source.dtype, source.dimensions)
+            copied.setncatts(dict((a, source.getncattr(a)) for a in source.ncattrs() if a != '_FillValue'))
+            if source.ndim == 1 and name in selected:
+                copied[:] = source[selected[name]]
+            else:
+                copied[:] = source[:]
+
+    east = out_nc.createVariable('u_east', 'f8', dims, fill_value=np.nan)
+    east.long_name = "eastward velocity at rho points"
+    north = out_nc.createVariable('v_north', 'f8', dims, fill_value=np.nan)
+    north.long_name = "northward velocity at rho points"
+    if 'units' in uvar.ncattrs():
+        east.units = north.units = uvar.units
+    if 'lon_rho' in out_nc.variables and 'lat_rho' in out_nc.variables:
+        east.coordinates = north.coordinates = " ".join(["lon_rho", "lat_rho"] + dims[:-2][::-1])
+    return out_nc, east, north
 
 def rotate_complex_by_angle(points,angles):
     """
@@ -164,10 +266,91 @@ def rotate_complex_by_angle(points,angles):
     """
     return points * np.exp(1j*angles)
 
-def average_adjacents(a, by_column=False):
+class Rotation(object):
+    """
+        Turns u and v on a curvilinear grid into eastward and northward
+        components, by the grid's 'angle' (of xi, counterclockwise from
+        east, in radians).
+
+        cos and sin of the angles are worked out once, and applied with
+        real arithmetic to any number of leading (t, z, ...) dimensions:
+
+            east  = u*cos(angle) - v*sin(angle)
+            north = u*sin(angle) + v*cos(angle)
+
+        which is rotate_complex_by_angle(u + v*j, angle) without
+        complex arrays.
+    """
+    def __init__(self, angle=None, cos=None, sin=None):
+        if angle is not None:
+            angle = np.ma.filled(np.ma.asarray(angle, dtype=np.float64), np.nan)
+            cos, sin = np.cos(angle), np.sin(angle)
+        self.cos = cos
+        self.sin = sin
+
+    def get_shape(self):
+        return self.cos.shape
+    shape = property(get_shape, None)
+
+    def subset(self, rows, cols):
+        """
+            The Rotation of part of the grid (views, nothing is copied)
+        """
+        return Rotation(cos=self.cos[rows, cols], sin=self.sin[rows, cols])
+
+    def rotate(self, u, v, east=None, north=None):
+        """
+            (east, north) of u and v, which are (..., y, x) on this grid.
+            They are written into 'east' and 'north' when given, which can
+            be u and v themselves.
+        """
+        u = np.asanyarray(u)
+        v = np.asanyarray(v)
+        shape = np.broadcast(u, v, self.cos).shape
+        dtype = np.result_type(u.dtype, v.dtype, self.cos.dtype)
+        if east is None:
+            east = np.empty(shape, dtype=dtype)
+        if north is None:
+            north = np.empty(shape, dtype=dtype)
+        usin = u * self.sin
+        vsin = v * self.sin
+        np.multiply(u, self.cos, out=east)
+        east -= vsin
+        np.multiply(v, self.cos, out=north)
+        north += usin
+        return east, north
+
+def get_rotation(source, angle="angle"):
+    """
+        The Rotation of the 'angle' variable of a paegan Dataset, an open
+        netCDF4.Dataset or a path.  A CGridDataset keeps it (shared with
+        its copies), so the angles are read once per dataset.
+    """
+    if isinstance(source, basestring):
+        nc = netCDF4.Dataset(source)
+        try:
+            return Rotation(nc.variables[angle][:])
+        finally:
+            nc.close()
+    if isinstance(source, (netCDF4.Dataset, LockedHandle)):
+        return Rotation(source.variables[angle][:])
+    rotations = getattr(source, "_rotations", None)
+    if rotations is None:
+        return Rotation(source.nc.variables[angle][:])
+    if angle not in rotations:
+        rotations[angle] = Rotation(source.nc.variables[angle][:])
+    return rotations[angle]
+
+def average_adjacents(a, by_column=False, out=None):
     """
         Sums adjacent values in a column.  Optional by_column parameter
-        will sum adjacement column values.
+        will sum adjacement column values.  Arrays of more than two
+        dimensions are averaged along their last (or, by_column, their
+        second to last) axis.
+
+        The result is written into 'out' when given, which must be a
+        float array of the right shape, and returned.  Large arrays are
+        worked on by a pool of threads, a block of rows each.
 
         For a row that looks like this:
         [ 2, 4, 6, 8, 10, 12 ]
@@ -219,47 +402,70 @@ def average_adjacents(a, by_column=False):
                    [ 15.,  17.,  19.,  21.,  23.]])
 
     """
-    if by_column:
-        # Easier to transpose, sum by row, and transpose back.
-        #sumd = 0.5 * (a[1:m,:] + a[0:m-1,:])
-        return average_adjacents(a.T).T
-
-    try:
-        [m,n] = a.shape
-    except ValueError:
-        [m,n] = [1,a.size]
-
-    if m == 1:
-        sumd = 0.5 * (a[0:n-1] + a[1:n]) # Single row
-    else:
-        sumd = 0.5 * (a[:,0:n-1] + a[:,1:n]) # By row
+    a = np.asanyarray(a)
+    axis = a.ndim - 2 if by_column and a.ndim > 1 else a.ndim - 1
+    return _average(a, axis, out)
 
-    return sumd
+def _average(a, axis, out=None):
+    """
+        0.5 * (a[i] + a[i+1]) along 'axis', into 'out'
+    """
+    lo = [slice(None)] * a.ndim
+    hi = [slice(None)] * a.ndim
+    lo[axis], hi[axis] = slice(0, -1), slice(1, None)
+    if isinstance(a, np.ma.MaskedArray):
+        # Keep the mask
+        averaged = 0.5 * (a[tuple(lo)] + a[tuple(hi)])
+        if out is None:
+            return averaged
+        out[...] = averaged
+        return out
+
+    shape = list(a.shape)
+    shape[axis] -= 1
+    if out is None:
+        out = np.empty(shape, dtype=np.result_type(a.dtype, 0.5))
+    elif list(out.shape) != shape:
+        raise ValueError("out is %s, it should be %s" % (str(out.shape), str(tuple(shape))))
+
+    # Blocks are taken along the first other axis long enough to split,
+    # so leading axes of length 1 (one timestep) don't stop the split
+    split = [i for i in range(a.ndim) if i != axis and out.shape[i] > 1]
+    if a.size < _parallel_size or _workers < 2 or len(split) == 0:
+        _average_block(a, out, tuple(lo), tuple(hi))
+        return out
+    split = split[0]
+
+    edges = np.linspace(0, out.shape[split], min(_workers, out.shape[split]) + 1).astype(int)
+    blocks = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        rows = [slice(None)] * a.ndim
+        rows[split] = slice(start, stop)
+        rows = tuple(rows)
+        blocks.append((a[rows], out[rows], tuple(lo), tuple(hi)))
+    _thread_pool().map(lambda block: _average_block(*block), blocks)
+    return out
+
+def _average_block(a, out, lo, hi):
+    np.add(a[lo], a[hi], out=out)
+    np.multiply(out, 0.5, out=out)
+
+def _thread_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(_workers)
+    return _pool
 
-# Threaded instance for speed testing on enormous grids.
 class AverageAdjacents(threading.Thread):
+    """
+        Kept for code that ran average_adjacents on a thread of its own.
+        average_adjacents already spreads large arrays over a pool of
+        threads.
+    """
     def __init__(self, data, by_column=False):
         threading.Thread.__init__(self)
         self.by_column = by_column
         self.data = data
     def run(self):
-        if self.by_column:
-            # Easier to transpose, sum by row, and transpose back.
-            #sumd = 0.5 * (a[1:m,:] + a[0:m-1,:])
-            t3 = AverageAdjacents(self.data.T)
-            t3.start(); t3.join()
-            self.data = t3.data.T
-            return
-
-        try:
-            [m,n] = self.data.shape
-        except ValueError:
-            [m,n] = [1,self.data.size]
-
-        if m == 1:
-            sumd = 0.5 * (self.data[0:n-1] + self.data[1:n]) # Single row
-        else:
-            sumd = 0.5 * (self.data[:,0:n-1] + self.data[:,1:n]) # By row
-
-        self.data = sumd
-        return
\ No newline at end of file
+        self.data = average_adjacents(self.data, self.by_column)
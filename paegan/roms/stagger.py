@@ -0,0 +1,167 @@
+import numpy as np
+
+from paegan.roms.roms import average_adjacents, _axis_indexes
+
+#       ROMS Arakawa C-grid, eta (y) by xi (x):
+#
+#       psi | v | psi | v | psi
+#       ---------------------------------
+#        u  |rho|  u  |rho|  u
+#       ---------------------------------
+#       psi | v | psi | v | psi
+#
+#       size(rho)=ny,nx;  size(u)=ny,nx-1;  size(v)=ny-1,nx;  size(psi)=ny-1,nx-1
+#
+#       Every function here works on the last two (y, x) axes, so any
+#       leading dimensions (t, z, ...) are carried along.  Moving onto the
+#       rho grid can't fill the outermost rows or columns of rho points,
+#       they are copied from their neighbours (as Octant's u2rho/v2rho do).
+
+_grids = ["rho", "u", "v", "psi"]
+
+def _output(a, shape, out):
+    if out is None:
+        if isinstance(a, np.ma.MaskedArray):
+            return np.ma.masked_all(shape, dtype=np.result_type(a.dtype, 0.5))
+        return np.empty(shape, dtype=np.result_type(a.dtype, 0.5))
+    if tuple(out.shape) != tuple(shape):
+        raise ValueError("out is %s, it should be %s" % (str(out.shape), str(tuple(shape))))
+    return out
+
+def rho_to_u(a, out=None):
+    a = np.asanyarray(a)
+    return average_adjacents(a, out=_output(a, a.shape[:-1] + (a.shape[-1] - 1,), out))
+
+def rho_to_v(a, out=None):
+    a = np.asanyarray(a)
+    return average_adjacents(a, True, out=_output(a, a.shape[:-2] + (a.shape[-2] - 1, a.shape[-1]), out))
+
+def rho_to_psi(a, out=None):
+    a = np.asanyarray(a)
+    out = _output(a, a.shape[:-2] + (a.shape[-2] - 1, a.shape[-1] - 1), out)
+    return average_adjacents(average_adjacents(a, True), out=out)
+
+def u_to_psi(a, out=None):
+    a = np.asanyarray(a)
+    return average_adjacents(a, True, out=_output(a, a.shape[:-2] + (a.shape[-2] - 1, a.shape[-1]), out))
+
+def v_to_psi(a, out=None):
+    a = np.asanyarray(a)
+    return average_adjacents(a, out=_output(a, a.shape[:-1] + (a.shape[-1] - 1,), out))
+
+def u_to_rho(a, out=None):
+    a = np.asanyarray(a)
+    out = _output(a, a.shape[:-1] + (a.shape[-1] + 1,), out)
+    average_adjacents(a, out=out[..., 1:-1])
+    out[..., 0] = out[..., 1]
+    out[..., -1] = out[..., -2]
+    return out
+
+def v_to_rho(a, out=None):
+    a = np.asanyarray(a)
+    out = _output(a, a.shape[:-2] + (a.shape[-2] + 1, a.shape[-1]), out)
+    average_adjacents(a, True, out=out[..., 1:-1, :])
+    out[..., 0, :] = out[..., 1, :]
+    out[..., -1, :] = out[..., -2, :]
+    return out
+
+def psi_to_rho(a, out=None):
+    a = np.asanyarray(a)
+    out = _output(a, a.shape[:-2] + (a.shape[-2] + 1, a.shape[-1] + 1), out)
+    average_adjacents(average_adjacents(a, True), out=out[..., 1:-1, 1:-1])
+    out[..., 0, :] = out[..., 1, :]
+    out[..., -1, :] = out[..., -2, :]
+    out[..., :, 0] = out[..., :, 1]
+    out[..., :, -1] = out[..., :, -2]
+    return out
+
+_converters = {
+    ("rho", "u")   : rho_to_u,
+    ("rho", "v")   : rho_to_v,
+    ("rho", "psi") : rho_to_psi,
+    ("u", "rho")   : u_to_rho,
+    ("v", "rho")   : v_to_rho,
+    ("psi", "rho") : psi_to_rho,
+    ("u", "psi")   : u_to_psi,
+    ("v", "psi")   : v_to_psi,
+}
+
+def stagger(a, source, target, out=None):
+    """
+        Move 'a', (..., y, x) on the 'source' grid ("rho", "u", "v" or
+        "psi"), onto the 'target' grid, writing into 'out' when given
+    """
+    if source == target:
+        if out is None:
+            return a
+        out[...] = a
+        return out
+    try:
+        converter = _converters[(source, target)]
+    except KeyError:
+        raise ValueError("Can't move from the %s grid to the %s grid" % (source, target))
+    return converter(a, out=out)
+
+def grid_of(ncvar):
+    """
+        Which of the "rho", "u", "v" or "psi" grids a ROMS variable is on,
+        from the names of its last two dimensions
+    """
+    for grid in _grids:
+        if tuple(ncvar.dimensions[-2:]) == ("eta_" + grid, "xi_" + grid):
+            return grid
+    raise ValueError("%s is not on a ROMS grid, its dimensions are %s" % (ncvar.name, str(ncvar.dimensions)))
+
+def _selection(dataset, var, times, levels):
+    """
+        The time and level indexes of 'var' selected, None for a missing axis
+    """
+    ncvar = dataset.nc.variables[var]
+    positions = dataset._get_positions(var)
+    tinds, zinds = None, None
+    if positions["time"] is not None:
+        tinds = _axis_indexes(times, ncvar.shape[positions["time"][0]])
+    if positions["z"] is not None:
+        zinds = _axis_indexes(levels, ncvar.shape[positions["z"][0]])
+    return tinds, zinds
+
+def iter_staggered(dataset, var, target, times=None, levels=None, chunk=1):
+    """
+        Read 'var' from a paegan Dataset 'chunk' timesteps at a time
+        (through get_values) and yield (time indexes, block moved onto the
+        'target' grid) for each chunk, so a whole run is never in memory
+        at once.
+
+        times and levels are indexes along the time and s axes (a slice or
+        a sequence), all of them by default.  Variables without a time
+        axis come out in one block, with None for the time indexes.  The
+        dataset's grid must not be restricted.
+    """
+    source = grid_of(dataset.nc.variables[var])
+    tinds, zinds = _selection(dataset, var, times, levels)
+    if tinds is None:
+        yield None, stagger(dataset.get_values(var, zinds=[zinds]), source, target)
+        return
+    for start in range(0, tinds.size, chunk):
+        tchunk = tinds[start:start+chunk]
+        yield tchunk, stagger(dataset.get_values(var, timeinds=[tchunk], zinds=[zinds]), source, target)
+
+def staggered(dataset, var, target, times=None, levels=None, chunk=1, out=None):
+    """
+        All of 'var' (or the times and levels selected) on the 'target'
+        grid, read and moved a chunk of timesteps at a time.  'out' can be
+        an array or a netCDF variable of the right shape to write the
+        chunks into, otherwise an array is returned.
+    """
+    tinds, zinds = _selection(dataset, var, times, levels)
+    start = 0
+    for tchunk, block in iter_staggered(dataset, var, target, times, levels, chunk):
+        if out is None:
+            shape = block.shape if tinds is None else (tinds.size,) + block.shape[1:]
+            out = _output(block, shape, None)
+        if tchunk is None:
+            out[:] = block
+        else:
+            out[start:start+tchunk.size] = block
+            start += tchunk.size
+    return out
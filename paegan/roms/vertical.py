@@ -0,0 +1,219 @@
+import collections
+import numpy as np
+
+#       ROMS vertical coordinate (https://www.myroms.org/wiki/Vertical_S-coordinate)
+#
+#       Vtransform 1:   z0 = hc*s + (h - hc)*C(s)
+#                       z  = z0 + zeta*(1 + z0/h)
+#
+#       Vtransform 2:   z0 = (hc*s + h*C(s)) / (hc + h)
+#                       z  = zeta + (zeta + h)*z0
+#
+#       z is height (meters, positive up, 0 at the mean surface), s runs
+#       from -1 at the bottom to 0 at the surface, and C(s) is the
+#       stretching function picked by Vstretching.
+
+_s_coordinate_names = ["s_rho", "S_RHO", "s_w", "S_W"]
+_s_coordinate_standard_names = ["ocean_s_coordinate",
+                                "ocean_s_coordinate_g1",
+                                "ocean_s_coordinate_g2",
+                               ]
+
+def is_s_coordinate(nc, zname):
+    """
+        Whether the 'zname' variable of nc is a ROMS s-coordinate that
+        SCoordinate can turn into depths (it needs the bathymetry, h)
+    """
+    if zname is None or zname not in nc.variables or "h" not in nc.variables:
+        return False
+    standard_name = getattr(nc.variables[zname], "standard_name", None)
+    return zname in _s_coordinate_names or standard_name in _s_coordinate_standard_names
+
+def s_levels(n, levels="rho"):
+    """
+        The s values of the 'n' rho levels (cell centers), or the n+1 w
+        levels (cell faces) when levels="w"
+    """
+    if levels == "w":
+        return (np.arange(n + 1) - n) / float(n)
+    return (np.arange(1, n + 1) - n - 0.5) / float(n)
+
+def stretching(s, Vstretching=1, theta_s=0., theta_b=0.):
+    """
+        The ROMS stretching function C(s) for Vstretching 1 (Song and
+        Haidvogel, 1994), 2 (Shchepetkin, 2005), 3 (Geyer) or
+        4 (Shchepetkin, 2010)
+    """
+    s = np.asarray(s, dtype=np.float64)
+    if Vstretching == 1:
+        if theta_s == 0:
+            return s.copy()
+        return (1 - theta_b) * np.sinh(theta_s * s) / np.sinh(theta_s) + \
+               theta_b * (0.5 * np.tanh(theta_s * (s + 0.5)) / np.tanh(0.5 * theta_s) - 0.5)
+    elif Vstretching == 2:
+        if theta_s <= 0:
+            return s.copy()
+        csur = (1 - np.cosh(theta_s * s)) / (np.cosh(theta_s) - 1)
+        if theta_b <= 0:
+            return csur
+        cbot = np.sinh(theta_b * (s + 1)) / np.sinh(theta_b) - 1
+        weight = (s + 1) * (1 + (1 - (s + 1)))
+        return weight * csur + (1 - weight) * cbot
+    elif Vstretching == 3:
+        alpha = 3.
+        cbot = np.log(np.cosh(alpha * (s + 1) ** theta_b)) / np.log(np.cosh(alpha)) - 1
+        csur = -np.log(np.cosh(alpha * np.abs(s) ** theta_s)) / np.log(np.cosh(alpha))
+        weight = 0.5 * (1 - np.tanh(alpha * (s + 0.5)))
+        return weight * cbot + (1 - weight) * csur
+    elif Vstretching == 4:
+        if theta_s > 0:
+            c = (1 - np.cosh(theta_s * s)) / (np.cosh(theta_s) - 1)
+        else:
+            c = -s ** 2
+        if theta_b > 0:
+            c = (np.exp(theta_b * c) - 1) / (1 - np.exp(-theta_b))
+        return c
+    raise ValueError("Vstretching must be 1, 2, 3 or 4, not %s" % Vstretching)
+
+def z_levels(h, zeta, s, C, hc, Vtransform=1):
+    """
+        Heights (meters, positive up) of the s-levels 's', with stretching
+        C(s), over bathymetry 'h' (y, x).  'zeta' is the free surface,
+        either (y, x) or (t, y, x), and the result is (N, y, x) or
+        (t, N, y, x) to match.
+    """
+    h = np.asarray(h, dtype=np.float64)
+    zeta = np.asarray(zeta, dtype=np.float64)[..., np.newaxis, :, :]
+    s = np.asarray(s, dtype=np.float64)[:, np.newaxis, np.newaxis]
+    C = np.asarray(C, dtype=np.float64)[:, np.newaxis, np.newaxis]
+    if Vtransform == 1:
+        z0 = hc * s + (h - hc) * C
+        return z0 + zeta * (1 + z0 / h)
+    elif Vtransform == 2:
+        z0 = (hc * s + h * C) / (hc + h)
+        return zeta + (zeta + h) * z0
+    raise ValueError("Vtransform must be 1 or 2, not %s" % Vtransform)
+
+def _scalar(nc, name, default):
+    if name in nc.variables:
+        return np.asarray(nc.variables[name][:]).ravel()[0]
+    return default
+
+def _stagger(field, shape):
+    """
+        Average a (..., y, x) rho field onto the u, v or psi points of 'shape'
+    """
+    y, x = field.shape[-2:]
+    if shape[-2] == y - 1:
+        field = 0.5 * (field[..., 1:, :] + field[..., :-1, :])
+    if shape[-1] == x - 1:
+        field = 0.5 * (field[..., :, 1:] + field[..., :, :-1])
+    if field.shape[-2:] != tuple(shape[-2:]):
+        raise ValueError("%s is not a rho, u, v or psi grid shape of %s" % (str(tuple(shape)), str((y, x))))
+    return field
+
+class SCoordinate(object):
+    """
+        The heights of the rho (or w) levels of a ROMS output file, worked
+        out from h, zeta and its s-coordinate parameters.
+
+        Heights are computed for one timestep at a time, when first asked
+        for, and the last 'cache_steps' of them are kept.  Files without
+        zeta are taken to have a flat free surface.
+    """
+
+    def __init__(self, nc, zname="s_rho", cache_steps=8):
+        variables = nc.variables
+        self.levels = "w" if zname.lower() == "s_w" else "rho"
+        self.Vtransform = int(_scalar(nc, "Vtransform", 1))
+        self.Vstretching = int(_scalar(nc, "Vstretching", 1))
+        self.theta_s = float(_scalar(nc, "theta_s", 0))
+        self.theta_b = float(_scalar(nc, "theta_b", 0))
+        self.hc = float(_scalar(nc, "hc", 0))
+        self.h = np.ma.filled(np.ma.asarray(variables["h"][:], dtype=np.float64), np.nan)
+
+        if zname in variables:
+            self.s = np.asarray(variables[zname][:], dtype=np.float64)
+        else:
+            n = len(nc.dimensions[zname])
+            self.s = s_levels(n - 1 if self.levels == "w" else n, self.levels)
+        cname = "Cs_w" if self.levels == "w" else "Cs_r"
+        if cname in variables:
+            self.C = np.asarray(variables[cname][:], dtype=np.float64)
+        else:
+            self.C = stretching(self.s, self.Vstretching, self.theta_s, self.theta_b)
+
+        self.set_nc(nc)
+        self.cache_steps = cache_steps
+        # (tind, shape) -> heights, least recently used first
+        self._heights = collections.OrderedDict()
+
+    def get_nc(self):
+        return self._nc
+    def set_nc(self, nc):
+        """
+            Read zeta through another handle of the same file (after it was
+            closed and opened again).  The cached heights are kept.
+        """
+        self._nc = nc
+        self._zeta = None
+        if "zeta" in nc.variables and nc.variables["zeta"].ndim == 3:
+            self._zeta = nc.variables["zeta"]
+
+    def get_size(self):
+        return self.s.size
+
+    def get_time_varying(self):
+        return self._zeta is not None
+
+    def z(self, tind=None, shape=None):
+        """
+            Heights (N, y, x) of the levels at timestep 'tind', on the grid
+            points of 'shape' (rho, u, v or psi; rho if None).  Shared by
+            every caller, so read-only.
+        """
+        if self._zeta is None:
+            tind = None
+        shape = self.h.shape if shape is None else tuple(shape[-2:])
+        key = (None if tind is None else int(tind), shape)
+        heights = self._heights.pop(key, None)
+        if heights is None:
+            if tind is None:
+                zeta = np.zeros(self.h.shape)
+            else:
+                zeta = np.ma.filled(np.ma.asarray(self._zeta[tind], dtype=np.float64), 0)
+            heights = _stagger(z_levels(self.h, zeta, self.s, self.C, self.hc, self.Vtransform), shape)
+            heights.flags.writeable = False
+        self._heights[key] = heights
+        while len(self._heights) > self.cache_steps:
+            self._heights.popitem(last=False)
+        return heights
+
+    def nearest_levels(self, depths, tinds, rows, cols, shape=None, among=None):
+        """
+            For each point (depth in meters, positive down, at timestep
+            'tinds' and grid cell 'rows', 'cols'), the index of the level
+            nearest to it, out of the level indexes 'among' (all of them
+            if None)
+        """
+        depths = np.asarray(depths, dtype=np.float64).ravel()
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        cols = np.asarray(cols, dtype=np.int64).ravel()
+        if tinds is None or self._zeta is None:
+            tinds = np.zeros(depths.size, dtype=np.int64) - 1
+        tinds = np.asarray(tinds, dtype=np.int64).ravel()
+        levels = np.zeros(depths.size, dtype=np.int64)
+        for tind in np.unique(tinds):
+            here = np.where(tinds == tind)[0]
+            columns = self.z(None if tind < 0 else tind, shape)[:, rows[here], cols[here]]
+            if among is not None:
+                columns = columns[among]
+            distance = np.abs(columns + depths[here])
+            levels[here] = np.argmin(np.where(np.isnan(distance), np.inf, distance), axis=0)
+        if among is not None:
+            return np.asarray(among, dtype=np.int64)[levels]
+        return levels
+
+    nc = property(get_nc, set_nc)
+    size = property(get_size, None)
+    time_varying = property(get_time_varying, None)
@@ -11,6 +11,10 @@ class AsaGreatCircle(object):
             distance = distance to traveled
             azimuth = angle, in DECIMAL DEGREES of HEADING from NORTH
             start_point = Location4D object representing the starting point
+            OR
+            start_lats, start_lons = arrays (or scalars) of decimal degrees.
+                distance and azimuth may then be arrays too, all four
+                are broadcast against each other.
             rmajor = radius of earth's major axis. default=6378137.0 (WGS84)
             rminor = radius of earth's minor axis. default=6356752.3142 (WGS84)
 
@@ -23,14 +27,21 @@ class AsaGreatCircle(object):
 
         distance = kwargs.pop('distance')
         azimuth = kwargs.pop('azimuth')
-        starting = kwargs.pop('start_point')
+        starting = kwargs.pop('start_point', None)
+        if starting == None:
+            start_lat = kwargs.pop("start_lats")
+            start_lon = kwargs.pop("start_lons")
         rmajor = kwargs.pop('rmajor', 6378137.0)
         rminor = kwargs.pop('rminor', 6356752.3142)
         f = (rmajor - rminor) / rmajor
 
-        lat_result, lon_result, angle_result = GreatCircle.vinc_pt(f, rmajor, math.radians(starting.latitude), math.radians(starting.longitude), math.radians(azimuth), distance)
-
-        return {'latitude': math.degrees(lat_result), 'longitude': math.degrees(lon_result), 'reverse_azimuth': math.degrees(angle_result)}
+        if starting != None:
+            lat_result, lon_result, angle_result = GreatCircle.vinc_pt(f, rmajor, math.radians(starting.latitude), math.radians(starting.longitude), math.radians(azimuth), distance)
+            return {'latitude': math.degrees(lat_result), 'longitude': math.degrees(lon_result), 'reverse_azimuth': math.degrees(angle_result)}
+        else:
+            lat_result, lon_result, angle_result = GreatCircle.vinc_pt_array(f, rmajor, np.radians(start_lat), np.radians(start_lon),
+                                                                             np.radians(azimuth), distance)
+            return {'latitude': np.degrees(lat_result), 'longitude': np.degrees(lon_result), 'reverse_azimuth': np.degrees(angle_result)}
 
     @classmethod
     def great_distance(self, **kwargs):
@@ -38,6 +49,9 @@ class AsaGreatCircle(object):
             Named arguments:
             start_point = Location4D obect representing start point
             end_point = Location4D obect representing end point
+            OR
+            start_lats, start_lons, end_lats, end_lons = arrays (or scalars)
+                of decimal degrees, broadcast against each other
             rmajor = radius of earth's major axis. default=6378137.0 (WGS84)
             rminor = radius of earth's minor axis. default=6356752.3142 (WGS84)
 
@@ -65,9 +79,8 @@ class AsaGreatCircle(object):
                                                                    math.radians(end_point.latitude), 
                                                                    math.radians(end_point.longitude))
         else:
-            vector_dist = np.vectorize(GreatCircle.vinc_dist)
-            distance, angle, reverse_angle = vector_dist(f, rmajor, np.radians(start_lat), np.radians(start_lon),
-                                                         np.radians(end_lat), np.radians(end_lon))
+            distance, angle, reverse_angle = GreatCircle.vinc_dist_array(f, rmajor, np.radians(start_lat), np.radians(start_lon),
+                                                                         np.radians(end_lat), np.radians(end_lon))
         return {'distance': distance, 'azimuth': np.degrees(angle), 'reverse_azimuth': np.degrees(reverse_angle)}
         
         
@@ -1,41 +1,76 @@
 from math import sqrt, atan2, degrees, radians
+import numpy as np
+
+def _is_array(*values):
+    """
+        Whether any of 'values' is an array (or a list or tuple of values),
+        rather than a scalar
+    """
+    return any(isinstance(value, (np.ndarray, list, tuple)) for value in values)
 
 class AsaMath(object):
+    """
+        The methods take scalars, and give back scalars, or N-D arrays
+        (also lists and tuples).  Arrays are worked on with NumPy ufuncs,
+        and results can be written into preallocated arrays ('out', or
+        'speed_out' and 'direction_out').
+    """
 
     @classmethod
     def speed_direction_from_u_v(cls, **kwargs):
-        if "u" and "v" in kwargs:
-            speed = cls.__speed_from_u_v(kwargs.get('u'), kwargs.get('v'))
-            direction = cls.__direction_from_u_v(kwargs.get('u'), kwargs.get('v'), output=kwargs.get('output'))
+        if "u" in kwargs and "v" in kwargs:
+            u, v = kwargs.get('u'), kwargs.get('v')
+            speed = cls.__speed_from_u_v(u, v, out=kwargs.get('speed_out'))
+            direction = cls.__direction_from_u_v(u, v, output=kwargs.get('output'), out=kwargs.get('direction_out'))
             return { 'speed':speed, 'direction':direction }
         else:
             raise TypeError( "must pass in 'u' and 'v' values ")
 
     @classmethod
-    def __speed_from_u_v(cls, u, v):
+    def __speed_from_u_v(cls, u, v, out=None):
+        if _is_array(u, v):
+            return np.hypot(u, v, out=out)
         return sqrt((u*u) + (v*v))
 
     @classmethod
     def __direction_from_u_v(cls, u, v, **kwargs):
-        rads = atan2(v, u)
+        out = kwargs.pop('out', None)
+        if _is_array(u, v):
+            rads = np.arctan2(v, u, out=out)
+        else:
+            rads = atan2(v, u)
         if 'output' in kwargs:
             if kwargs.pop('output') == 'radians':
                 return rads
 
         # if 'output' was not specified as 'radians', we return degrees
+        if _is_array(rads):
+            return cls.normalize_angle(angle=np.degrees(rads, out=rads), out=rads)
         return cls.normalize_angle(angle=degrees(rads))
 
     @classmethod
     def azimuth_to_math_angle(cls, **kwargs):
-        return cls.normalize_angle(angle=90 - kwargs.get("azimuth"))
+        azimuth = kwargs.get("azimuth")
+        if _is_array(azimuth):
+            angle = np.subtract(90, azimuth, out=kwargs.get('out'))
+            return cls.normalize_angle(angle=angle, out=angle)
+        return cls.normalize_angle(angle=90 - azimuth)
 
     @classmethod
     def math_angle_to_azimuth(cls, **kwargs):
-        return cls.normalize_angle(angle=(360 - kwargs.get("angle")) + 90)
+        angle = kwargs.get("angle")
+        if _is_array(angle):
+            azimuth = np.subtract(360, angle, out=kwargs.get('out'))
+            np.add(azimuth, 90, out=azimuth)
+            return cls.normalize_angle(angle=azimuth, out=azimuth)
+        return cls.normalize_angle(angle=(360 - angle) + 90)
 
     @classmethod
     def normalize_angle(cls, **kwargs):
-        return kwargs.get('angle') % 360
+        angle = kwargs.get('angle')
+        if _is_array(angle):
+            return np.mod(angle, 360, out=kwargs.get('out'))
+        return angle % 360
 
     @classmethod
     def is_number(cls, num):
@@ -0,0 +1,287 @@
+"""
+    Small netCDF files for the tests that don't need the remote data, and a
+    TestCase that writes them into a temporary directory of its own.
+
+    >> class MyTest(NetCDFTestCase):
+    >>     def setUp(self):
+    >>         super(MyTest, self).setUp()
+    >>         self.path = self.write(write_cgrid)
+"""
+import unittest
+import os
+import tempfile
+import shutil
+import netCDF4
+import numpy as np
+
+from paegan.cdm.pool import pool
+from paegan.roms.vertical import s_levels, stretching
+
+class NetCDFTestCase(unittest.TestCase):
+    """
+        Gives each test a temporary directory (self.tmpdir), removed along
+        with the handles the pool kept open on its files afterwards
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        pool.close_idle()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, writer, name=None, **kwargs):
+        """
+            Write a file with 'writer' into the temporary directory, named
+            after the writer unless 'name' is given, and return its path
+        """
+        if name is None:
+            name = writer.__name__[len("write_"):] + ".nc"
+        path = os.path.join(self.tmpdir, name)
+        writer(path, **kwargs)
+        return path
+
+def write_cgrid(path):
+    """ A curvilinear grid, temp(time, z, eta, xi) and zeta(time, eta, xi) """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("time", 10)
+    nc.createDimension("z", 5)
+    nc.createDimension("eta", 20)
+    nc.createDimension("xi", 30)
+    time = nc.createVariable("time", "f8", ("time",))
+    time.units = "hours since 2012-01-01 00:00:00"
+    time[:] = np.arange(10)
+    depth = nc.createVariable("depth", "f8", ("z",))
+    depth.units = "m"
+    depth[:] = [0, 5, 10, 20, 50]
+    eta, xi = np.mgrid[0:20, 0:30]
+    nc.createVariable("lon", "f8", ("eta", "xi"))[:] = -75.0 + 0.05 * xi - 0.01 * eta
+    nc.createVariable("lat", "f8", ("eta", "xi"))[:] = 38.0 + 0.04 * eta + 0.01 * xi
+    temp = nc.createVariable("temp", "f8", ("time", "z", "eta", "xi"))
+    temp.coordinates = "time depth lat lon"
+    temp[:] = np.arange(10 * 5 * 20 * 30).reshape(10, 5, 20, 30)
+    zeta = nc.createVariable("zeta", "f8", ("time", "eta", "xi"))
+    zeta.coordinates = "time lat lon"
+    zeta[:] = np.arange(10 * 20 * 30).reshape(10, 20, 30)
+    nc.close()
+
+def write_rgrid(path):
+    """ A rectilinear grid, u and v(time, depth, lat, lon) """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("time", 6)
+    nc.createDimension("depth", 4)
+    nc.createDimension("lat", 15)
+    nc.createDimension("lon", 25)
+    time = nc.createVariable("time", "f8", ("time",))
+    time.units = "days since 2011-05-01 00:00:00"
+    time[:] = np.arange(6)
+    depth = nc.createVariable("depth", "f8", ("depth",))
+    depth.units = "m"
+    depth[:] = [1, 5, 25, 100]
+    nc.createVariable("lat", "f8", ("lat",))[:] = np.linspace(59, 61, 15)
+    nc.createVariable("lon", "f8", ("lon",))[:] = np.linspace(-148, -145, 25)
+    u = nc.createVariable("u", "f8", ("time", "depth", "lat", "lon"))
+    u[:] = np.arange(6 * 4 * 15 * 25).reshape(6, 4, 15, 25)
+    v = nc.createVariable("v", "f8", ("time", "depth", "lat", "lon"))
+    v[:] = -np.arange(6 * 4 * 15 * 25).reshape(6, 4, 15, 25)
+    nc.close()
+
+def write_ncell(path):
+    """ Unstructured nodes, zeta(time, node) """
+    rs = np.random.RandomState(4)
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("time", 8)
+    nc.createDimension("node", 400)
+    time = nc.createVariable("time", "f8", ("time",))
+    time.units = "seconds since 2005-09-20 00:00:00"
+    time[:] = np.arange(8) * 3600
+    nc.createVariable("lon", "f8", ("node",))[:] = rs.uniform(-95, -90, 400)
+    nc.createVariable("lat", "f8", ("node",))[:] = rs.uniform(27, 30, 400)
+    zeta = nc.createVariable("zeta", "f8", ("time", "node"))
+    zeta.coordinates = "time lat lon"
+    zeta.standard_name = "sea_surface_height_above_geoid"
+    zeta[:] = np.arange(8 * 400).reshape(8, 400)
+    nc.close()
+
+def write_roms(path):
+    """ ROMS output on s-levels, temp on the rho grid and u on the u grid """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("ocean_time", 3)
+    nc.createDimension("s_rho", 4)
+    nc.createDimension("s_w", 5)
+    nc.createDimension("eta_rho", 6)
+    nc.createDimension("xi_rho", 7)
+    nc.createDimension("eta_u", 6)
+    nc.createDimension("xi_u", 6)
+    time = nc.createVariable("ocean_time", "f8", ("ocean_time",))
+    time.units = "seconds since 2012-06-01 00:00:00"
+    time[:] = np.arange(3) * 3600
+    for name, value in [("Vtransform", 2), ("Vstretching", 4), ("theta_s", 5.), ("theta_b", 0.4), ("hc", 10.)]:
+        nc.createVariable(name, "f8")[:] = value
+    for name, cname, levels in [("s_rho", "Cs_r", "rho"), ("s_w", "Cs_w", "w")]:
+        s = s_levels(4, levels)
+        nc.createVariable(name, "f8", (name,))[:] = s
+        nc.createVariable(cname, "f8", (name,))[:] = stretching(s, 4, 5., 0.4)
+    eta, xi = np.mgrid[0:6, 0:7]
+    nc.createVariable("h", "f8", ("eta_rho", "xi_rho"))[:] = 20. + 10 * xi + 5 * eta
+    nc.createVariable("zeta", "f8", ("ocean_time", "eta_rho", "xi_rho"))[:] = 0.5 * np.arange(3)[:, None, None] * np.ones((6, 7))
+    lon = -70.0 + 0.1 * xi
+    lat = 40.0 + 0.1 * eta
+    nc.createVariable("lon_rho", "f8", ("eta_rho", "xi_rho"))[:] = lon
+    nc.createVariable("lat_rho", "f8", ("eta_rho", "xi_rho"))[:] = lat
+    nc.createVariable("lon_u", "f8", ("eta_u", "xi_u"))[:] = 0.5 * (lon[:, 1:] + lon[:, :-1])
+    nc.createVariable("lat_u", "f8", ("eta_u", "xi_u"))[:] = 0.5 * (lat[:, 1:] + lat[:, :-1])
+    temp = nc.createVariable("temp", "f8", ("ocean_time", "s_rho", "eta_rho", "xi_rho"))
+    temp.coordinates = "lon_rho lat_rho s_rho ocean_time"
+    temp[:] = np.arange(3 * 4 * 6 * 7).reshape(3, 4, 6, 7)
+    u = nc.createVariable("u", "f8", ("ocean_time", "s_rho", "eta_u", "xi_u"))
+    u.coordinates = "lon_u lat_u s_rho ocean_time"
+    u[:] = np.arange(3 * 4 * 6 * 6).reshape(3, 4, 6, 6)
+    nc.close()
+
+def write_uv(path):
+    """ ROMS velocities on the u and v grids, and the grid angles """
+    rs = np.random.RandomState(2)
+    nc = netCDF4.Dataset(path, "w")
+    for name, size in [("ocean_time", 5), ("s_rho", 3), ("eta_rho", 8), ("xi_rho", 10),
+                       ("eta_u", 8), ("xi_u", 9), ("eta_v", 7), ("xi_v", 10)]:
+        nc.createDimension(name, size)
+    time = nc.createVariable("ocean_time", "f8", ("ocean_time",))
+    time.units = "seconds since 2012-06-01 00:00:00"
+    time[:] = np.arange(5) * 3600
+    nc.createVariable("s_rho", "f8", ("s_rho",))[:] = [-5/6., -0.5, -1/6.]
+    eta, xi = np.mgrid[0:8, 0:10]
+    lon, lat = -70.0 + 0.1 * xi, 40.0 + 0.1 * eta
+    for grid, rows, cols in [("rho", slice(None), slice(None)), ("u", slice(None), slice(1, None)), ("v", slice(1, None), slice(None))]:
+        nc.createVariable("lon_" + grid, "f8", ("eta_" + grid, "xi_" + grid))[:] = lon[rows, cols]
+        nc.createVariable("lat_" + grid, "f8", ("eta_" + grid, "xi_" + grid))[:] = lat[rows, cols]
+    nc.createVariable("angle", "f8", ("eta_rho", "xi_rho"))[:] = rs.uniform(-1, 1, (8, 10))
+    u = nc.createVariable("u", "f8", ("ocean_time", "s_rho", "eta_u", "xi_u"))
+    u.coordinates = "lon_u lat_u s_rho ocean_time"
+    u.units = "meter second-1"
+    u[:] = rs.normal(size=(5, 3, 8, 9))
+    v = nc.createVariable("v", "f8", ("ocean_time", "s_rho", "eta_v", "xi_v"))
+    v.coordinates = "lon_v lat_v s_rho ocean_time"
+    v[:] = rs.normal(size=(5, 3, 7, 10))
+    nc.close()
+
+def write_staggered(path):
+    """ ROMS u on the u grid, and h on the rho grid without a time axis """
+    nc = netCDF4.Dataset(path, "w")
+    for name, size in [("ocean_time", 7), ("s_rho", 2), ("eta_rho", 5), ("xi_rho", 6), ("eta_u", 5), ("xi_u", 5)]:
+        nc.createDimension(name, size)
+    time = nc.createVariable("ocean_time", "f8", ("ocean_time",))
+    time.units = "seconds since 2012-06-01 00:00:00"
+    time[:] = np.arange(7) * 3600
+    nc.createVariable("s_rho", "f8", ("s_rho",))[:] = [-0.75, -0.25]
+    eta, xi = np.mgrid[0:5, 0:6]
+    nc.createVariable("lon_rho", "f8", ("eta_rho", "xi_rho"))[:] = -70.0 + 0.1 * xi
+    nc.createVariable("lat_rho", "f8", ("eta_rho", "xi_rho"))[:] = 40.0 + 0.1 * eta
+    nc.createVariable("lon_u", "f8", ("eta_u", "xi_u"))[:] = -69.95 + 0.1 * xi[:, :-1]
+    nc.createVariable("lat_u", "f8", ("eta_u", "xi_u"))[:] = 40.0 + 0.1 * eta[:, :-1]
+    u = nc.createVariable("u", "f8", ("ocean_time", "s_rho", "eta_u", "xi_u"))
+    u.coordinates = "lon_u lat_u s_rho ocean_time"
+    u[:] = np.random.RandomState(7).normal(size=(7, 2, 5, 5))
+    h = nc.createVariable("h", "f8", ("eta_rho", "xi_rho"))
+    h.coordinates = "lon_rho lat_rho"
+    h[:] = 10. + xi
+    nc.close()
+
+def write_s_coordinate(path):
+    """ Just what SCoordinate needs: the s-levels, h and zeta """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("ocean_time", 4)
+    nc.createDimension("s_rho", 5)
+    nc.createDimension("eta_rho", 3)
+    nc.createDimension("xi_rho", 4)
+    for name, value in [("Vtransform", 1), ("Vstretching", 1), ("theta_s", 3.), ("theta_b", 0.5), ("hc", 5.)]:
+        nc.createVariable(name, "f8")[:] = value
+    nc.createVariable("s_rho", "f8", ("s_rho",))[:] = s_levels(5)
+    nc.createVariable("h", "f8", ("eta_rho", "xi_rho"))[:] = np.arange(10., 130., 10.).reshape(3, 4)
+    nc.createVariable("zeta", "f8", ("ocean_time", "eta_rho", "xi_rho"))[:] = np.arange(4)[:, None, None] * np.ones((3, 4))
+    nc.close()
+
+def write_steps(path, steps=10, chunksizes=(1, 20, 30), masked=None):
+    """
+        u(time, lat, lon) on a rectilinear grid, stored in 'chunksizes'
+        chunks, numbered in order and masked at the 'masked' index
+    """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("time", steps)
+    nc.createDimension("lat", 20)
+    nc.createDimension("lon", 30)
+    time = nc.createVariable("time", "f8", ("time",))
+    time.units = "hours since 2012-01-01 00:00:00"
+    time[:] = np.arange(steps)
+    nc.createVariable("lat", "f8", ("lat",))[:] = np.linspace(38, 40, 20)
+    nc.createVariable("lon", "f8", ("lon",))[:] = np.linspace(-75, -72, 30)
+    fill_value = None if masked is None else -999.
+    u = nc.createVariable("u", "f8", ("time", "lat", "lon"), chunksizes=chunksizes, fill_value=fill_value)
+    u[:] = np.arange(steps * 20 * 30).reshape(steps, 20, 30)
+    if masked is not None:
+        u[masked] = np.ma.masked
+    nc.close()
+
+def write_points(path):
+    """ Three points along time """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("time", 3)
+    time = nc.createVariable("time", "f8", ("time",))
+    time.units = "hours since 2012-01-01 00:00:00"
+    time[:] = np.arange(3)
+    nc.createVariable("lon", "f8", ("time",))[:] = np.arange(3)
+    nc.createVariable("lat", "f8", ("time",))[:] = np.arange(3)
+    nc.close()
+
+def write_depths(path):
+    """ Depths in meters going down, and heights in cm going up """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("z", 5)
+    depth = nc.createVariable("depth", "f8", ("z",))
+    depth.units = "m"
+    depth[:] = [0, 5, 10, 20, 50]
+    height = nc.createVariable("height", "f8", ("z",))
+    height.units = "cm"
+    height[:] = [5000, 2000, 1000, 500, 0]
+    nc.close()
+
+def write_times(path):
+    """ 1000 half-hourly and 6-hourly times """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("time", 1000)
+    time = nc.createVariable("time", "f8", ("time",))
+    time.units = "seconds since 1990-01-01 00:00:00"
+    time[:] = np.arange(1000) * 1800.
+    ocean_time = nc.createVariable("ocean_time", "f8", ("time",))
+    ocean_time.units = "days since 2005-09-20"
+    ocean_time[:] = np.arange(1000) * 0.25
+    nc.close()
+
+def write_char_times(path):
+    """ Times as character arrays, in a fixed layout (Times) and not (odd) """
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("Time", 3)
+    nc.createDimension("DateStrLen", 19)
+    nc.createDimension("LongStrLen", 25)
+    times = ["2012-02-28_22:00:00", "2012-02-29_23:30:00", "2012-03-01_00:00:15"]
+    nc.createVariable("Times", "S1", ("Time", "DateStrLen"))[:] = netCDF4.stringtochar(np.array(times, dtype="S19"))
+    odd = ["2012-02-28 22:00:00+0000", "Feb 29 2012 23:30", "2012-03-01T00:00:15.000Z"]
+    nc.createVariable("odd", "S1", ("Time", "LongStrLen"))[:] = netCDF4.stringtochar(np.array(odd, dtype="S25"))
+    nc.close()
+
+def write_grid(path):
+    """ A rotated curvilinear grid and an unstructured set of nodes """
+    eta, xi = np.mgrid[0:40, 0:60]
+    lon = -75.0 + 0.05 * xi - 0.02 * eta
+    lat = 38.0 + 0.03 * eta + 0.01 * xi
+    rs = np.random.RandomState(3)
+
+    nc = netCDF4.Dataset(path, "w")
+    nc.createDimension("eta_rho", 40)
+    nc.createDimension("xi_rho", 60)
+    nc.createDimension("node", 500)
+    nc.createVariable("lon_rho", "f8", ("eta_rho", "xi_rho"))[:] = lon
+    nc.createVariable("lat_rho", "f8", ("eta_rho", "xi_rho"))[:] = lat
+    nc.createVariable("lon", "f8", ("node",))[:] = rs.uniform(-80, -70, 500)
+    nc.createVariable("lat", "f8", ("node",))[:] = rs.uniform(35, 45, 500)
+    nc.close()
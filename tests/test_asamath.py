@@ -1,4 +1,5 @@
 import math
+import numpy as np
 import unittest
 from paegan.utils.asamath import AsaMath
 
@@ -48,4 +49,37 @@ class AsaMathTest(unittest.TestCase):
         assert azimuth == 218
 
         azimuth = AsaMath.math_angle_to_azimuth(angle=45)
-        assert azimuth == 45
\ No newline at end of file
+        assert azimuth == 45
+
+    def test_speed_direction(self):
+        result = AsaMath.speed_direction_from_u_v(u=3, v=4)
+        assert result['speed'] == 5
+        assert abs(result['direction'] - math.degrees(math.atan2(4, 3))) < 1e-12
+        assert AsaMath.speed_direction_from_u_v(u=0, v=-1)['direction'] == 270
+        assert AsaMath.speed_direction_from_u_v(u=0, v=-1, output='radians')['direction'] == -math.pi / 2
+        self.assertRaises(TypeError, AsaMath.speed_direction_from_u_v, v=1)
+
+    def test_arrays(self):
+        rs = np.random.RandomState(9)
+        u, v = rs.normal(size=(3, 4, 5)), rs.normal(size=(3, 4, 5))
+        result = AsaMath.speed_direction_from_u_v(u=u, v=v)
+        assert result['speed'].shape == result['direction'].shape == (3, 4, 5)
+        for i in [(0, 0, 0), (2, 3, 4), (1, 2, 0)]:
+            scalar = AsaMath.speed_direction_from_u_v(u=u[i], v=v[i])
+            assert abs(scalar['speed'] - result['speed'][i]) < 1e-12
+            assert abs(scalar['direction'] - result['direction'][i]) < 1e-9
+
+        # Into preallocated arrays
+        speed, direction = np.empty((3, 4, 5)), np.empty((3, 4, 5))
+        result = AsaMath.speed_direction_from_u_v(u=u, v=v, speed_out=speed, direction_out=direction, output='radians')
+        assert result['speed'] is speed and result['direction'] is direction
+        assert np.allclose(direction, np.arctan2(v, u))
+
+        # Lists work the same as the scalars, one by one
+        azimuths = [0, 45, 90, 180, 360, 270, 218]
+        assert list(AsaMath.azimuth_to_math_angle(azimuth=azimuths)) == [AsaMath.azimuth_to_math_angle(azimuth=a) for a in azimuths]
+        angles = np.array([90., 180, 0, 360, 270, 45, 232, -45])
+        out = np.empty(8)
+        assert AsaMath.math_angle_to_azimuth(angle=angles, out=out) is out
+        assert list(out) == [AsaMath.math_angle_to_azimuth(angle=a) for a in angles]
+        assert list(AsaMath.normalize_angle(angle=[-90, 720, 45.5])) == [270, 0, 45.5]
@@ -0,0 +1,75 @@
+import unittest
+import netCDF4
+import numpy as np
+from datetime import datetime, timedelta
+import pytz
+from paegan.cdm.cache import BlockCache, CachedVariable, block_shape
+from paegan.cdm.dataset import CommonDataset
+from fixtures import NetCDFTestCase, write_steps
+
+class BlockCacheTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(BlockCacheTest, self).setUp()
+        self.path = self.write(write_steps, "chunked.nc", steps=12, chunksizes=(1, 10, 10), masked=(3, 5, 5))
+
+    def test_blocks(self):
+        nc = netCDF4.Dataset(self.path)
+        ncvar = nc.variables['u']
+        assert block_shape(ncvar) == (1, 10, 10)
+        assert block_shape(nc.variables['lat']) == (20,)
+
+        cache = BlockCache()
+        var = CachedVariable(cache, self.path, 'u', ncvar)
+        full = ncvar[:]
+        data = var[2:5, 3:15, 8:21]
+        assert np.all(data == full[2:5, 3:15, 8:21])
+        # 3 times, 2 row blocks, 3 column blocks
+        assert (cache.misses, cache.hits, cache.block_count) == (18, 0, 18)
+
+        # Overlapping reads are served from memory
+        assert np.all(var[3:4, 0:10, 10:20] == full[3:4, 0:10, 10:20])
+        assert (cache.misses, cache.hits) == (18, 1)
+        assert var[3:4, 5:6, 5:6].mask.all()
+
+        # Other reads pass straight through
+        assert np.all(var[[1, 2], 0, :] == full[[1, 2], 0, :])
+        nc.close()
+
+    def test_eviction(self):
+        nc = netCDF4.Dataset(self.path)
+        block = 10 * 10 * 8
+        cache = BlockCache(max_bytes=3 * block)
+        var = CachedVariable(cache, self.path, 'u', nc.variables['u'])
+        var[0:1, 0:10, 0:30]
+        var[1:2, 0:10, 0:10]
+        assert cache.block_count == 3
+        assert cache.nbytes <= 3 * block
+        # The oldest blocks went first
+        assert cache.get((self.path, 'u', (0, 0, 0))) is None
+        assert cache.get((self.path, 'u', (1, 0, 0))) is not None
+
+        cache.max_bytes = block
+        assert cache.block_count <= 1
+        cache.clear(self.path)
+        assert cache.block_count == 0 and cache.nbytes == 0
+        nc.close()
+
+    def test_dataset(self):
+        cache = BlockCache()
+        pd = CommonDataset.open(self.path)
+        direct = pd.get_values('u')
+        pd.block_cache = cache
+        start = datetime(2012, 1, 1, tzinfo=pytz.utc)
+        window = pd.restrict_time((start, start + timedelta(hours=5, minutes=30)))
+        assert window.block_cache is cache
+        assert np.all(window.get_values('u') == direct[:6])
+        misses = cache.misses
+        assert cache.hits == 0
+
+        # A sliding window only reads what it hasn't seen
+        window = pd.restrict_time((start + timedelta(hours=2, minutes=30), start + timedelta(hours=8, minutes=30)))
+        assert np.all(window.get_values('u') == direct[3:9])
+        assert cache.hits == 3 * 6
+        assert cache.misses == misses + 3 * 6
+        pd.closenc()
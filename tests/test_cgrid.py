@@ -0,0 +1,28 @@
+import unittest
+import pytz
+import numpy as np
+from datetime import datetime
+from paegan.cdm.dataset import CommonDataset
+from paegan.location4d import Location4D
+from fixtures import NetCDFTestCase, write_cgrid
+
+class CGridDatasetTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(CGridDatasetTest, self).setUp()
+        self.path = self.write(write_cgrid)
+
+    def test_xyind_from_point(self):
+        pd = CommonDataset.open(self.path)
+        assert pd._datasettype == 'cgrid'
+        # Nearest to the cell at row (eta) 3, column (xi) 17
+        point = Location4D(latitude=38.0 + 0.12 + 0.17, longitude=-75.0 + 0.85 - 0.03,
+                           time=datetime(2012, 1, 1, tzinfo=pytz.utc))
+        inds, inds = pd.get_xyind_from_point('zeta', point)
+        assert list(np.ravel(inds[0])) == [3]
+        assert list(np.ravel(inds[1])) == [17]
+        assert pd.get_values('zeta', point=point).ravel()[0] == 3 * 30 + 17
+        pd.closenc()
+
+if __name__ == '__main__':
+    unittest.main()
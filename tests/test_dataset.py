@@ -1,7 +1,10 @@
-from paegan.cdm.dataset import CommonDataset
+from paegan.cdm.dataset import CommonDataset, _read_hyperslabs, _read_chunked, _raw_bounds
+from paegan.location4d import Location4D
+from fixtures import NetCDFTestCase, write_cgrid, write_rgrid, write_ncell, write_roms
 import unittest, os, pytz
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
+import netCDF4
 
 class DatasetTest(unittest.TestCase):
     def test_cgrid_init(self):
@@ -62,3 +65,371 @@ class DatasetTest(unittest.TestCase):
         assert test.gettimebounds("u")[0] == datetime(2011,5,1,0,0, tzinfo=pytz.utc)
         assert test.gettimebounds("u")[1] == datetime(2011,5,1,0,0, tzinfo=pytz.utc)
 
+
+class CountingVariable(object):
+    """ Wraps a netCDF4 variable, counting reads and recording their sizes """
+    def __init__(self, var):
+        self.var, self.reads, self.sizes = var, 0, []
+        self.ndim, self.shape, self.dtype = var.ndim, var.shape, var.dtype
+    def __getitem__(self, key):
+        self.reads += 1
+        data = self.var[key]
+        self.sizes.append(data.size)
+        return data
+
+class LocalDatasetTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(LocalDatasetTest, self).setUp()
+        self.cgrid = self.write(write_cgrid)
+        self.rgrid = self.write(write_rgrid)
+        self.ncell = self.write(write_ncell)
+
+    def test_values_at_points(self):
+        start = datetime(2012, 1, 1, tzinfo=pytz.utc)
+        points = [Location4D(latitude=38.3, longitude=-74.5, depth=12, time=start + timedelta(hours=3)),
+                  Location4D(latitude=38.5, longitude=-74.2, depth=40, time=start + timedelta(hours=7, minutes=40)),
+                  Location4D(latitude=38.65, longitude=-73.7, depth=0, time=start + timedelta(hours=7, minutes=50)),
+                  Location4D(latitude=38.3, longitude=-74.5, depth=12, time=start + timedelta(hours=3))]
+
+        pd = CommonDataset.open(self.cgrid)
+        assert pd._datasettype == 'cgrid'
+        values = pd.get_values_at_points('temp', points)
+        assert values.shape == (4,)
+        for i, point in enumerate(points):
+            assert values[i] == pd.get_values('temp', point=point).ravel()[0]
+
+        # Parallel arrays work the same way, and variables without depth
+        values = pd.get_values_at_points('zeta', lats=[p.latitude for p in points], lons=[p.longitude for p in points],
+                                         times=[p.time for p in points])
+        for i, point in enumerate(points):
+            assert values[i] == pd.get_values('zeta', point=point).ravel()[0]
+        pd.closenc()
+
+        pd = CommonDataset.open(self.rgrid)
+        assert pd._datasettype == 'rgrid'
+        start = datetime(2011, 5, 1, tzinfo=pytz.utc)
+        points = [Location4D(latitude=59.5, longitude=-147.0, depth=20, time=start + timedelta(days=2)),
+                  Location4D(latitude=60.6, longitude=-145.5, depth=2, time=start + timedelta(days=4, hours=4))]
+        values = pd.get_values_at_points('u', points)
+        for i, point in enumerate(points):
+            assert values[i] == pd.get_values('u', point=point).ravel()[0]
+        pd.closenc()
+
+        pd = CommonDataset.open(self.ncell)
+        assert pd._datasettype == 'ncell'
+        start = datetime(2005, 9, 20, tzinfo=pytz.utc)
+        points = [Location4D(latitude=28.0, longitude=-93.0, time=start + timedelta(hours=2)),
+                  Location4D(latitude=29.5, longitude=-91.0, time=start + timedelta(hours=5))]
+        values = pd.get_values_at_points('zeta', points)
+        for i, point in enumerate(points):
+            assert values[i] == pd.get_values('zeta', point=point).ravel()[0]
+        pd.closenc()
+
+    def test_values_at_points_restricted(self):
+        start = datetime(2012, 1, 1, tzinfo=pytz.utc)
+        inside = Location4D(latitude=38.45, longitude=-74.3, depth=5, time=start + timedelta(hours=3))
+        outside = Location4D(latitude=38.9, longitude=-73.5, depth=45, time=start + timedelta(hours=8))
+        bbox = (-74.6, 38.2, -74.0, 38.6)
+
+        pd = CommonDataset.open(self.cgrid)
+        restricted = pd.restrict_time((start + timedelta(hours=2), start + timedelta(hours=5))) \
+                       .restrict_depth((0, 20)).restrict_bbox(bbox)
+        values = restricted.get_values_at_points('temp', [inside, outside])
+        assert values[0] == pd.get_values_at_points('temp', [inside])[0]
+        # The nearest of what is selected: 5:00, 20m and a cell of the box
+        t, z = np.unravel_index(int(values[1]), (10, 5, 20, 30))[:2]
+        assert (t, z) == (5, 3)
+        assert values[1] in restricted.get_values('temp')
+        assert values[1] not in pd.get_values_at_points('temp', [outside])
+        pd.closenc()
+
+        pd = CommonDataset.open(self.rgrid)
+        start = datetime(2011, 5, 1, tzinfo=pytz.utc)
+        point = Location4D(latitude=60.9, longitude=-145.2, depth=100, time=start + timedelta(days=5))
+        restricted = pd.restrict_depth((2, 30)).restrict_time((start, start + timedelta(days=3))) \
+                       .restrict_bbox((-148, 59, -146.5, 60))
+        t, z, lat, lon = np.unravel_index(int(restricted.get_values_at_points('u', [point])[0]), (6, 4, 15, 25))
+        assert (t, z) == (3, 2)
+        assert np.linspace(59, 61, 15)[lat] <= 60 and np.linspace(-148, -145, 25)[lon] <= -146.5
+        # Nothing selected
+        self.assertRaises(ValueError, pd.restrict_depth((30, 40)).get_values_at_points, 'u', [point])
+        pd.closenc()
+
+        pd = CommonDataset.open(self.ncell)
+        grid = pd.getgridobj('zeta')
+        point = Location4D(latitude=29.5, longitude=-91.0, time=datetime(2005, 9, 20, 2, tzinfo=pytz.utc))
+        node = int(pd.restrict_bbox((-95, 27, -93, 28.5)).get_values_at_points('zeta', [point])[0]) % 400
+        assert grid._xarray[node] <= -93 and grid._yarray[node] <= 28.5
+        pd.closenc()
+
+    def test_coord_names_cached(self):
+        pd = CommonDataset.open(self.cgrid)
+        names = pd.get_coord_names('temp')
+        assert names == {"tname": "time", "zname": "depth", "xname": "lon", "yname": "lat"}
+        assert pd._get_positions('temp') == {"time": [0], "z": [1], "y": [2, 3], "x": [2, 3]}
+        info = pd._coordinfo['temp']
+
+        # Resolved once, and shared with copies
+        pd.get_values('temp', point=Location4D(latitude=38.3, longitude=-74.5, depth=12, time=datetime(2012, 1, 1, tzinfo=pytz.utc)))
+        assert pd._coordinfo['temp'] is info
+        copied = pd.restrict_depth((0, 10))
+        assert copied._coordinfo is pd._coordinfo
+
+        # Explicit names aren't cached
+        assert pd.get_coord_names('temp', zname="time")["zname"] == "time"
+        assert pd.get_coord_names('temp')["zname"] == "depth"
+
+        # Changing the variables stops the sharing
+        restricted = pd.restrict_vars('zeta')
+        assert restricted._coordinfo is not pd._coordinfo
+        assert 'temp' not in restricted._coordinfo
+        pd.closenc()
+
+    def test_lazy_restrictions(self):
+        start = datetime(2012, 1, 1, tzinfo=pytz.utc)
+        timebounds = (start + timedelta(hours=1, minutes=30), start + timedelta(hours=5, minutes=30))
+        bbox = (-74.6, 38.2, -74.0, 38.6)
+        pd = CommonDataset.open(self.cgrid)
+        restricted = pd.restrict_time(timebounds).restrict_depth((4, 25)).restrict_bbox(bbox)
+
+        # Nothing is resolved until asked for, and the parent is untouched
+        assert len(restricted._plan) == 3
+        assert restricted._resolved == {}
+        assert pd._plan == []
+
+        direct = pd.get_values('temp', timebounds=timebounds, zbounds=(4, 25), bbox=bbox)
+        values = restricted.values('temp')
+        assert values.shape[:2] == (4, 3)
+        assert np.all(values == direct)
+        assert np.all(restricted.execute('temp') == values)
+        tmin, tmax = restricted.gettimebounds('temp')
+        assert (tmin.hour, tmax.hour) == (2, 5)
+        assert restricted.getdepthbounds('temp', units="m") == (5, 20)
+        xmin, ymin, xmax, ymax = restricted.getbbox('temp')
+        assert xmin < bbox[2] and xmax > bbox[0] and ymin < bbox[3] and ymax > bbox[1]
+        assert pd.get_values('temp').shape == (10, 5, 20, 30)
+
+        # nearest_* narrows within what is already restricted
+        point = Location4D(latitude=38.3, longitude=-74.5, depth=12, time=start + timedelta(hours=3))
+        nearest = restricted.nearest_time(point).nearest_depth(point).nearest_point(point)
+        assert np.all(nearest.values('temp') == pd.get_values('temp', point=point))
+        assert nearest.gettimebounds('temp') == (point.time, point.time)
+        pd.closenc()
+
+        pd = CommonDataset.open(self.rgrid)
+        restricted = pd.restrict_bbox((-147.2, 59.5, -146.0, 60.2)).restrict_depth((0, 30))
+        values = restricted.get_values('u')
+        assert values.shape[1:] == (3, 5, 10)
+        point = Location4D(latitude=59.6, longitude=-147.0, depth=20, time=datetime(2011, 5, 3, tzinfo=pytz.utc))
+        assert np.all(restricted.nearest_point(point).nearest_depth(20).get_values('u', timeinds=[np.array([2])]) == pd.get_values('u', point=point))
+        pd.closenc()
+
+        pd = CommonDataset.open(self.ncell)
+        bbox = (-93.0, 28.0, -91.0, 29.0)
+        restricted = pd.restrict_bbox(bbox)
+        assert np.all(restricted.get_values('zeta') == pd.get_values('zeta', bbox=bbox))
+        x, y = pd.getgridobj('zeta')._xarray, pd.getgridobj('zeta')._yarray
+        inside = np.sum((x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3]))
+        assert restricted.get_values('zeta').shape == (8, inside)
+        pd.closenc()
+
+    def test_restriction_windows(self):
+        pd = CommonDataset.open(self.cgrid)
+        grid = pd.getgridobj('temp')
+        restricted = pd.restrict_bbox((-74.6, 38.2, -74.0, 38.6)).restrict_depth((4, 25))
+        selection = restricted._resolve('temp')
+        rows, cols = selection["xy"]
+        assert isinstance(rows, slice) and isinstance(cols, slice)
+        assert selection["z"] == slice(1, 4)
+
+        # The restricted coordinates are views of the full ones, which keep their values
+        x, y = restricted._xy_values('temp', selection["xy"])
+        assert np.may_share_memory(x, grid._xarray)
+        assert not np.isnan(restricted.getgridobj('temp')._xarray).any()
+        assert restricted.getgridobj('temp') is grid
+
+        # Searches stay inside the window
+        point = Location4D(latitude=38.0, longitude=-75.0)
+        rows, cols = restricted.nearest_point(point)._resolve('temp')["xy"]
+        assert (rows.start, cols.start) == (selection["xy"][0].start, selection["xy"][1].start)
+        assert restricted.restrict_bbox((-70, 30, -69, 31)).get_indices('temp')[2].size == 0
+        pd.closenc()
+
+    def test_cheap_bounds(self):
+        start = datetime(2012, 1, 1, tzinfo=pytz.utc)
+        pd = CommonDataset.open(self.cgrid)
+        bounds = pd.gettimebounds('temp')
+        assert abs(bounds[0] - start) < timedelta(seconds=1)
+        assert abs(bounds[1] - (start + timedelta(hours=9))) < timedelta(seconds=1)
+        assert pd.getdepthbounds('temp') == (0, 50)
+        assert pd.getdepthbounds('temp', units='m') == (0, 50)
+        # Neither coordinate was read in full
+        assert not pd._incache('temp', 'time')
+        assert not pd._incache('temp', 'z')
+
+        # Restricted, only the ends of the window become datetimes
+        window = pd.restrict_time((start + timedelta(hours=2, minutes=30), start + timedelta(hours=6, minutes=30)))
+        bounds = window.gettimebounds('temp')
+        assert abs(bounds[0] - (start + timedelta(hours=3))) < timedelta(seconds=1)
+        assert abs(bounds[1] - (start + timedelta(hours=6))) < timedelta(seconds=1)
+        assert pd.restrict_depth((4, 30)).getdepthbounds('temp') == (5, 20)
+        pd.closenc()
+
+        # actual_range is believed over the values
+        nc = netCDF4.Dataset(self.rgrid, "a")
+        nc.variables['depth'].units = "cm"
+        nc.variables['depth'].actual_range = [1., 80.]
+        nc.close()
+        pd = CommonDataset.open(self.rgrid)
+        assert pd.getdepthbounds('u') == (1, 80)
+        assert pd.getdepthbounds('u', units='m') == (0.01, 0.8)
+        assert pd.getdepthbounds('u', units='ft') == ()
+        pd.closenc()
+
+    def test_packed_bounds(self):
+        nc = netCDF4.Dataset(self.rgrid, "a")
+        depth = nc.createVariable("packed_depth", "i2", ("depth",))
+        depth.scale_factor = 0.5
+        depth.add_offset = 10.
+        depth[:] = [11, 15, 25, 100]
+        # In the packed type, so unpacked to 10.5 and 60
+        depth.actual_range = np.array([1, 100], dtype="i2")
+        # Bounds of what the values may be, not of what they are
+        nc.variables['depth'].valid_min = 0.
+        nc.variables['depth'].valid_max = 5000.
+        nc.close()
+        nc = netCDF4.Dataset(self.rgrid)
+        assert _raw_bounds(nc.variables['packed_depth']) == (10.5, 60)
+        assert _raw_bounds(nc.variables['depth']) == (1, 100)
+        nc.close()
+
+    def test_depth_units(self):
+        nc = netCDF4.Dataset(self.rgrid, "a")
+        nc.variables['depth'].units = "cm"
+        nc.close()
+        # Depths of 1, 5, 25 and 100 cm, searched in meters
+        pd = CommonDataset.open(self.rgrid)
+        assert list(pd.get_zind_from_bounds('u', (0.04, 0.3))[0]) == [1, 2]
+        assert list(pd.restrict_depth((0.04, 0.3)).get_indices('u')[1]) == [1, 2]
+        assert list(pd.restrict_depth((0.04, 0.3)).nearest_depth(0.9).get_indices('u')[1]) == [2]
+        assert list(pd.restrict_depth((4, 30)).get_indices('u')[1]) == []
+        pd.closenc()
+
+    def test_depth_nonlength_units(self):
+        nc = netCDF4.Dataset(self.rgrid, "a")
+        nc.variables['depth'].units = "dbar"
+        nc.close()
+        # Not a length, so the depths are used as they are
+        pd = CommonDataset.open(self.rgrid)
+        assert list(pd.get_zind_from_bounds('u', (2, 30))[0]) == [1, 2]
+        assert list(pd.restrict_depth((2, 30)).get_indices('u')[1]) == [1, 2]
+        assert list(pd.restrict_depth((2, 30)).nearest_depth(20).get_indices('u')[1]) == [2]
+        assert pd.getdepthbounds('u', units='m') == (1, 100)
+        pd.closenc()
+
+    def test_roms_depths(self):
+        path = self.write(write_roms)
+        pd = CommonDataset.open(path)
+        assert pd.get_coord_names('temp')['zname'] == 's_rho'
+        levels = pd.getzlevels('temp')
+        assert levels is pd.getzlevels('u')
+
+        # Depths are meters, not fractions of the water column
+        depths = -np.array([levels.z(t) for t in range(3)])
+        inside = np.where(np.logical_and(depths >= 0, depths <= 5).any(axis=(0, 2, 3)))[0]
+        assert list(pd.get_zind_from_bounds('temp', (0, 5))[0]) == list(inside)
+        values = pd.restrict_depth((0, 5)).get_values('temp')
+        assert values.shape == (3, inside.size, 6, 7)
+        bounds = pd.getdepthbounds('temp')
+        assert np.allclose(bounds, (np.nanmin(depths), np.nanmax(depths)))
+
+        # The nearest level is picked in the water column of the point
+        point = Location4D(latitude=40.2, longitude=-69.6, depth=30, time=datetime(2012, 6, 1, 2, tzinfo=pytz.utc))
+        level = np.argmin(np.abs(depths[2, :, 2, 4] - 30))
+        assert list(pd.get_nearest_zind('temp', point)) == [level]
+        assert pd.get_values('temp', point=point).ravel()[0] == ((2 * 4 + level) * 6 + 2) * 7 + 4
+        assert pd.nearest_point(point).nearest_depth(30).restrict_time((point.time, point.time)).get_indices('temp')[1] == [level]
+        assert pd.get_values_at_points('temp', [point])[0] == pd.get_values('temp', point=point).ravel()[0]
+        assert pd.get_values_at_points('u', [point])[0] == pd.get_values('u', point=point).ravel()[0]
+        # Only the levels of the restricted depths are picked from
+        shallow = inside[np.argmin(np.abs(depths[2, inside, 2, 4] - 30))]
+        value = pd.restrict_depth((0, 5)).get_values_at_points('temp', [point])[0]
+        assert value == ((2 * 4 + shallow) * 6 + 2) * 7 + 4
+        pd.closenc()
+
+    def test_coalesced_reads(self):
+        nc = netCDF4.Dataset(self.cgrid)
+        var = CountingVariable(nc.variables['temp'])
+        full = nc.variables['temp'][:]
+        indices = [np.array([1, 2, 3, 7, 8]), np.array([0, 4]), np.arange(20), np.array([2, 3, 4, 25, 26, 27, 28])]
+        expected = full[np.ix_(*indices)]
+
+        # Sparse enough that every axis is read as its bounding range
+        assert np.all(_read_hyperslabs(var, indices) == expected)
+        assert var.reads == 1
+
+        # Read run by run: two runs each of time, depth and x
+        var.reads = 0
+        assert np.all(_read_hyperslabs(var, indices, slab_ratio=1) == expected)
+        assert var.reads == 8
+
+        # Capping the reads merges runs back into bounding ranges
+        var.reads = 0
+        assert np.all(_read_hyperslabs(var, indices, slab_ratio=1, max_reads=4) == expected)
+        assert var.reads == 4
+
+        # Unsorted and repeated indexes come back in the order asked for
+        indices = [np.array([8, 1, 1]), np.array([4, 0]), np.array([19, 0]), np.array([29, 2, 15])]
+        assert np.all(_read_hyperslabs(var, indices) == full[np.ix_(*indices)])
+        nc.close()
+
+        pd = CommonDataset.open(self.rgrid)
+        pd.slab_ratio = 1
+        assert pd.restrict_depth((0, 30)).slab_ratio == 1
+        assert np.all(pd.get_values('u', zinds=[np.array([0, 2])]) == pd.nc.variables['u'][:][:, [0, 2]])
+        pd.closenc()
+
+    def test_ncell_chunked_reads(self):
+        nc = netCDF4.Dataset(self.ncell)
+        var = CountingVariable(nc.variables['zeta'])
+        full = nc.variables['zeta'][:]
+        nodes = np.array([3, 4, 5, 90, 91, 250, 399, 12])
+        indices = [np.array([1, 2, 5]), nodes]
+
+        # Nothing but the selected nodes' range is read
+        assert np.all(_read_chunked(var, indices, 1) == full[np.ix_(*indices)])
+        assert max(var.sizes) < 5 * 400
+
+        # Each chunk of nodes spans at most max_bytes
+        var.reads, var.sizes = 0, []
+        assert np.all(_read_chunked(var, indices, 1, max_bytes=5 * 100 * 8) == full[np.ix_(*indices)])
+        assert var.reads > 1
+        assert max(var.sizes) <= 5 * 100
+        nc.close()
+
+        pd = CommonDataset.open(self.ncell)
+        pd.max_read_bytes = 8 * 8 * 50
+        bbox = (-93.0, 28.0, -91.0, 29.0)
+        restricted = pd.restrict_bbox(bbox)
+        assert restricted.max_read_bytes == 8 * 8 * 50
+        nodes = restricted._xy_indices('zeta', restricted._resolve('zeta')["xy"])[0][0]
+        assert np.all(restricted.get_values('zeta') == pd.nc.variables['zeta'][:][:, nodes])
+        pd.closenc()
+
+    def test_single_open(self):
+        opened = []
+        original = netCDF4.Dataset
+        class CountingDataset(original):
+            def __init__(self, *args, **kwargs):
+                opened.append(args[0])
+                original.__init__(self, *args, **kwargs)
+        netCDF4.Dataset = CountingDataset
+        try:
+            pd = CommonDataset.open(self.cgrid)
+        finally:
+            netCDF4.Dataset = original
+        assert len(opened) == 1
+        assert 'temp' in pd.nc.variables
+        assert pd._datasettype == 'cgrid'
+        pd.closenc()
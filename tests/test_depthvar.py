@@ -3,6 +3,7 @@ import os
 import netCDF4
 from datetime import timedelta, datetime, tzinfo
 from paegan.cdm.depthvar import Depthvar
+from fixtures import NetCDFTestCase, write_depths
 import numpy as np
 from dateutil.parser import parse
 import pytz
@@ -29,4 +30,52 @@ class DepthvarTest(unittest.TestCase):
         assert ((data * 0.001) == kilo).all()
 
         cents = dvar.centimeters
-        assert ((data * 100) == cents).all()
\ No newline at end of file
+        assert ((data * 100) == cents).all()
+
+class LocalDepthvarTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(LocalDepthvarTest, self).setUp()
+        self.path = self.write(write_depths)
+        self.nc = netCDF4.Dataset(self.path)
+
+    def tearDown(self):
+        self.nc.close()
+        super(LocalDepthvarTest, self).tearDown()
+
+    def test_nearest_index(self):
+        depth = Depthvar(self.nc, 'depth')
+        height = Depthvar(self.nc, 'height')
+        assert (depth._units, height._units) == ('meters', 'centimeters')
+        assert (depth.order, height.order) == (1, -1)
+
+        # One depth gives every index tied for nearest
+        assert list(depth.nearest_index(12)) == [2]
+        assert list(depth.nearest_index(15)) == [2, 3]
+        assert list(height.nearest_index(15)) == [1, 2]
+        assert depth.nearest(48) == 50
+
+        # Many depths give one index each
+        assert list(depth.nearest_index([-3, 7, 7.5, 36, 100])) == [0, 1, 1, 4, 4]
+        assert list(height.nearest_index([-3, 7, 36, 100])) == [4, 3, 0, 0]
+        assert list(depth.nearest_index([7, 60], select='before')) == [1, 4]
+        assert list(depth.nearest_index([7, 60], select='after')) == [2, 5]
+
+    def test_cached_conversions(self):
+        height = Depthvar(self.nc, 'height')
+        meters = height.meters
+        assert meters.dtype == np.float64
+        assert list(meters) == [50, 20, 10, 5, 0]
+        # Worked out once and kept, callers get a copy they can change
+        assert height._converted('meters') is height._converted('meters')
+        assert not height._converted('meters').flags.writeable
+        meters *= 100
+        assert list(height.meters) == [50, 20, 10, 5, 0]
+        assert list(height.nearest_index([7, 36])) == [3, 0]
+        assert height.kilometers is not height.kilometers
+        assert np.allclose(height.millimeters, [50000, 20000, 10000, 5000, 0])
+
+        # Views work their own out
+        assert list(height[1:3].meters) == [20, 10]
+        assert list(height.nearest([7, 36, 100])) == [5, 50, 50]
+        assert height.nearest(12) == 10
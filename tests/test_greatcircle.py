@@ -1,7 +1,9 @@
 import math
 import unittest
+import numpy as np
 from paegan.utils.asagreatcircle import AsaGreatCircle
 from paegan.utils.asamath import AsaMath
+from paegan.external.greatcircle import GreatCircle
 from paegan.location4d import Location4D
 
 class GreatCircleTest(unittest.TestCase):
@@ -40,3 +42,55 @@ class GreatCircleTest(unittest.TestCase):
         # We should have gone up and to the left
         assert new_pt.latitude > starting.latitude + 0.45
         assert new_pt.longitude < starting.longitude - 0.45
+
+    def test_great_distance_arrays(self):
+        lats = np.array([[40.0, 40.5], [0.0, -33.0]])
+        lons = np.array([[-76.0, -75.5], [10.0, 151.0]])
+        end = Location4D(latitude=38.0, longitude=-70.0)
+
+        result = AsaGreatCircle.great_distance(start_lats=lats, start_lons=lons, end_lats=end.latitude, end_lons=end.longitude)
+        assert result['distance'].shape == lats.shape
+
+        for (i, j), lat in np.ndenumerate(lats):
+            start = Location4D(latitude=lat, longitude=lons[i, j])
+            scalar = AsaGreatCircle.great_distance(start_point=start, end_point=end)
+            assert abs(scalar['distance'] - result['distance'][i, j]) < 0.001
+            assert abs(scalar['azimuth'] - result['azimuth'][i, j]) < 1e-9
+            assert abs(scalar['reverse_azimuth'] - result['reverse_azimuth'][i, j]) < 1e-9
+
+        # Same point and missing values
+        result = AsaGreatCircle.great_distance(start_lats=np.array([38.0, np.nan]), start_lons=np.array([-70.0, -70.0]), end_lats=38.0, end_lons=-70.0)
+        assert result['distance'][0] == 0
+        assert np.isnan(result['distance'][1])
+
+    def test_great_distance_grid(self):
+        # The arrays give what the scalar solver gives for each cell of a
+        # regional model grid (see benchmarks/great_distance.py)
+        lons, lats = np.meshgrid(np.linspace(-80, -60, 30), np.linspace(30, 45, 30))
+        f = (6378137.0 - 6356752.3142) / 6378137.0
+        scalar = np.vectorize(GreatCircle.vinc_dist)(f, 6378137.0, np.radians(lats), np.radians(lons), math.radians(38.0), math.radians(-70.0))
+        result = AsaGreatCircle.great_distance(start_lats=lats, start_lons=lons, end_lats=38.0, end_lons=-70.0)
+        assert np.allclose(scalar[0], result['distance'], rtol=0, atol=0.001)
+
+    def test_great_circle_arrays(self):
+        rs = np.random.RandomState(2)
+        lats = rs.uniform(-70, 70, 500)
+        lons = rs.uniform(-180, 180, 500)
+        azimuths = rs.uniform(-90, 360, 500)
+        distances = rs.uniform(0, 500000, 500)
+        distances[:3] = 0
+
+        result = AsaGreatCircle.great_circle(distance=distances, azimuth=azimuths, start_lats=lats, start_lons=lons)
+        assert result['latitude'].shape == lats.shape
+
+        for i in range(lats.size):
+            scalar = AsaGreatCircle.great_circle(distance=distances[i], azimuth=azimuths[i], start_point=Location4D(latitude=lats[i], longitude=lons[i]))
+            assert abs(scalar['reverse_azimuth'] - result['reverse_azimuth'][i]) < 1e-9
+            # Back to meters, within a millimetre
+            moved = AsaGreatCircle.great_distance(start_point=Location4D(latitude=scalar['latitude'], longitude=scalar['longitude']),
+                                                  end_point=Location4D(latitude=result['latitude'][i], longitude=result['longitude'][i]))
+            assert moved['distance'] < 0.001
+
+        # A scalar distance and azimuth applied to a whole cloud
+        result = AsaGreatCircle.great_circle(distance=111000, azimuth=90, start_lats=lats[:10], start_lons=lons[:10])
+        assert (result['longitude'] > lons[:10]).all()
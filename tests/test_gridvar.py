@@ -0,0 +1,64 @@
+import unittest
+import netCDF4
+import numpy as np
+from paegan.cdm import gridvar
+from paegan.cdm.gridvar import Gridobj
+from paegan.location4d import Location4D
+from paegan.utils.asagreatcircle import AsaGreatCircle
+from fixtures import NetCDFTestCase, write_grid
+
+class GridobjTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(GridobjTest, self).setUp()
+        self.datafile = self.write(write_grid)
+        self.nc = netCDF4.Dataset(self.datafile)
+
+    def tearDown(self):
+        self.nc.close()
+        super(GridobjTest, self).tearDown()
+
+    def brute_force(self, grid, point):
+        distance = AsaGreatCircle.great_distance(start_lats=grid._yarray, start_lons=grid._xarray,
+                                                 end_lats=point.latitude, end_lons=point.longitude)["distance"]
+        return np.argsort(distance.ravel(), kind='mergesort')
+
+    def test_cgrid_near_xy(self):
+        grid = Gridobj(self.nc, "lon_rho", "lat_rho")
+        point = Location4D(latitude=38.5, longitude=-74.0)
+        yinds, xinds = grid.near_xy(point=point)
+        expected = np.unravel_index(self.brute_force(grid, point)[0], grid._xarray.shape)
+        assert yinds[0] == expected[0] and xinds[0] == expected[1]
+
+        # Several at once, nearest first
+        yinds, xinds = grid.near_xy(point=point, num=4)
+        flat = np.ravel_multi_index((yinds, xinds), grid._xarray.shape)
+        assert (flat == self.brute_force(grid, point)[:4]).all()
+
+    def test_ncell_near_xy(self):
+        grid = Gridobj(self.nc, "lon", "lat")
+        point = Location4D(latitude=40.0, longitude=-75.0)
+        inds, inds = grid.near_xy(point=point, ncell=True)
+        assert inds[0][0] == self.brute_force(grid, point)[0]
+
+        inds, inds = grid.near_xy(point=point, ncell=True, num=5)
+        assert (inds[0] == np.sort(self.brute_force(grid, point)[:5])).all()
+
+    def test_tree_reuse(self):
+        if gridvar.cKDTree is None:
+            return
+        grid = Gridobj(self.nc, "lon", "lat")
+        point = Location4D(latitude=40.0, longitude=-75.0)
+        grid.near_xy(point=point, ncell=True)
+        tree = grid.tree
+        grid.near_xy(point=Location4D(latitude=41.0, longitude=-76.0), ncell=True)
+        assert grid.tree is tree
+
+        # Mask out the nearest point, the next nearest should be found
+        nearest = self.brute_force(grid, point)
+        grid._xarray[nearest[0]] = np.nan
+        inds, inds = grid.near_xy(point=point, ncell=True)
+        assert inds[0][0] == nearest[1]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import threading
+import netCDF4
+import numpy as np
+from paegan.cdm.pool import HandlePool, LockedHandle, pool, read_lock
+from paegan.cdm.dataset import CommonDataset
+from fixtures import NetCDFTestCase, write_points
+
+class HandlePoolTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(HandlePoolTest, self).setUp()
+        self.files = [self.write(write_points, "pool%d.nc" % i) for i in range(4)]
+
+    def test_shared_handles(self):
+        hp = HandlePool(max_handles=2)
+        first = hp.acquire(self.files[0])
+        assert hp.acquire(self.files[0]) is first
+        assert hp.refcount(self.files[0]) == 2
+        hp.release(self.files[0])
+        assert hp.open_count == 1
+        hp.release(self.files[0])
+        assert hp.refcount(self.files[0]) == 0
+        # Closed once nobody holds it
+        assert hp.open_count == 0
+        assert hp.acquire(self.files[0]) is not first
+        hp.release(self.files[0])
+
+        # Unless idle handles are kept, until they are needed again
+        hp.max_idle = 1
+        first = hp.acquire(self.files[0])
+        hp.release(self.files[0])
+        assert hp.open_count == 1
+        assert hp.acquire(self.files[0]) is first
+        hp.release(self.files[0])
+        hp.close_idle()
+        assert hp.open_count == 0
+
+    def test_lru_eviction(self):
+        hp = HandlePool(max_handles=2, max_idle=2)
+        for path in self.files[:2]:
+            hp.acquire(path)
+        for path in self.files[:2]:
+            hp.release(path)
+        assert hp.open_count == 2
+
+        # files[0] is the least recently used idle handle, so it goes first
+        hp.acquire(self.files[2])
+        assert hp.open_count == 2
+        assert self.files[0] not in hp._handles
+        assert self.files[1] in hp._handles
+
+        # Handles in use are never closed
+        hp.acquire(self.files[3])
+        hp.max_handles = 1
+        assert hp.open_count == 2
+        assert self.files[1] not in hp._handles
+
+    def test_dataset_copies(self):
+        path = unicode(self.files[3])
+        pd = CommonDataset.open(path)
+        assert pool.refcount(path) == 1
+        copied = pd.restrict_vars("time").restrict_vars("lon")
+        assert copied.nc is pd.nc
+        assert pool.refcount(path) == 2
+        copied.closenc()
+        assert pool.refcount(path) == 1
+        pd.closenc()
+        assert pool.refcount(path) == 0
+        assert path not in pool._handles
+
+    def test_rewrite_after_close(self):
+        path = unicode(self.files[0])
+        pd = CommonDataset.open(path)
+        assert len(pd.gettimevar('time')) == 3
+        pd.closenc()
+        # The file isn't held open, so it can be written again
+        nc = netCDF4.Dataset(path, "w")
+        nc.createDimension("time", 5)
+        time = nc.createVariable("time", "f8", ("time",))
+        time.units = "hours since 2012-01-01 00:00:00"
+        time[:] = np.arange(5)
+        nc.createVariable("lon", "f8", ("time",))[:] = np.arange(5)
+        nc.createVariable("lat", "f8", ("time",))[:] = np.arange(5)
+        nc.close()
+        pd = CommonDataset.open(path)
+        assert len(pd.gettimevar('time')) == 5
+        pd.closenc()
+
+if __name__ == '__main__':
+    unittest.main()
+
+    def test_reads_hold_read_lock(self):
+        pd = CommonDataset.open(self.files[0])
+        assert isinstance(pd.nc, LockedHandle)
+        assert isinstance(pd.nc.variables['time'], LockedHandle)
+        held = threading.Event()
+        done = threading.Event()
+        def hold():
+            with read_lock:
+                held.set()
+                done.wait()
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        times = []
+        reader = threading.Thread(target=lambda: times.append(pd.gettimevar('time')))
+        reader.start()
+        # Waits for the lock, like a prefetch read would
+        reader.join(0.2)
+        assert times == []
+        done.set()
+        reader.join()
+        holder.join()
+        assert len(times[0]) == 3
+        pd.closenc()
@@ -0,0 +1,90 @@
+import unittest
+import netCDF4
+import numpy as np
+from paegan.cdm.cache import BlockCache
+from paegan.cdm.dataset import CommonDataset
+from fixtures import NetCDFTestCase, write_steps
+
+class PrefetchTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(PrefetchTest, self).setUp()
+        self.path = self.write(write_steps)
+
+    def test_read_ahead(self):
+        pd = CommonDataset.open(self.path)
+        full = pd.get_values('u')
+        cache = BlockCache()
+        pd.block_cache = cache
+        pd.start_prefetch(depth=2)
+
+        # The first read isn't sequential, the second one is
+        assert np.all(pd.get_values('u', timeinds=[np.array([0])]) == full[0:1])
+        pd._prefetcher.wait()
+        assert cache.block_count == 1
+        assert np.all(pd.get_values('u', timeinds=[np.array([1])]) == full[1:2])
+        pd._prefetcher.wait()
+        assert cache.block_count == 4
+
+        # Later steps are waiting in the cache
+        for t in range(2, 8):
+            hits = cache.hits
+            assert np.all(pd.get_values('u', timeinds=[np.array([t])]) == full[t:t+1])
+            assert cache.hits == hits + 1
+            pd._prefetcher.wait()
+        assert cache.block_count == 10
+
+        # Stepping back isn't read ahead of
+        cache.clear()
+        pd.get_values('u', timeinds=[np.array([3])])
+        pd._prefetcher.wait()
+        assert cache.block_count == 1
+        pd.closenc()
+        assert pd._prefetcher is None
+
+    def test_cancel_and_cap(self):
+        pd = CommonDataset.open(self.path)
+        cache = BlockCache()
+        pd.block_cache = cache
+        # Room for one step ahead at a time
+        pd.start_prefetch(depth=5, max_bytes=20 * 30 * 8)
+        pd.get_values('u', timeinds=[np.array([0])])
+        pd.get_values('u', timeinds=[np.array([1])])
+        pd._prefetcher.wait()
+        assert cache.block_count == 3
+
+        prefetcher = pd._prefetcher
+        pd.cancel_prefetch()
+        assert prefetcher._queue.empty()
+        pd.stop_prefetch()
+        assert prefetcher.stopped
+        assert not prefetcher._thread.is_alive()
+        pd.closenc()
+
+    def test_own_handle(self):
+        pd = CommonDataset.open(self.path)
+        full = pd.get_values('u')
+        pd.block_cache = BlockCache()
+        pd.start_prefetch()
+        pd.get_values('u', timeinds=[np.array([0])])
+        pd.get_values('u', timeinds=[np.array([1])])
+        prefetcher = pd._prefetcher
+        prefetcher.wait()
+        # The thread reads the file through a handle nobody else has
+        reader = prefetcher._reader
+        assert reader is not None
+        assert reader.nc is not pd.nc
+        assert np.all(pd.get_values('u', timeinds=[np.array([2])]) == full[2:3])
+        pd.stop_prefetch()
+        assert prefetcher._reader is None
+        assert reader.nc is None
+        pd.closenc()
+
+    def test_no_filename(self):
+        nc = netCDF4.Dataset(self.path)
+        pd = CommonDataset.open(nc)
+        # Nothing to open a second handle of
+        pd._filename = None
+        pd.start_prefetch()
+        assert pd._prefetcher is None
+        nc.close()
@@ -5,6 +5,8 @@ import math
 import netCDF4
 
 from paegan.roms import roms as rm
+from paegan.cdm.dataset import CommonDataset
+from fixtures import NetCDFTestCase, write_uv
 
 class RomsTest(unittest.TestCase):
 
@@ -54,6 +56,77 @@ class RomsTest(unittest.TestCase):
     
         assert np.allclose(a_avg,result_test)
 
+    def test_average_kernels(self):
+        rs = np.random.RandomState(3)
+        a = rs.normal(size=(4, 6, 9))
+        out = np.empty((4, 6, 8))
+        assert rm.average_adjacents(a, out=out) is out
+        assert np.allclose(out, 0.5 * (a[..., 1:] + a[..., :-1]))
+        assert np.allclose(rm.average_adjacents(a, True), 0.5 * (a[:, 1:, :] + a[:, :-1, :]))
+        self.assertRaises(ValueError, rm.average_adjacents, a, True, out)
+
+        # Masks are kept
+        masked = np.ma.masked_array(a[0], mask=a[0] > 1)
+        assert np.all(rm.average_adjacents(masked).mask == np.logical_or(masked.mask[:, 1:], masked.mask[:, :-1]))
+
+        # Blocks of rows on the thread pool give the same answer
+        size, workers, pool = rm._parallel_size, rm._workers, rm._pool
+        try:
+            rm._parallel_size, rm._workers = 0, 3
+            assert np.allclose(rm.average_adjacents(a), 0.5 * (a[..., 1:] + a[..., :-1]))
+            assert np.allclose(rm.average_adjacents(a[0], True), 0.5 * (a[0, 1:] + a[0, :-1]))
+            thread = rm.AverageAdjacents(a[0], True)
+            thread.start(); thread.join()
+            assert np.allclose(thread.data, 0.5 * (a[0, 1:] + a[0, :-1]))
+
+            # A single timestep is split along its levels
+            threads, blocks = rm._thread_pool(), []
+            class CountingPool(object):
+                def map(self, func, iterable):
+                    blocks.extend(iterable)
+                    return threads.map(func, blocks)
+            rm._pool = CountingPool()
+            one = rs.normal(size=(1, 3, 6, 9))
+            assert np.allclose(rm.average_adjacents(one), 0.5 * (one[..., 1:] + one[..., :-1]))
+            assert len(blocks) == 3
+            assert all(block[1].shape == (1, 1, 6, 8) for block in blocks)
+        finally:
+            rm._parallel_size, rm._workers = size, workers
+            rm._pool = pool
+
+    def test_shrink(self):
+        rs = np.random.RandomState(4)
+        a = rs.normal(size=(9, 10, 12))
+        shrunk = rm.shrink(a, (5, 7, 11))
+        expected = a[2:-2]
+        expected = 0.5 * (expected[:, 1:] + expected[:, :-1])[:, 1:-1]
+        expected = 0.5 * (expected[..., 1:] + expected[..., :-1])
+        assert shrunk.shape == (5, 7, 11)
+        assert np.allclose(shrunk, expected)
+        assert np.allclose(rm.shrink(np.arange(5.), 3), [1, 2, 3])
+        # 1D arrays are averaged once for every value too many
+        x = rs.normal(size=8)
+        expected = x
+        for i in range(3):
+            expected = 0.5 * (expected[1:] + expected[:-1])
+        assert np.array_equal(rm.shrink(x, 5), expected)
+        small, large = rm.shrink(a, rs.normal(size=(4, 12, 10)))
+        assert small.shape == large.shape == (4, 10, 10)
+
+    def test_average_onto_rho(self):
+        # Averaging u and v onto rho points, as the old threads and
+        # np.vectorize(complex) did (see benchmarks/average.py)
+        rs = np.random.RandomState(5)
+        u = rs.normal(size=(200, 199))
+        v = rs.normal(size=(199, 200))
+        old = np.vectorize(complex)((0.5 * (u[:, 0:-1] + u[:, 1:]))[1:-1, :],
+                                    (0.5 * (v[0:-1, :] + v[1:, :]))[:, 1:-1])
+
+        U = np.empty((198, 198), dtype=complex)
+        rm.average_adjacents(u[1:-1, :], out=U.real)
+        rm.average_adjacents(v[:, 1:-1], True, out=U.imag)
+        assert np.allclose(U, old)
+
     def test_angle_rotation(self):
         points = np.vectorize(complex)([-0.018,-0.013],[0.013,0.012])
         angles = np.array([-0.7,-0.3])
@@ -66,6 +139,23 @@ class RomsTest(unittest.TestCase):
 
         assert np.allclose(r,result_test)
 
+    def test_rotation(self):
+        rs = np.random.RandomState(8)
+        angles = rs.uniform(-1, 1, (4, 5))
+        u, v = rs.normal(size=(2, 3, 4, 5)), rs.normal(size=(2, 3, 4, 5))
+        rotation = rm.Rotation(angles)
+        east, north = rotation.rotate(u, v)
+        expected = rm.rotate_complex_by_angle(u + 1j * v, angles)
+        assert east.dtype == np.float64 and east.shape == (2, 3, 4, 5)
+        assert np.allclose(east, expected.real) and np.allclose(north, expected.imag)
+
+        # In place, and on part of the grid
+        part = rotation.subset(slice(1, 3), slice(0, 2))
+        assert part.shape == (2, 2)
+        pu, pv = u[..., 1:3, 0:2].copy(), v[..., 1:3, 0:2].copy()
+        assert part.rotate(pu, pv, east=pu, north=pv)[0] is pu
+        assert np.allclose(pu, east[..., 1:3, 0:2]) and np.allclose(pv, north[..., 1:3, 0:2])
+
     def test_uv_size(self):
         #URL = 'http://testbedapps-dev.sura.org/thredds/dodsC/alldata/Estuarine_Hypoxia/noaa/cbofs2/synoptic/Output_Avg/ocean_avg_synoptic_seg22.nc'
         URL = os.path.join(self.data_path, "ocean_avg_synoptic_seg22.nc")
@@ -122,5 +212,61 @@ class RomsTest(unittest.TestCase):
         # Why does the right point now work!!!?!?!?!?!?!?
         #assert right_rho == uv_rho[101,102]
 
+class LocalRomsTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(LocalRomsTest, self).setUp()
+        self.path = self.write(write_uv)
+
+    def test_uv_to_rho(self):
+        nc = netCDF4.Dataset(self.path)
+        u, v, angle = nc.variables['u'][:], nc.variables['v'][:], nc.variables['angle'][:]
+        nc.close()
+
+        pd = CommonDataset.open(self.path)
+        east, north = rm.uv_to_rho(pd, times=slice(1, 4), levels=[0, 2], chunk=2)
+        assert east.shape == north.shape == (3, 2, 8, 10)
+        assert np.isnan(east[:, :, 0, :]).all() and np.isnan(north[:, :, :, -1]).all()
+
+        # Worked out one point at a time
+        for t, z, r, c in [(1, 0, 1, 1), (3, 2, 6, 8), (2, 2, 3, 5)]:
+            U = complex(0.5 * (u[t, z, r, c-1] + u[t, z, r, c]), 0.5 * (v[t, z, r-1, c] + v[t, z, r, c]))
+            U = rm.rotate_complex_by_angle(U, angle[r, c])
+            ti, zi = [1, 2, 3].index(t), [0, 2].index(z)
+            assert np.allclose([east[ti, zi, r, c], north[ti, zi, r, c]], [U.real, U.imag])
+
+        # Streaming a timestep at a time gives the same answer
+        one_east, one_north = rm.uv_to_rho(pd, chunk=1)
+        assert one_east.shape == (5, 3, 8, 10)
+        assert np.allclose(one_east[1:4][:, [0, 2]], east, equal_nan=True)
+        assert np.allclose(one_north[1:4][:, [0, 2]], north, equal_nan=True)
+
+        # Or written straight to a file
+        output = os.path.join(self.tmpdir, "rho.nc")
+        assert rm.uv_to_rho(pd, times=[4], output=output) == output
+        out = netCDF4.Dataset(output)
+        assert out.variables['u_east'].dimensions == ('ocean_time', 's_rho', 'eta_rho', 'xi_rho')
+        assert out.variables['ocean_time'][:] == [4 * 3600]
+        assert np.allclose(out.variables['v_north'][0, :, 1:-1, 1:-1], one_north[4, :, 1:-1, 1:-1])
+        assert out.variables['u_east'][0, 0, 0, 0] is np.ma.masked
+        out.close()
+        pd.closenc()
+
+        # The angles are only read once per dataset, and its copies
+        pd = CommonDataset.open(self.path)
+        rotation = rm.get_rotation(pd)
+        assert np.allclose(rotation.cos, np.cos(angle))
+        assert rm.get_rotation(pd) is rotation
+        assert rm.get_rotation(pd.restrict_time((0, 1))) is rotation
+        pd.closenc()
+        # But read again from a file that may have changed
+        assert rm.get_rotation(self.path) is not rm.get_rotation(self.path)
+        assert np.allclose(rm.get_rotation(self.path).sin, np.sin(angle))
+
+        # A path gives the rotated first time and level
+        U = rm.uv_to_rho(self.path)
+        assert U.shape == (8, 10) and U.dtype == complex
+        assert np.allclose(U.real, one_east[0, 0], equal_nan=True)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
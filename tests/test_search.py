@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+from paegan.cdm.search import search, monotonic
+
+class SearchTest(unittest.TestCase):
+
+    def brute(self, values, target, select):
+        values = np.asarray(values, dtype=np.float64)
+        values = np.where(np.isnan(values), np.inf if select == 'before' else -np.inf, values)
+        if select == 'nearest':
+            return np.argmin(np.abs(values - target))
+        if select == 'before':
+            below = np.where(values <= target)[0]
+            return below[np.argmax(values[below])] if below.size else -1
+        above = np.where(values >= target)[0]
+        return above[np.argmin(values[above])] if above.size else values.size
+
+    def test_monotonic(self):
+        assert monotonic([1, 2, 2, 5]) == 1
+        assert monotonic([5, 3, 3, 0]) == -1
+        assert monotonic([1, 3, 2]) == 0
+        assert monotonic([1, np.nan, 3]) == 0
+
+    def test_against_brute_force(self):
+        rs = np.random.RandomState(7)
+        increasing = np.cumsum(rs.uniform(0.1, 2, 200))
+        for values in (increasing, increasing[::-1], rs.permutation(increasing),
+                       np.where(rs.uniform(size=200) < 0.1, np.nan, increasing)):
+            targets = rs.uniform(increasing[0] - 5, increasing[-1] + 5, 500)
+            for select in ('nearest', 'before', 'after'):
+                found = search(values, targets, select)
+                expected = [self.brute(values, t, select) for t in targets]
+                assert np.all(found == expected), (select, monotonic(values))
+
+    def test_bad_select(self):
+        self.assertRaises(ValueError, search, [1, 2, 3], [2], 'closest')
+        self.assertRaises(ValueError, search, [1, 3, 2], [2], 'closest')
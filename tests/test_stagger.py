@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+
+from paegan.roms import stagger as st
+from paegan.cdm.dataset import CommonDataset
+from fixtures import NetCDFTestCase, write_staggered
+
+class StaggerTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(StaggerTest, self).setUp()
+        rs = np.random.RandomState(6)
+        self.rho = rs.normal(size=(2, 3, 5, 6))
+
+    def test_onto_staggered_grids(self):
+        rho = self.rho
+        u = st.rho_to_u(rho)
+        v = st.rho_to_v(rho)
+        psi = st.rho_to_psi(rho)
+        assert (u.shape, v.shape, psi.shape) == ((2, 3, 5, 5), (2, 3, 4, 6), (2, 3, 4, 5))
+        assert np.allclose(u, 0.5 * (rho[..., 1:] + rho[..., :-1]))
+        assert np.allclose(v, 0.5 * (rho[..., 1:, :] + rho[..., :-1, :]))
+        assert np.allclose(psi, 0.25 * (rho[..., 1:, 1:] + rho[..., 1:, :-1] + rho[..., :-1, 1:] + rho[..., :-1, :-1]))
+        # Through u or v, or straight there
+        assert np.allclose(st.u_to_psi(u), psi)
+        assert np.allclose(st.v_to_psi(v), psi)
+        assert np.allclose(st.stagger(rho, "rho", "psi"), psi)
+
+        out = np.empty((2, 3, 5, 5))
+        assert st.stagger(rho, "rho", "u", out=out) is out
+        self.assertRaises(ValueError, st.rho_to_u, rho, np.empty((5, 5)))
+        self.assertRaises(ValueError, st.stagger, u, "u", "v")
+
+    def test_onto_rho(self):
+        rho = self.rho
+        back = st.u_to_rho(st.rho_to_u(rho))
+        assert back.shape == rho.shape
+        assert np.allclose(back[..., 1:-1], 0.25 * rho[..., :-2] + 0.5 * rho[..., 1:-1] + 0.25 * rho[..., 2:])
+        # The edges are copied from their neighbours
+        assert np.all(back[..., 0] == back[..., 1]) and np.all(back[..., -1] == back[..., -2])
+        assert st.v_to_rho(st.rho_to_v(rho)).shape == rho.shape
+        back = st.psi_to_rho(st.rho_to_psi(rho))
+        assert back.shape == rho.shape
+        assert np.all(back[..., 0, :] == back[..., 1, :]) and np.all(back[..., :, -1] == back[..., :, -2])
+
+        # Masked (land) cells spread to what they touch
+        masked = np.ma.masked_array(rho[0, 0], mask=np.zeros((5, 6), dtype=bool))
+        masked[2, 2] = np.ma.masked
+        u = st.rho_to_u(masked)
+        assert list(np.where(u.mask)[1]) == [1, 2]
+
+    def test_streaming(self):
+        path = self.write(write_staggered, "roms.nc")
+        pd = CommonDataset.open(path)
+        full = pd.get_values('u')
+        blocks = list(st.iter_staggered(pd, 'u', 'rho', times=slice(1, 6), chunk=2))
+        assert [list(tinds) for tinds, block in blocks] == [[1, 2], [3, 4], [5]]
+        assert blocks[0][1].shape == (2, 2, 5, 6)
+        assert np.allclose(np.concatenate([block for tinds, block in blocks]), st.u_to_rho(full[1:6]))
+
+        assert np.allclose(st.staggered(pd, 'u', 'psi', levels=[1], chunk=3), st.u_to_psi(full[:, [1]]))
+        # Variables without time come out in one piece
+        assert np.allclose(st.staggered(pd, 'h', 'u'), st.rho_to_u(np.arange(6.)[None, :] + 10. + np.zeros((5, 1))))
+        pd.closenc()
@@ -2,7 +2,9 @@ import unittest
 import os
 import netCDF4
 from datetime import timedelta, datetime, tzinfo
-from paegan.cdm.timevar import Timevar
+from paegan.cdm.timevar import Timevar, date2num
+import paegan.cdm.timevar
+from fixtures import NetCDFTestCase, write_times, write_char_times
 import numpy as np
 from dateutil.parser import parse
 import pytz
@@ -113,3 +115,75 @@ class TimevarTest(unittest.TestCase):
         assert (jds == tvar.dates).all()
 
         ds.close()
+
+
+class LocalTimevarTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(LocalTimevarTest, self).setUp()
+        self.path = self.write(write_times)
+        self.nc = netCDF4.Dataset(self.path)
+
+    def tearDown(self):
+        self.nc.close()
+        super(LocalTimevarTest, self).tearDown()
+
+    def test_units_per_instance(self):
+        seconds = Timevar(self.nc, name='time')
+        days = Timevar(self.nc, name='ocean_time')
+        assert (seconds._units, days._units) == ('seconds', 'days')
+        assert seconds.origin == datetime(1990, 1, 1)
+        assert days.origin == datetime(2005, 9, 20)
+        assert abs(seconds.dates[1] - datetime(1990, 1, 1, 0, 30, tzinfo=pytz.utc)) < timedelta(milliseconds=1)
+
+        # Slices keep them
+        part = days[10:20]
+        assert part._units == 'days' and part.origin == days.origin
+        assert abs(part.dates[0] - datetime(2005, 9, 22, 12, tzinfo=pytz.utc)) < timedelta(milliseconds=1)
+
+    def test_datenum(self):
+        tvar = Timevar(self.nc, name='time')
+        dates = tvar.dates
+        # Worked out without making datetimes, and only once
+        original = paegan.cdm.timevar.num2date
+        def fail(*args, **kwargs):
+            raise AssertionError("datetimes were made")
+        paegan.cdm.timevar.num2date = fail
+        try:
+            datenum = tvar.datenum
+            assert tvar.datenum is datenum
+            assert tvar[5:].datenum[0] == datenum[5]
+            assert tvar.nearest_index(datetime(1990, 1, 2, 0, 10, tzinfo=pytz.utc)) == [48]
+        finally:
+            paegan.cdm.timevar.num2date = original
+        assert datenum.dtype == np.float64
+        assert np.allclose(datenum, date2num(dates), rtol=0, atol=1e-9)
+
+    def test_nearest_index(self):
+        tvar = Timevar(self.nc, name='time')
+        assert tvar.order == 1
+        start = datetime(1990, 1, 1, tzinfo=pytz.utc)
+        targets = [start + timedelta(minutes=m) for m in (-20, 10, 20, 44, 45, 46, 600000)]
+        assert tvar.nearest_index(targets) == [0, 0, 1, 1, 1, 2, 999]
+        assert tvar.nearest_index(targets[1]) == [0]
+        assert list(tvar.nearest_index(targets, select='before')) == [-1, 0, 0, 1, 1, 1, 999]
+        assert list(tvar.nearest_index(targets, select='after')) == [0, 1, 1, 2, 2, 2, 1000]
+        assert tvar.nearest(targets[2]) == tvar.dates[1]
+
+    def test_char_times(self):
+        # Times is a fixed layout, odd isn't so it is parsed row by row
+        path = self.write(write_char_times)
+
+        expected = [datetime(2012, 2, 28, 22, tzinfo=pytz.utc), datetime(2012, 2, 29, 23, 30, tzinfo=pytz.utc),
+                    datetime(2012, 3, 1, 0, 0, 15, tzinfo=pytz.utc)]
+        nc = netCDF4.Dataset(path)
+        tvar = Timevar(nc, name='Times')
+        assert np.allclose(tvar.datenum, date2num(expected), rtol=0, atol=1e-8)
+        assert all(abs(d - e) < timedelta(milliseconds=1) for d, e in zip(tvar.dates, expected))
+
+        tvar = Timevar(nc, name='Times', units="hours since 2012-02-28 00:00:00")
+        assert np.allclose(tvar, [22, 47.5, 48 + 15 / 3600.])
+
+        tvar = Timevar(nc, name='odd')
+        assert np.allclose(tvar.datenum, date2num(expected), rtol=0, atol=1e-8)
+        nc.close()
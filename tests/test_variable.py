@@ -0,0 +1,16 @@
+import unittest
+import numpy as np
+from paegan.cdm.variable import Coordinates
+
+class CoordinatesTest(unittest.TestCase):
+
+    def test_array_coordinates(self):
+        # Coordinate arrays are compared with None by identity, not elementwise
+        coords = Coordinates()
+        assert str(coords) == ""
+        coords.add_z(np.arange(5.))
+        coords.add_time(np.arange(3.))
+        assert str(coords) == "[Z][T]"
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import netCDF4
+import numpy as np
+
+from paegan.roms.vertical import SCoordinate, s_levels, stretching, z_levels
+from fixtures import NetCDFTestCase, write_s_coordinate
+
+class VerticalTest(NetCDFTestCase):
+
+    def setUp(self):
+        super(VerticalTest, self).setUp()
+        self.path = self.write(write_s_coordinate, "roms.nc")
+        self.nc = netCDF4.Dataset(self.path)
+
+    def tearDown(self):
+        self.nc.close()
+        super(VerticalTest, self).tearDown()
+
+    def test_stretching(self):
+        s = s_levels(10, "w")
+        assert s.size == 11 and s[0] == -1 and s[-1] == 0
+        assert np.allclose(s_levels(2), [-0.75, -0.25])
+        # Every stretching runs from the bottom (-1) to the surface (0)
+        for vstretching in (1, 2, 3, 4):
+            C = stretching(s, vstretching, 5., 0.4)
+            assert np.allclose(C[[0, -1]], [-1, 0])
+            assert np.all(np.diff(C) > 0)
+        assert np.allclose(stretching(s, 1, 0., 0.), s)
+
+    def test_z_levels(self):
+        h = np.array([[20., 100.]])
+        s = s_levels(4, "w")
+        C = stretching(s, 4, 5., 0.4)
+        for vtransform in (1, 2):
+            z = z_levels(h, np.array([[1., 2.]]), s, C, 10., vtransform)
+            assert z.shape == (5, 1, 2)
+            # The w levels run from the bottom to the free surface
+            assert np.allclose(z[0], -h)
+            assert np.allclose(z[-1], [[1., 2.]])
+
+        # One point worked by hand
+        z0 = (10. * s[2] + 100. * C[2]) / (10. + 100.)
+        z = z_levels(h, np.zeros((3, 1, 2)) + 2., s, C, 10., 2)
+        assert z.shape == (3, 5, 1, 2)
+        assert np.allclose(z[1, 2, 0, 1], 2. + (2. + 100.) * z0)
+
+    def test_cached_timesteps(self):
+        levels = SCoordinate(self.nc, "s_rho", cache_steps=2)
+        assert (levels.size, levels.Vtransform, levels.hc, levels.time_varying) == (5, 1, 5., True)
+        z = levels.z(1)
+        assert z.shape == (5, 3, 4)
+        C = stretching(s_levels(5), 1, 3., 0.5)
+        assert np.allclose(z, z_levels(self.nc.variables['h'][:], self.nc.variables['zeta'][1], s_levels(5), C, 5., 1))
+        assert levels.z(1) is z
+        assert not z.flags.writeable
+        # Only the latest steps are kept
+        levels.z(2)
+        levels.z(3)
+        assert levels.z(1) is not z
+
+        # u points are between rho points
+        u = levels.z(1, (3, 3))
+        assert np.allclose(u, 0.5 * (z[:, :, 1:] + z[:, :, :-1]))
+        self.assertRaises(ValueError, levels.z, 1, (2, 2, 2))
+
+    def test_nearest_levels(self):
+        levels = SCoordinate(self.nc, "s_rho")
+        rows, cols = np.array([0, 2, 2]), np.array([0, 3, 3])
+        inds = levels.nearest_levels([1, 60, 60], [0, 0, 3], rows, cols)
+        expected = [np.argmin(np.abs(levels.z(t)[:, r, c] + d)) for d, t, r, c in zip([1, 60, 60], [0, 0, 3], rows, cols)]
+        assert list(inds) == expected
+        assert inds[0] == 4